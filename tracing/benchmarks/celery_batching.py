@@ -0,0 +1,99 @@
+import argparse
+import json
+import threading
+import time
+
+import harness
+from celery import Celery
+from celery.contrib.testing.worker import start_worker
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from common.celery_batching import BatchItemError, batched
+from common.celery_tracing import instrument_celery
+
+# End-to-end tasks/sec for printSum-sized tasks on the in-memory broker, one
+# message per call versus @batched, with header trace propagation on. The
+# clock runs from the first publish until the worker has executed every
+# call. Then checks that a failing call fails alone and that each call's
+# process/ span continues the trace it was sent from.
+
+app = Celery("batching_bench", broker="memory://", backend="cache+memory://")
+app.conf.update(task_acks_late=True, worker_hijack_root_logger=False,
+                broker_transport_options={"polling_interval": 0.01})
+
+done = threading.Semaphore(0)
+
+
+def add(full_payload):
+    task_payload = full_payload["task_payload"]
+    done.release()
+    if task_payload["x"] < 0:
+        raise ValueError("negative x")
+    return task_payload["x"] + task_payload["y"]
+
+
+single = app.task(name="bench.single", ignore_result=True)(add)
+batch = batched(app, max_items=100, window=0.05, name="bench.batched")(add)
+
+
+def payload(index):
+    return {"task_payload": {"x": index, "y": 2}, "name": "abc"}
+
+
+def throughput(task, count):
+    start = time.perf_counter()
+    for index in range(count):
+        task.delay(payload(index))
+    for _ in range(count):
+        done.acquire(timeout=60)
+    elapsed = time.perf_counter() - start
+    return {"tasks": count, "seconds": round(elapsed, 3), "tasks_per_second": round(count / elapsed, 1)}
+
+
+def check(exporter, tracer):
+    exporter.clear()
+    with tracer.start_as_current_span("request") as request:
+        results = [batch.delay(payload(index)) for index in (1, -1, 2)]
+    values = []
+    for result in results:
+        try:
+            values.append(result.get(timeout=10))
+        except BatchItemError as error:
+            values.append(f"error: {error}")
+    spans = [span for span in exporter.get_finished_spans() if span.name == "process/bench.batched"]
+    return {
+        "results": values,
+        "item_spans_in_request_trace": sum(span.context.trace_id == request.get_span_context().trace_id
+                                           for span in spans),
+        "item_spans_linked_to_batch": sum(bool(span.links) for span in spans),
+    }
+
+
+def run(count):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    instrument_celery()
+    results = {}
+    with start_worker(app, pool="solo", perform_ping_check=False, shutdown_timeout=30):
+        throughput(single, 100)
+        exporter.clear()
+        results["one_message_per_call"] = throughput(single, count)
+        exporter.clear()
+        results["batched"] = throughput(batch, count)
+        results["batched"]["messages"] = batch.published_batches
+        results["checks"] = check(exporter, trace.get_tracer(__name__))
+    speedup = results["batched"]["tasks_per_second"] / results["one_message_per_call"]["tasks_per_second"]
+    results["speedup"] = round(speedup, 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=5000)
+    args = parser.parse_args()
+    run(args.tasks)
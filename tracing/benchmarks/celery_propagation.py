@@ -0,0 +1,120 @@
+import argparse
+import json
+
+import harness
+from celery import Celery, chain, group
+from celery.contrib.testing.worker import start_worker
+from celery.signals import before_task_publish
+from opentelemetry import baggage, context, trace
+from opentelemetry.propagate import inject
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import SpanKind
+
+from common.celery_tracing import instrument_celery
+
+# Message size and publish throughput on the in-memory broker for three ways
+# of carrying the trace: a trace_context dict inside the task payload (the
+# old commented-out approach), the stock CeleryInstrumentor, and
+# common.celery_tracing. Then runs a worker thread to check that consumer
+# spans continue their producer for delay, chains and groups, and that
+# baggage arrives.
+
+PAYLOAD = {"task_payload": {"x": 4, "y": 2}, "name": "abc"}
+
+app = Celery("propagation_bench", broker="memory://", backend="cache+memory://")
+app.conf.update(worker_hijack_root_logger=False, broker_transport_options={"polling_interval": 0.01})
+seen_baggage = []
+
+
+@app.task(name="bench.work")
+def work(full_payload):
+    seen_baggage.append(baggage.get_baggage("tenant"))
+    return full_payload["task_payload"]["x"] + full_payload["task_payload"]["y"]
+
+
+sizes = []
+
+
+@before_task_publish.connect(weak=False)
+def measure(body=None, headers=None, **kwargs):
+    # Connected last, so it sees the headers after injection
+    sizes.append((len(json.dumps(body)), len(json.dumps(headers, default=str))))
+
+
+def publish_payload_context():
+    carrier = {}
+    inject(carrier)
+    work.delay(dict(PAYLOAD, trace_context=carrier))
+
+
+def publish_plain():
+    work.delay(PAYLOAD)
+
+
+def measure_mode(publish, count, tracer):
+    sizes.clear()
+    with tracer.start_as_current_span("request"):
+        stats = harness.time_calls(publish, count)
+    body = sum(size[0] for size in sizes) / len(sizes)
+    headers = sum(size[1] for size in sizes) / len(sizes)
+    return {"publish_p50_us": stats["p50_us"], "publishes_per_second": stats["rps"],
+            "body_bytes": round(body), "header_bytes": round(headers),
+            "message_bytes": round(body + headers)}
+
+
+def check_consumers(exporter, tracer):
+    # Drop the messages left by the throughput runs
+    app.control.purge()
+    exporter.clear()
+    seen_baggage.clear()
+    with start_worker(app, pool="solo", perform_ping_check=False, shutdown_timeout=10):
+        token = context.attach(baggage.set_baggage("tenant", "acme"))
+        with tracer.start_as_current_span("request"):
+            results = [work.delay(PAYLOAD),
+                       chain(work.si(PAYLOAD), work.si(PAYLOAD)).apply_async(),
+                       group(work.si(PAYLOAD), work.si(PAYLOAD)).apply_async()]
+        context.detach(token)
+        for result in results:
+            result.get(timeout=10)
+    spans = exporter.get_finished_spans()
+    producers = {span.context.span_id: span for span in spans if span.kind == SpanKind.PRODUCER}
+    consumers = [span for span in spans if span.kind == SpanKind.CONSUMER]
+    return {
+        "consumer_spans": len(consumers),
+        "consumers_parented_by_producer": all(
+            span.parent is not None and span.parent.span_id in producers for span in consumers),
+        "single_trace": len({span.context.trace_id for span in spans}) == 1,
+        "baggage_received": seen_baggage.count("acme"),
+    }
+
+
+def run(count):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    tracer = trace.get_tracer(__name__)
+
+    results = {"payload_trace_context": measure_mode(publish_payload_context, count, tracer)}
+
+    from opentelemetry.instrumentation.celery import CeleryInstrumentor
+
+    CeleryInstrumentor().instrument()
+    results["celery_instrumentor"] = measure_mode(publish_plain, count, tracer)
+    CeleryInstrumentor().uninstrument()
+
+    instrument_celery()
+    before_task_publish.disconnect(measure)
+    before_task_publish.connect(measure, weak=False)
+    results["message_headers"] = measure_mode(publish_plain, count, tracer)
+    results["message_headers"].update(check_consumers(exporter, tracer))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+    run(args.messages)
@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+
+# Benchmarks are run as scripts from anywhere; make the service modules importable
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "p50_us": round(percentile(latencies, 50) * 1e6, 1),
+        "p99_us": round(percentile(latencies, 99) * 1e6, 1),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def time_calls(call, count, warmup=50):
+    for _ in range(warmup):
+        call()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(count):
+        begin = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+class StubReceiver:
+    # Local stand-in for the OTLP/HTTP and Loki push endpoints. Accepts every
+    # POST with `status`, keeps the decompressed bodies, the byte count and
+    # the client addresses (one per connection). `latency` delays every
+    # answer; every `fail_every`-th request gets `fail_status` instead.
+    def __init__(self, status=200, port=0, latency=0.0, fail_every=0, fail_status=503):
+        import gzip
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        receiver = self
+        self.status = status
+        self.latency = latency
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.requests = 0
+        self.failed = 0
+        self.bodies = []
+        self.bytes = 0
+        self.clients = set()
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if receiver.latency:
+                    time.sleep(receiver.latency)
+                with receiver._lock:
+                    receiver.requests += 1
+                    if receiver.fail_every and receiver.requests % receiver.fail_every == 0:
+                        receiver.failed += 1
+                        status = receiver.fail_status
+                    else:
+                        status = receiver.status
+                    if status < 300:
+                        receiver.bytes += len(body)
+                        receiver.clients.add(self.client_address)
+                        if self.headers.get("Content-Encoding") == "gzip":
+                            body = gzip.decompress(body)
+                        receiver.bodies.append((self.path, body))
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def spans(self):
+        from opentelemetry.proto.collector.trace.v1.trace_service_pb2 import ExportTraceServiceRequest
+
+        spans = []
+        with self._lock:
+            bodies = list(self.bodies)
+        for path, body in bodies:
+            if path != "/v1/traces":
+                continue
+            request = ExportTraceServiceRequest()
+            request.ParseFromString(body)
+            for resource_spans in request.resource_spans:
+                for scope_spans in resource_spans.scope_spans:
+                    spans.extend(scope_spans.spans)
+        return spans
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
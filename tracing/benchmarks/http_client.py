@@ -0,0 +1,113 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+os.environ.setdefault("TRACING_EXPORTER", "none")
+
+import harness
+import requests
+from loguru import logger
+from opentelemetry import trace
+from opentelemetry.sdk.trace import SpanProcessor
+from opentelemetry.trace import SpanKind
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import testing_service
+from common.http_client import HttpClient
+
+# Outbound calls to the local /test service: a new connection per call (the
+# old requests.request path) against the pooled client, and four downstream
+# calls made one after another against fan_out(). Also checks that fanned
+# out client spans are children of the caller's span. --latency-ms stands in
+# for the network and downstream work of a real service.
+
+PAYLOAD = {"task_payload": {"x": 4, "y": 2}, "name": "abc"}
+
+
+class KeepAliveHandler(WSGIRequestHandler):
+    # Keep-alive, and no Nagle delay between werkzeug's header and body writes
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def delayed(app, seconds):
+    def wsgi(environ, start_response):
+        time.sleep(seconds)
+        return app(environ, start_response)
+
+    return wsgi
+
+
+class Collector(SpanProcessor):
+    def __init__(self):
+        self.spans = []
+
+    def on_end(self, span):
+        self.spans.append(span)
+
+
+def run(count, fan_out, latency):
+    # testing_service sets up tracing with the requests instrumentation
+    logger.remove()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    collector = Collector()
+    trace.get_tracer_provider().add_span_processor(collector)
+    server = make_server("127.0.0.1", 0, delayed(testing_service.app, latency), threaded=True,
+                         request_handler=KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/test"
+    client = HttpClient()
+    tracer = trace.get_tracer(__name__)
+
+    def new_connection():
+        requests.request("POST", url, headers={"Content-Type": "application/json"},
+                         data=json.dumps(PAYLOAD))
+
+    def pooled():
+        client.post(url, json=PAYLOAD)
+
+    def sequential():
+        with tracer.start_as_current_span("fan-out"):
+            for _ in range(fan_out):
+                client.post(url, json=PAYLOAD)
+
+    def concurrent():
+        with tracer.start_as_current_span("fan-out"):
+            client.fan_out([{"method": "POST", "url": url, "json": PAYLOAD}] * fan_out)
+
+    results = {
+        "latency_ms": latency * 1000,
+        "new_connection_per_call": harness.time_calls(new_connection, count),
+        "pooled": harness.time_calls(pooled, count),
+        f"sequential_x{fan_out}": harness.time_calls(sequential, count // fan_out),
+    }
+    collector.spans.clear()
+    results[f"fan_out_x{fan_out}"] = harness.time_calls(concurrent, count // fan_out)
+
+    by_id = {span.context.span_id: span for span in collector.spans}
+    clients = [span for span in collector.spans if span.kind == SpanKind.CLIENT]
+    servers = [span for span in collector.spans if span.kind == SpanKind.SERVER]
+    results["fan_out_client_spans_parented"] = all(
+        span.parent is not None and by_id.get(span.parent.span_id) is not None
+        and by_id[span.parent.span_id].name == "fan-out" for span in clients)
+    results["fan_out_server_spans_parented_by_client"] = all(
+        span.parent is not None and by_id.get(span.parent.span_id) in clients for span in servers)
+    server.shutdown()
+    client.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--fan-out", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    run(args.requests, args.fan_out, args.latency_ms / 1000)
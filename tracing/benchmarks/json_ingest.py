@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import harness
+
+# POST /test with JSON bodies from 1 KB to 100 MB, through the old handler
+# (request.data, .strip(), json.loads, whole payload logged) and the
+# streaming one (common/request_body.py). Each size and handler runs in a
+# fresh process: latency per request, and the peak RSS the requests add on
+# top of the process with the body already built. The log sink renders
+# record fields to JSON, as LokiSink does on its thread. The last row posts
+# 100 MB against the default cap.
+
+SIZES = {"1KB": 1024, "64KB": 64 * 1024, "1MB": 1024 ** 2, "10MB": 10 * 1024 ** 2, "100MB": 100 * 1024 ** 2}
+
+WORKER = """
+import json, resource, sys, time
+from flask import Flask
+from flask_restful import Resource, request
+from loguru import logger
+from common.exception import CoreApi
+from views.test import TestHandler
+
+size, handler, count = {size}, "{handler}", {count}
+
+def json_parse(obj_str=None):
+    if obj_str is not None and isinstance(obj_str, (str, bytes, bytearray)) and len(obj_str.strip())>0:
+        try:
+            return json.loads(obj_str)
+        except Exception:
+            return None
+    else:
+        return None
+
+class LegacyHandler(Resource):
+    def post(self):
+        a = json_parse(request.data)
+        logger.info("Getting payload to test", payload=a)
+        return "Test, World!"
+
+logger.remove()
+logger.add(lambda message: json.dumps(message.record["extra"], default=str), level="INFO")
+app = Flask(__name__)
+api = CoreApi(app, catch_all_404s=True)
+TestHandler.init(api)
+api.add_resource(LegacyHandler, "/legacy")
+client = app.test_client()
+
+record = b'{{"id":123456,"name":"item-abcdefgh","tags":["a","b","c"],"value":0.5,"ok":true}}'
+items = max(1, size // (len(record) + 1))
+body = b'{{"items":[' + b",".join([record] * items) + b']}}'
+path = "/legacy" if handler == "request_data" else "/test"
+client.post(path, data=b"{{}}", content_type="application/json")
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+latencies = []
+for _ in range(count):
+    start = time.perf_counter()
+    response = client.post(path, data=body, content_type="application/json")
+    latencies.append(time.perf_counter() - start)
+    status = response.status_code
+    del response
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+latencies.sort()
+print(json.dumps({{"status": status, "body_bytes": len(body), "p50_ms": round(latencies[len(latencies) // 2] * 1e3, 2),
+                   "peak_extra_mb": round((peak - before) / 1024, 1)}}))
+"""
+
+
+def run_one(size, handler, max_body_bytes):
+    count = max(1, min(200, (8 * 1024 ** 2) // size))
+    env = dict(os.environ, PYTHONPATH=harness.ROOT, MAX_BODY_BYTES=str(max_body_bytes))
+    code = WORKER.format(size=size, handler=handler, count=count)
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, check=True).stdout
+    return json.loads(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default=",".join(SIZES), help=f"comma separated, of {', '.join(SIZES)}")
+    args = parser.parse_args()
+    results = {}
+    for label in args.sizes.split(","):
+        # A cap above the largest body, so both handlers parse everything
+        results[label] = {handler: run_one(SIZES[label], handler, 128 * 1024 ** 2)
+                          for handler in ("request_data", "streaming")}
+    results["100MB_over_default_cap"] = {"streaming": run_one(SIZES["100MB"], "streaming", 16 * 1024 ** 2)}
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,116 @@
+import argparse
+import contextlib
+import io
+import json
+import time
+
+import harness  # noqa: F401
+from loguru import logger
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.trace import (INVALID_SPAN, INVALID_SPAN_CONTEXT, INVALID_SPAN_ID,
+                                 INVALID_TRACE_ID, get_current_span)
+
+from common.log_context import current_trace_ids, install_loguru
+
+# Log calls per second through loguru with the old per-record patcher and
+# with the shared enrichment layer, inside a recording span and outside any
+# span; plus the Cloud Logging trace/spanId strings built per record.
+
+PROJECT_ID = "example-project"
+
+
+def legacy_patcher(record):
+    # add_trace_context_to_loguru before the shared enrichment layer
+    print(f"In enrich_with_trace_info")
+    span = trace.get_current_span()
+    if not span:
+        return
+    span_context = span.get_span_context()
+    if not span_context:
+        return
+    if span_context.trace_id != INVALID_TRACE_ID:
+        record["extra"]["otel_trace_id"] = f"{span_context.trace_id:032x}"
+    else:
+        record["extra"]["otel_trace_id"] = None
+    if span_context.span_id != INVALID_SPAN_ID:
+        record["extra"]["otel_span_id"] = f"{span_context.span_id:016x}"
+    else:
+        record["extra"]["otel_span_id"] = None
+
+
+def legacy_patcher_without_print(record):
+    span_context = trace.get_current_span().get_span_context()
+    record["extra"]["otel_trace_id"] = f"{span_context.trace_id:032x}" if span_context.trace_id else None
+    record["extra"]["otel_span_id"] = f"{span_context.span_id:016x}" if span_context.span_id else None
+
+
+def legacy_cloud_ids():
+    # PatchedCloudLoggingHandler.emit before the shared enrichment layer
+    record_otelSpanID = None
+    record_otelTraceID = None
+    span = get_current_span()
+    if span != INVALID_SPAN:
+        ctx = span.get_span_context()
+        if ctx != INVALID_SPAN_CONTEXT:
+            record_otelSpanID = format(ctx.span_id, "016x")
+            record_otelTraceID = format(ctx.trace_id, "032x")
+    if record_otelTraceID is not None:
+        record_otelTraceID = f"projects/{PROJECT_ID}/traces/" + record_otelTraceID
+    if record_otelSpanID is not None:
+        record_otelSpanID = f"projects/{PROJECT_ID}/spanId/" + record_otelSpanID
+    return record_otelTraceID, record_otelSpanID
+
+
+def cloud_ids():
+    ids = current_trace_ids()
+    return ids.cloud(PROJECT_ID) if ids is not None else (None, None)
+
+
+def calls_per_second(call, count, in_span, tracer):
+    scope = tracer.start_as_current_span("request") if in_span else contextlib.nullcontext()
+    with scope:
+        for _ in range(200):
+            call()
+        start = time.perf_counter()
+        for _ in range(count):
+            call()
+        elapsed = time.perf_counter() - start
+    return round(count / elapsed)
+
+
+def run(count):
+    provider = TracerProvider()
+    tracer = provider.get_tracer(__name__)
+    trace.set_tracer_provider(provider)
+    logger.remove()
+    logger.add(lambda message: None, format="{time} {level} {message}", level="INFO")
+    log = lambda: logger.info("Getting payload to test")  # noqa: E731
+
+    patchers = {
+        "none": lambda: logger.configure(patcher=None),
+        "legacy": lambda: logger.configure(patcher=legacy_patcher),
+        "legacy_without_print": lambda: logger.configure(patcher=legacy_patcher_without_print),
+        "shared": install_loguru,
+    }
+    results = {"loguru_calls_per_second": {}, "cloud_ids_per_second": {}}
+    # The legacy patcher prints a line per record
+    with contextlib.redirect_stdout(io.StringIO()) as captured:
+        for name, install in patchers.items():
+            install()
+            results["loguru_calls_per_second"][name] = {
+                "in_span": calls_per_second(log, count, True, tracer),
+                "no_span": calls_per_second(log, count, False, tracer),
+            }
+            captured.seek(0)
+            captured.truncate()
+    for name, call in (("legacy", legacy_cloud_ids), ("shared", cloud_ids)):
+        results["cloud_ids_per_second"][name] = calls_per_second(call, count * 10, True, tracer)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=50000)
+    args = parser.parse_args()
+    run(args.calls)
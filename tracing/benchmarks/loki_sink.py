@@ -0,0 +1,84 @@
+import argparse
+import json
+import time
+
+import harness
+from loguru import logger
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+
+from common.log_context import install_loguru
+from common.logger import LokiSink
+
+# Loki sink throughput against a local stub push endpoint with the old
+# per-trace stream labels (log_level and otel_trace_id as labels) and the
+# fixed Resource-derived labels with IDs in the line.
+
+
+class LegacyLabelSink(LokiSink):
+    def _labels(self, record):
+        return tuple(self._fixed) + (
+            ("log_level", record["level"].name),
+            ("otel_trace_id", record["extra"].get("otel_trace_id") or "0" * 32),
+        )
+
+    _fixed = (("service", "example_service"), ("job", "bot_python"),
+              ("task_id", "2022-03-01"), ("type", "execution"))
+
+
+def run_sink(sink, receiver, records, per_trace):
+    tracer = trace.get_tracer(__name__)
+    handler = logger.add(sink, format="{time} {level} {message}", level="INFO")
+    receiver.bodies.clear()
+    receiver.bytes = 0
+    start = time.perf_counter()
+    for index in range(records // per_trace):
+        with tracer.start_as_current_span("request"):
+            for line in range(per_trace):
+                logger.info("Getting payload to test -> {}", index)
+    logged = time.perf_counter() - start
+    sink.flush(60)
+    delivered = time.perf_counter() - start
+    logger.remove(handler)
+    streams = []
+    lines = 0
+    for path, body in list(receiver.bodies):
+        push = json.loads(body)["streams"]
+        streams.append(len(push))
+        lines += sum(len(stream["values"]) for stream in push)
+    sink.close()
+    return {
+        "records": records,
+        "log_calls_per_second": round(records / logged),
+        "delivered_per_second": round(lines / delivered),
+        "lines_delivered": lines,
+        "pushes": len(streams),
+        "streams_per_push": round(sum(streams) / len(streams), 1) if streams else 0,
+        "bytes_sent": receiver.bytes,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--per-trace", type=int, default=4, help="log lines per trace")
+    args = parser.parse_args()
+
+    trace.set_tracer_provider(TracerProvider(resource=Resource.create(
+        {"service.name": "example_service", "service.namespace": "bot_python",
+         "deployment.environment": "bench"})))
+    install_loguru()
+    logger.remove()
+    receiver = harness.StubReceiver(status=204)
+    url = receiver.url + "/loki/api/v1/push"
+    try:
+        results = {
+            "trace_id_labels": run_sink(LegacyLabelSink(url=url), receiver, args.records, args.per_trace),
+            "resource_labels": run_sink(LokiSink(url=url), receiver, args.records, args.per_trace),
+            "structured_metadata": run_sink(LokiSink(url=url, structured_metadata=True), receiver,
+                                            args.records, args.per_trace),
+        }
+    finally:
+        receiver.close()
+    print(json.dumps(results, indent=2))
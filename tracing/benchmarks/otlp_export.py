@@ -0,0 +1,84 @@
+import argparse
+import json
+import time
+
+import harness
+from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+from common.otlp_export import OTLPExportProcessor
+
+# Spans/sec delivered and spans dropped by the default BatchSpanProcessor +
+# OTLPSpanExporter versus OTLPExportProcessor, against a local stub
+# OTLP/HTTP receiver that answers after --latency-ms and fails every
+# --fail-every-th request with 503. Spans are produced as fast as one
+# thread can for --seconds, then each pipeline gets --drain seconds to
+# deliver what it accepted.
+
+ATTRIBUTES = {"http.method": "GET", "http.route": "/hello/<name>", "http.status_code": 200,
+              "http.target": "/hello/abc", "net.host.name": "localhost", "celery.task_name": "printHello"}
+
+
+def pipelines(url):
+    endpoint = f"{url}/v1/traces"
+    return {
+        "batch_span_processor": lambda: BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)),
+        "export_engine": lambda: OTLPExportProcessor(endpoint, shutdown_timeout=30),
+    }
+
+
+def run_one(factory, receiver, seconds, drain):
+    processor = factory()
+    provider = TracerProvider()
+    provider.add_span_processor(processor)
+    tracer = provider.get_tracer(__name__)
+    produced = 0
+    start = time.perf_counter()
+    stop = start + seconds
+    while time.perf_counter() < stop:
+        for _ in range(100):
+            with tracer.start_as_current_span("GET /hello/<name>", attributes=ATTRIBUTES):
+                pass
+        produced += 100
+    produce_elapsed = time.perf_counter() - start
+    flush_start = time.perf_counter()
+    processor.force_flush(int(drain * 1000))
+    provider.shutdown()
+    elapsed = time.perf_counter() - start
+    delivered = len(receiver.spans())
+    telemetry = processor.telemetry.snapshot() if hasattr(processor, "telemetry") else None
+    return {
+        "produced": produced,
+        "produced_per_second": round(produced / produce_elapsed),
+        "delivered": delivered,
+        "dropped": produced - delivered,
+        "delivered_per_second": round(delivered / elapsed),
+        "drain_seconds": round(time.perf_counter() - flush_start, 2),
+        "wire_bytes_per_span": round(receiver.bytes / max(delivered, 1), 1),
+        "requests": receiver.requests,
+        "rejected_requests": receiver.failed,
+        # The engine's own account; BatchSpanProcessor keeps none
+        "dropped_by_reason": telemetry["dropped"] if telemetry else None,
+        "spooled": telemetry["events"].get("spooled", 0) if telemetry else None,
+        "export_requests": telemetry["export_seconds"]["count"] if telemetry else None,
+    }
+
+
+def run(seconds, drain, latency, fail_every):
+    results = {}
+    for name in ("batch_span_processor", "export_engine"):
+        receiver = harness.StubReceiver(latency=latency, fail_every=fail_every)
+        results[name] = run_one(pipelines(receiver.url)[name], receiver, seconds, drain)
+        receiver.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--drain", type=float, default=30)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--fail-every", type=int, default=0)
+    args = parser.parse_args()
+    run(args.seconds, args.drain, args.latency_ms / 1000, args.fail_every)
@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import harness
+
+# End-to-end cost of the tracing/logging setup on the two Flask services,
+# driven through the Flask test client. Each configuration runs in its own
+# interpreter since setup happens at import time:
+#
+#   uninstrumented  tracing disabled, no log enrichment, no Loki sink
+#   no_export       tracing, enrichment and span metrics, nothing exported
+#   otlp_export     as no_export, spans exported to a stub OTLP receiver
+#   loki_export     as no_export, logs shipped to a stub Loki receiver
+#
+# GET /hello/name runs its Celery tasks eagerly and calls POST /test on a
+# local server thread, so nothing leaves the machine. Output is JSON;
+# --baseline adds the change against a previous run's output.
+
+CONFIGS = ("uninstrumented", "no_export", "otlp_export", "loki_export")
+TEST_PAYLOAD = json.dumps({"task_payload": {"x": 4, "y": 2}, "name": "abc"})
+
+
+def environment(config, otlp, loki):
+    env = dict(os.environ, PYTHONPATH=harness.ROOT, TRACING_SAMPLING_RATE="1",
+               TRACING_OTLP_ENDPOINT=otlp.url + "/v1/traces", LOKI_URL=loki.url + "/loki/api/v1/push")
+    env.pop("LOKI_SPOOL_DIR", None)
+    if config == "uninstrumented":
+        env["TRACING_ENABLED"] = "false"
+    elif config == "otlp_export":
+        env["TRACING_EXPORTER"] = "otlp"
+    else:
+        env["TRACING_EXPORTER"] = "none"
+    return env
+
+
+def loki_lines(receiver):
+    with receiver._lock:
+        bodies = [body for path, body in receiver.bodies if path == "/loki/api/v1/push"]
+    return sum(len(stream["values"]) for body in bodies for stream in json.loads(body)["streams"])
+
+
+def allocations(call, count):
+    # Peak traced memory during one request, and what is still held after
+    # `count` of them
+    tracemalloc.start()
+    peaks = []
+    start = tracemalloc.get_traced_memory()[0]
+    for _ in range(count):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        call()
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    retained = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return {"alloc_peak_kib_p50": round(harness.percentile(peaks, 50) / 1024, 1),
+            "retained_bytes_per_request": round(retained / count, 1)}
+
+
+def worker(config, count, alloc_count, output):
+    import threading
+
+    from loguru import logger
+    from opentelemetry import trace
+    from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+    from werkzeug.serving import make_server
+
+    import grafana_celery_tracing
+    import testing_service
+    from celery_module.celery import app as celery_app
+    from common.logger import loki_filter, loki_sink
+
+    class SpanCounter(SpanProcessor):
+        def __init__(self):
+            self.ended = 0
+
+        def on_end(self, span):
+            self.ended += 1
+
+    log_count = [0]
+
+    def count_log(message):
+        log_count[0] += 1
+
+    # The app's own log calls go to a counting sink in every configuration;
+    # only loki_export keeps the Loki sink, and uninstrumented drops enrichment
+    logger.remove()
+    logger.add(count_log, format="{time} {level} {message}", level="INFO")
+    if config == "loki_export":
+        logger.add(loki_sink, format="{time} {level} {message}", level="INFO", filter=loki_filter)
+    if config == "uninstrumented":
+        logger.configure(patcher=None)
+    celery_app.conf.task_always_eager = True
+
+    provider = trace.get_tracer_provider()
+    counter = SpanCounter()
+    if isinstance(provider, TracerProvider):
+        provider.add_span_processor(counter)
+
+    server = make_server("127.0.0.1", 8081, testing_service.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    endpoints = {
+        "POST /test": lambda client: client.post("/test", data=TEST_PAYLOAD,
+                                                 headers={"Content-Type": "application/json"}),
+        "GET /hello/name": lambda client: client.get("/hello/name"),
+    }
+    apps = {"POST /test": testing_service.app, "GET /hello/name": grafana_celery_tracing.app}
+    results = {}
+    for endpoint, request in endpoints.items():
+        client = apps[endpoint].test_client()
+        call = lambda: request(client)  # noqa: E731
+        spans_before, logs_before = counter.ended, log_count[0]
+        stats = harness.time_calls(call, count)
+        requests_made = count + 50
+        if isinstance(provider, TracerProvider):
+            provider.force_flush()
+        if config == "loki_export":
+            loki_sink.flush(10)
+        stats["spans_per_request"] = round((counter.ended - spans_before) / requests_made, 2)
+        stats["logs_per_request"] = round((log_count[0] - logs_before) / requests_made, 2)
+        stats.update(allocations(call, alloc_count))
+        results[endpoint] = stats
+    server.shutdown()
+    with open(output, "w") as handle:
+        json.dump(results, handle)
+
+
+def run_config(config, count, alloc_count, otlp, loki):
+    otlp.bodies.clear()
+    loki.bodies.clear()
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        completed = subprocess.run(
+            [sys.executable, __file__, "--worker", config, "--requests", str(count),
+             "--alloc-requests", str(alloc_count), "--output", output.name],
+            env=environment(config, otlp, loki), cwd=harness.ROOT, capture_output=True, text=True)
+        if completed.returncode:
+            raise RuntimeError(f"{config} failed:\n{completed.stderr[-4000:]}")
+        with open(output.name) as handle:
+            results = json.load(handle)
+    # What the stubs received, averaged over every request of every endpoint
+    # (warmup and allocation pass included)
+    total = (count + 50 + alloc_count) * len(results)
+    spans, lines = len(otlp.spans()), loki_lines(loki)
+    results["exported"] = {"requests": total, "otlp_spans": spans, "loki_lines": lines,
+                           "otlp_spans_per_request": round(spans / total, 2),
+                           "loki_lines_per_request": round(lines / total, 2)}
+    return results
+
+
+def compare(results, baseline):
+    for config in CONFIGS:
+        for endpoint, stats in results.get(config, {}).items():
+            previous = baseline.get(config, {}).get(endpoint)
+            if not previous or endpoint == "exported":
+                continue
+            stats["change_pct"] = {
+                key: round((stats[key] - previous[key]) / previous[key] * 100, 1)
+                for key in ("p50_us", "p99_us", "rps", "alloc_peak_kib_p50")
+                if previous.get(key)
+            }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--alloc-requests", type=int, default=100)
+    parser.add_argument("--configs", default=",".join(CONFIGS))
+    parser.add_argument("--baseline", help="JSON output of a previous run to compare against")
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--worker", choices=CONFIGS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.requests, args.alloc_requests, args.output)
+        sys.exit(0)
+
+    otlp = harness.StubReceiver()
+    # LokiSink treats anything but 204 as a failed push
+    loki = harness.StubReceiver(status=204)
+    try:
+        results = {config: run_config(config, args.requests, args.alloc_requests, otlp, loki)
+                   for config in args.configs.split(",")}
+    finally:
+        otlp.close()
+        loki.close()
+    results["meta"] = {"requests": args.requests, "python": sys.version.split()[0],
+                       "timestamp": int(time.time())}
+    if args.baseline:
+        with open(args.baseline) as handle:
+            compare(results, json.load(handle))
+    rendered = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(rendered)
+    print(rendered)
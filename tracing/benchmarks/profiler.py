@@ -0,0 +1,79 @@
+import argparse
+import json
+import time
+
+import harness
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+
+from common.profiler import SpanProfiler
+
+# Cost and attribution of the span profiler. Two fake routes burn CPU in
+# different functions under their own spans; the same work is timed with
+# the profiler off and at several sampling rates, then the profile must put
+# each hot function under its own route. --max-overhead shows the runtime
+# cap stretching the interval when sampling gets expensive.
+
+
+def parse_digits(rounds):
+    total = 0
+    for index in range(rounds):
+        total += int(str(index * 7919)[-3:] or 0)
+    return total
+
+
+def hash_payload(rounds):
+    value = 0
+    for index in range(rounds):
+        value = (value * 31 + index) & 0xFFFFFFFF
+    return value
+
+
+def work(tracer, requests, rounds):
+    start = time.perf_counter()
+    for index in range(requests):
+        name, hot = ("GET /hello/<name>", parse_digits) if index % 2 else ("POST /test", hash_payload)
+        with tracer.start_as_current_span(name):
+            with tracer.start_as_current_span("handler"):
+                hot(rounds)
+    return time.perf_counter() - start
+
+
+def run(requests, rounds, rates, max_overhead):
+    results = {}
+    provider = TracerProvider()
+    baseline = min(work(provider.get_tracer(__name__), requests, rounds) for _ in range(3))
+    results["off"] = {"seconds": round(baseline, 3)}
+    for hz in rates:
+        provider = TracerProvider()
+        profiler = SpanProfiler(hz=hz, max_overhead=max_overhead)
+        provider.add_span_processor(profiler)
+        elapsed = min(work(provider.get_tracer(__name__), requests, rounds) for _ in range(3))
+        profiles = profiler.profiles()
+        profiler.close()
+
+        def share(route, function):
+            stacks = profiles.get(route, {})
+            hits = sum(count for stack, count in stacks.items() if stack.endswith(function))
+            return round(hits / max(sum(stacks.values()), 1), 2)
+
+        results[f"{hz:g}hz"] = {
+            "seconds": round(elapsed, 3),
+            "overhead_pct": round((elapsed / baseline - 1) * 100, 1),
+            "samples": profiler.samples,
+            "interval_ms": round(profiler.interval * 1000, 2),
+            "sample_cost_us": round(profiler._cost * 1e6, 1),
+            "hello_in_parse_digits": share("GET /hello/<name>", "parse_digits"),
+            "test_in_hash_payload": share("POST /test", "hash_payload"),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=20000)
+    parser.add_argument("--rates", type=float, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--max-overhead", type=float, default=0.01)
+    args = parser.parse_args()
+    run(args.requests, args.rounds, args.rates, args.max_overhead)
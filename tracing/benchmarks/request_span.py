@@ -0,0 +1,104 @@
+import argparse
+import json
+import logging
+import sys
+
+import harness
+from flask import Flask, request
+from opentelemetry import trace
+from opentelemetry.instrumentation.flask import FlaskInstrumentor
+from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from common.tracing import server_request_hook, server_response_hook
+
+# Compares the per-request cost of the old setup (FlaskInstrumentor plus the
+# hand-rolled before/after_request span) with the single instrumented span.
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+TRACEPARENT = f"00-{TRACE_ID}-00f067aa0ba902b7-01"
+
+
+class StartCounter(SpanProcessor):
+    # The legacy span is never ended, so only on_start sees it
+    def __init__(self):
+        self.started = 0
+
+    def on_start(self, span, parent_context=None):
+        self.started += 1
+
+
+def make_app(name):
+    app = Flask(name)
+
+    @app.route("/hello/<name>")
+    def hello(name):
+        return "Hello, World!"
+
+    return app
+
+
+def add_legacy_hooks(app, tracer):
+    @app.before_request
+    def start_span():
+        span_name = f"{request.method} {request.path}"
+        ctx = trace.set_span_in_context(trace.INVALID_SPAN)
+        span = tracer.start_span(span_name, context=ctx)
+        trace.use_span(span, end_on_exit=False)
+
+    @app.after_request
+    def end_span(response):
+        current_span = trace.get_current_span()
+        if current_span:
+            current_span.set_attribute("http.status_code", response.status_code)
+            current_span.end()
+        return response
+
+
+def run(count, budget_us):
+    # The legacy hooks end the instrumentor's span twice; keep that quiet
+    logging.getLogger("opentelemetry.sdk.trace").setLevel(logging.ERROR)
+    exporter = InMemorySpanExporter()
+    counter = StartCounter()
+    provider = TracerProvider()
+    provider.add_span_processor(counter)
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+    plain = make_app("plain")
+    legacy = make_app("legacy")
+    FlaskInstrumentor().instrument_app(legacy)
+    add_legacy_hooks(legacy, trace.get_tracer(__name__))
+    current = make_app("current")
+    FlaskInstrumentor().instrument_app(current, request_hook=server_request_hook,
+                                       response_hook=server_response_hook)
+
+    results = {}
+    for label, app in (("uninstrumented", plain), ("legacy", legacy), ("current", current)):
+        client = app.test_client()
+        exporter.clear()
+        counter.started = 0
+        stats = harness.time_calls(lambda: client.get("/hello/abc", headers={"traceparent": TRACEPARENT}), count)
+        spans = exporter.get_finished_spans()
+        stats["spans_started_per_request"] = round(counter.started / (count + 50), 2)
+        stats["spans_exported_per_request"] = round(len(spans) / (count + 50), 2)
+        stats["span_names"] = sorted({span.name for span in spans})
+        stats["honors_traceparent"] = bool(spans) and all(
+            f"{span.context.trace_id:032x}" == TRACE_ID for span in spans)
+        results[label] = stats
+
+    overhead = results["current"]["p50_us"] - results["uninstrumented"]["p50_us"]
+    results["current_overhead_p50_us"] = round(overhead, 1)
+    results["budget_us"] = budget_us
+    print(json.dumps(results, indent=2))
+    return overhead <= budget_us
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--budget-us", type=float, default=400.0,
+                        help="allowed p50 overhead of the request span over no instrumentation")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.requests, args.budget_us) else 1)
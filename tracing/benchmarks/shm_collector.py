@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import harness
+
+# N worker processes each finishing spans, exporting either through their own
+# BatchSpanProcessor/OTLP connection or through the shared-memory ring with
+# one elected drainer. Reports per-worker CPU (including export threads),
+# collector connections and spans received.
+
+WORKER = """
+import json, sys, time
+from opentelemetry import trace
+from common.tracing import setup_tracing
+provider = setup_tracing(service_name="bench", instrumentations=[])
+tracer = trace.get_tracer("bench")
+time.sleep({start_delay})
+cpu = time.process_time()
+for i in range({spans}):
+    with tracer.start_as_current_span("work") as span:
+        span.set_attribute("item", i)
+        span.set_attribute("celery.task_name", "tasks.printSum")
+provider.force_flush()
+cpu = time.process_time() - cpu
+# Keep the elected drainer around until the others have written their spans
+time.sleep({linger})
+provider.shutdown()
+print(json.dumps({{"cpu_s": cpu}}))
+"""
+
+
+def run_mode(exporter, workers, spans, receiver, ring_path):
+    env = dict(os.environ, PYTHONPATH=harness.ROOT, TRACING_EXPORTER=exporter,
+               TRACING_OTLP_ENDPOINT=receiver.url + "/v1/traces", TRACING_SHM_PATH=ring_path,
+               TRACING_SAMPLING_RATE="1")
+    receiver.bodies.clear()
+    receiver.clients.clear()
+    processes = []
+    for index in range(workers):
+        # The first worker starts earlier and stays last, so it is the drainer
+        code = WORKER.format(spans=spans, start_delay=0 if index == 0 else 0.5,
+                             linger=2.0 if index == 0 else 0)
+        processes.append(subprocess.Popen([sys.executable, "-c", code], env=env, stdout=subprocess.PIPE))
+        if index == 0:
+            time.sleep(0.3)
+    cpu = [json.loads(process.communicate()[0])["cpu_s"] for process in processes]
+    time.sleep(0.2)
+    return {
+        "worker_cpu_median_ms": round(statistics.median(cpu) * 1e3, 1),
+        "worker_cpu_total_ms": round(sum(cpu) * 1e3, 1),
+        "collector_connections": len(receiver.clients),
+        "spans_received": len(receiver.spans()),
+        "spans_sent": workers * spans,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--spans", type=int, default=5000)
+    args = parser.parse_args()
+    receiver = harness.StubReceiver()
+    ring_path = os.path.join(tempfile.mkdtemp(), "bench-ring")
+    try:
+        results = {exporter: run_mode(exporter, args.workers, args.spans, receiver, ring_path)
+                   for exporter in ("otlp", "shm")}
+    finally:
+        receiver.close()
+        for suffix in ("", ".drain.lock"):
+            if os.path.exists(ring_path + suffix):
+                os.unlink(ring_path + suffix)
+    print(json.dumps(results, indent=2))
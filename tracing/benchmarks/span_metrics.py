@@ -0,0 +1,64 @@
+import argparse
+import json
+
+import harness
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import ParentBasedTraceIdRatio
+
+from common.log_context import current_trace_ids
+from common.metrics import SpanMetricsProcessor
+from common.sampling import RecordingSampler
+
+# Per-request cost of span metrics at several head sampling rates. A
+# request is a server span, a child span started only under a recording
+# span (as trace_function does) and a log enrichment lookup. With span
+# metrics on, RecordingSampler turns every dropped span into a RECORD_ONLY
+# one: the share of requests taking the recording path stays at 1.
+
+
+class NullExporter(SpanExporter):
+    def export(self, spans):
+        return SpanExportResult.SUCCESS
+
+
+def run(rate, span_metrics, count):
+    sampler = ParentBasedTraceIdRatio(rate)
+    if span_metrics:
+        sampler = RecordingSampler(sampler)
+    provider = TracerProvider(sampler=sampler)
+    if span_metrics:
+        provider.add_span_processor(SpanMetricsProcessor())
+    provider.add_span_processor(BatchSpanProcessor(NullExporter()))
+    tracer = provider.get_tracer(__name__)
+    recording = 0
+
+    def request():
+        nonlocal recording
+        with tracer.start_as_current_span("GET /hello/<name>") as span:
+            if span.is_recording():
+                recording += 1
+                span.set_attribute("http.route", "/hello/<name>")
+            if trace.get_current_span().is_recording():
+                with tracer.start_as_current_span("work"):
+                    current_trace_ids()
+            else:
+                current_trace_ids()
+
+    result = harness.time_calls(request, count, warmup=0)
+    result["recording_share"] = round(recording / count, 3)
+    provider.shutdown()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--rates", default="1,0.1,0.01,0")
+    args = parser.parse_args()
+    results = {}
+    for rate in args.rates.split(","):
+        results[f"rate_{rate}"] = {mode: run(float(rate), mode == "span_metrics", args.count)
+                                   for mode in ("off", "span_metrics")}
+    print(json.dumps(results, indent=2))
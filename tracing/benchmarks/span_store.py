@@ -0,0 +1,95 @@
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import harness
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import ConsoleSpanExporter, SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from common.span_store import FileSpanExporter, SpanStore, compact_store
+
+# Cost of exporting the same spans to the file span store and through
+# ConsoleSpanExporter (into a discarded buffer), per batch as the
+# BatchSpanProcessor would call them, then query times on the resulting
+# store: load the index, fetch one trace tree, the slowest spans of a name
+# and an attribute filter.
+
+ATTRIBUTES = {"http.method": "GET", "http.route": "/hello/<name>", "http.target": "/hello/abc",
+              "net.host.name": "localhost"}
+
+
+def make_spans(traces):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = provider.get_tracer(__name__)
+    for index in range(traces):
+        with tracer.start_as_current_span("GET /hello/<name>", attributes=ATTRIBUTES) as span:
+            span.set_attribute("http.status_code", 500 if index % 100 == 0 else 200)
+            with tracer.start_as_current_span("apply_async/tasks.printHello"):
+                pass
+            with tracer.start_as_current_span("redis GET"):
+                pass
+    return exporter.get_finished_spans()
+
+
+def time_export(exporter, spans, batch_size):
+    start = time.perf_counter()
+    for index in range(0, len(spans), batch_size):
+        exporter.export(spans[index:index + batch_size])
+    elapsed = time.perf_counter() - start
+    exporter.shutdown()
+    return {"spans_per_second": round(len(spans) / elapsed), "us_per_span": round(elapsed / len(spans) * 1e6, 2)}
+
+
+def timed(call):
+    start = time.perf_counter()
+    result = call()
+    return result, round((time.perf_counter() - start) * 1e3, 2)
+
+
+def run(traces, batch_size, segment_size):
+    spans = make_spans(traces)
+    directory = tempfile.mkdtemp(prefix="span-store-bench-")
+    try:
+        console = time_export(ConsoleSpanExporter(out=io.StringIO()), spans, batch_size)
+        store = time_export(FileSpanExporter(directory, segment_size=segment_size, compact=False), spans,
+                            batch_size)
+        on_disk = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        store["bytes_per_span"] = round(on_disk / len(spans), 1)
+        store["segments"] = sum(name.endswith(".spans") for name in os.listdir(directory))
+
+        reader, load_ms = timed(lambda: SpanStore(directory))
+        trace_id = spans[len(spans) // 2].context.trace_id
+        tree, trace_ms = timed(lambda: reader.trace_tree(trace_id))
+        _, slowest_ms = timed(lambda: reader.slowest("redis GET", 10))
+        errors, find_ms = timed(lambda: reader.find({"http.status_code": 500}, name="GET /hello/<name>",
+                                                    limit=1000))
+        merged, compact_ms = timed(lambda: compact_store(directory, segment_size * 4))
+        queries = {
+            "index_load_ms": load_ms,
+            "trace_tree_ms": trace_ms,
+            "trace_spans": sum(1 + len(children) for _, children in tree),
+            "slowest_10_ms": slowest_ms,
+            "find_status_500_ms": find_ms,
+            "find_matches": len(errors),
+            "compact_ms": compact_ms,
+            "segments_merged": merged,
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {"spans": len(spans), "console_exporter": console, "file_span_store": store, "queries": queries}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--traces", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--segment-size", type=int, default=4 * 1024 * 1024)
+    args = parser.parse_args()
+    print(json.dumps(run(args.traces, args.batch_size, args.segment_size), indent=2))
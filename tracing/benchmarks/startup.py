@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import harness
+
+# Cold-start cost of tracing setup in a fresh interpreter: the eager imports
+# every setup module used to do, against the lazy bootstrap selecting only
+# what a given process needs.
+
+LEGACY = """
+from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+from opentelemetry.instrumentation.flask import FlaskInstrumentor
+from opentelemetry.instrumentation.grpc import GrpcInstrumentorServer
+from opentelemetry.instrumentation.requests import RequestsInstrumentor
+from opentelemetry.instrumentation.urllib import URLLibInstrumentor
+from opentelemetry.instrumentation.celery import CeleryInstrumentor
+from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import ParentBasedTraceIdRatio
+from opentelemetry import trace
+provider = TracerProvider(sampler=ParentBasedTraceIdRatio(1),
+                          resource=Resource.create({SERVICE_NAME: "bench"}))
+trace.set_tracer_provider(provider)
+provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint="http://localhost:4318/v1/traces")))
+FlaskInstrumentor().instrument()
+RequestsInstrumentor().instrument()
+URLLibInstrumentor().instrument()
+GrpcInstrumentorServer().instrument()
+CeleryInstrumentor().instrument()
+"""
+
+BOOTSTRAP = """
+from common.tracing import setup_tracing
+setup_tracing(service_name="bench", instrumentations={instrumentations!r})
+"""
+
+SCENARIOS = {
+    "legacy_eager": (LEGACY, {}),
+    "bootstrap_web": (BOOTSTRAP.format(instrumentations=["flask", "requests"]), {}),
+    "bootstrap_celery_worker": (BOOTSTRAP.format(instrumentations=["celery"]), {}),
+    "bootstrap_no_export": (BOOTSTRAP.format(instrumentations=["celery"]), {"TRACING_EXPORTER": "none"}),
+    "python_baseline": ("pass", {}),
+}
+
+
+def measure(code, env, runs):
+    env = dict(os.environ, PYTHONPATH=harness.ROOT, **env)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return {"median_ms": round(statistics.median(timings) * 1e3, 1),
+            "min_ms": round(min(timings) * 1e3, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps({name: measure(code, env, args.runs) for name, (code, env) in SCENARIOS.items()},
+                     indent=2))
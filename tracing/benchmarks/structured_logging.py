@@ -0,0 +1,81 @@
+import argparse
+import json
+import time
+
+import harness
+from loguru import logger
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.sampling import ALWAYS_OFF, ALWAYS_ON
+
+import common.logger as loki
+from common.log_context import install_loguru
+from common.log_sampling import TraceAwareLogFilter
+
+# Cost of logging a large nested payload as an eager f-string against
+# passing it as a structured field, on the calling thread and until the
+# Loki stub has it; both for records that ship (sampled trace) and records
+# the trace-aware filter drops (unsampled trace).
+
+
+def payload(items):
+    return {
+        "task_payload": {"x": 4, "y": 2},
+        "name": "abc",
+        "items": [{"id": index, "tags": ["a", "b", "c"], "meta": {"score": index / 3, "ok": True}}
+                  for index in range(items)],
+    }
+
+
+def run_case(style, sampled, data, count, receiver, fast_json):
+    loki.orjson = fast_json
+    sink = loki.LokiSink(url=receiver.url + "/loki/api/v1/push")
+    handler = logger.add(sink, format="{time} {level} {message}", level="INFO",
+                         filter=TraceAwareLogFilter(rate_limit=None))
+    provider = TracerProvider(sampler=ALWAYS_ON if sampled else ALWAYS_OFF)
+    tracer = provider.get_tracer(__name__)
+    receiver.bodies.clear()
+    receiver.bytes = 0
+    calls = []
+    start = time.perf_counter()
+    for _ in range(count):
+        with tracer.start_as_current_span("request"):
+            begin = time.perf_counter()
+            if style == "f_string":
+                logger.info(f"Sending payload to queue -> {data}")
+            else:
+                logger.info("Sending payload to queue", payload=data)
+            calls.append(time.perf_counter() - begin)
+    sink.flush(120)
+    delivered = time.perf_counter() - start
+    logger.remove(handler)
+    sink.close()
+    return {
+        "caller_p50_us": round(harness.percentile(calls, 50) * 1e6, 1),
+        "end_to_end_ms": round(delivered * 1e3, 1),
+        "bytes_sent": receiver.bytes,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=2000, help="entries in the nested payload")
+    parser.add_argument("--count", type=int, default=200)
+    args = parser.parse_args()
+
+    install_loguru()
+    logger.remove()
+    data = payload(args.items)
+    fast_json = loki.orjson
+    receiver = harness.StubReceiver(status=204)
+    results = {"payload_json_bytes": len(json.dumps(data)), "orjson_available": fast_json is not None}
+    try:
+        for sampled in (True, False):
+            for style in ("f_string", "fields"):
+                key = f"{style}_{'sampled' if sampled else 'unsampled'}"
+                results[key] = run_case(style, sampled, data, args.count, receiver, fast_json)
+                if style == "fields" and sampled and fast_json is not None:
+                    results[key + "_stdlib_json"] = run_case(style, sampled, data, args.count, receiver, None)
+    finally:
+        receiver.close()
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,79 @@
+import argparse
+import json
+import time
+from functools import wraps
+
+import harness
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.sampling import ALWAYS_OFF, ALWAYS_ON
+
+from decorators import trace_function
+
+# Per-call cost of @trace_function against an undecorated call and the
+# previous implementation (tracer looked up and a span started on every
+# call), with no span in context, under an unsampled parent and under a
+# sampled parent with no exporter.
+
+
+def old_trace_function(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = trace.get_tracer(__name__)
+            with tracer.start_as_current_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add(x, y):
+    return x + y
+
+
+VARIANTS = {
+    "undecorated": add,
+    "old": old_trace_function("add")(add),
+    "new": trace_function("add")(add),
+    "new_capture": trace_function("add", capture_args=True, capture_result=True)(add),
+}
+
+
+def per_call_ns(func, count):
+    best = None
+    for _ in range(3):
+        start = time.perf_counter_ns()
+        for index in range(count):
+            func(index, 1)
+        elapsed = (time.perf_counter_ns() - start) / count
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best)
+
+
+def run(count):
+    results = {}
+    sampled = TracerProvider(sampler=ALWAYS_ON)
+    unsampled = TracerProvider(sampler=ALWAYS_OFF)
+    trace.set_tracer_provider(sampled)
+    contexts = {
+        "no_span": None,
+        "unsampled_parent": unsampled.get_tracer(__name__),
+        "sampled_parent": sampled.get_tracer(__name__),
+    }
+    for label, parent_tracer in contexts.items():
+        row = {}
+        for name, func in VARIANTS.items():
+            if parent_tracer is None:
+                row[name] = per_call_ns(func, count)
+            else:
+                with parent_tracer.start_as_current_span("parent"):
+                    row[name] = per_call_ns(func, count)
+        results[label] = {f"{name}_ns": value for name, value in row.items()}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+    run(args.calls)
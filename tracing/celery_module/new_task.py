@@ -1,12 +1,16 @@
 from celery_module.celery import app
+from common.celery_batching import batched
 from loguru import logger
 
 
 
 
-@app.task(bind=True)
-def printSum(self, full_payload):
+# printHello sends one of these per request; they travel to the sum queue
+# in batches of up to 100 calls or 50 ms
+@batched(app, max_items=100, window=0.05)
+def printSum(full_payload):
     task_payload = full_payload['task_payload']
     x, y = task_payload['x'], task_payload['y']
     z = x + y
-    logger.info({"sum": f"sum is : {z}"})
+    logger.info("Sum computed", sum=z)
+    return z
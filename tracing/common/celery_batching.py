@@ -0,0 +1,224 @@
+import atexit
+import functools
+import os
+import threading
+import time
+
+from opentelemetry import context, trace
+from opentelemetry.propagate import extract, inject
+from opentelemetry.trace import Link, Status, StatusCode
+
+from common import lifecycle
+
+# Opt-in micro-batching for high-rate tiny tasks. @batched(app) turns a plain
+# function into a producer-side buffer in front of one Celery task that runs
+# a whole batch: .delay() appends the call and returns at once, and the
+# buffer is published as a single message when it holds `max_items` calls or
+# `window` seconds after its first one.
+#
+# Each call keeps its own trace: its context is captured at .delay() and the
+# function runs for it under a process/<name> span that continues the
+# caller's trace and links to the batch. The batch/<name> span that publishes
+# the message links back to every call it carries. An exception fails only
+# its own call; the batch returns one [ok, result or error] per call, in
+# order, and BatchItemResult.get() reads a call's entry (with a result
+# backend). A batch whose publish fails is not retried: each of its calls
+# gets the error, counted in failed_batches/failed_items.
+#
+# Calls buffered but not yet published are lost if the process dies without
+# a clean shutdown, a trade for fewer broker round-trips; keep the window
+# short.
+
+MAX_LINKS = 128  # the SDK's default span link limit
+
+_tracer = trace.get_tracer(__name__)
+
+
+class BatchItemError(Exception):
+    pass
+
+
+class BatchItemResult:
+    __slots__ = ("_published", "_batch", "error", "index")
+
+    def __init__(self, index):
+        self._published = threading.Event()
+        self._batch = None
+        self.error = None
+        self.index = index
+
+    def _set(self, batch, error=None):
+        self._batch = batch
+        self.error = error
+        self._published.set()
+
+    @property
+    def published(self):
+        return self._published.is_set() and self.error is None
+
+    def get(self, timeout=None):
+        if not self._published.wait(timeout):
+            raise TimeoutError("batch not published yet")
+        if self.error is not None:
+            raise BatchItemError(f"publish failed: {type(self.error).__name__}: {self.error}")
+        ok, value = self._batch.get(timeout=timeout)[self.index]
+        if not ok:
+            raise BatchItemError(value)
+        return value
+
+
+class BatchedTask:
+    def __init__(self, app, fun, name=None, max_items=100, window=0.05, **task_options):
+        self.fun = fun
+        self.name = name or f"{fun.__module__}.{fun.__name__}"
+        self.max_items = max_items
+        self.window = window
+        # A name of its own: old single-call messages and batch messages
+        # must not meet the same task signature during a rollout
+        def run_batch(items):
+            return self._run_batch(items)
+
+        self.task = app.task(name=f"{self.name}.batch", **task_options)(run_batch)
+        self._reset()
+        atexit.register(self.close)
+        functools.update_wrapper(self, fun)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._items = []
+        self._results = []
+        self._deadline = None
+        self._thread = None
+        self._closed = False
+        self.published_batches = 0
+        self.published_items = 0
+        self.failed_batches = 0
+        self.failed_items = 0
+
+    def reinit(self):
+        # A forked child must not publish the calls its parent buffered
+        if self._pid != os.getpid():
+            self._reset()
+
+    def __call__(self, *args, **kwargs):
+        return self.fun(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        return self.apply_async(args, kwargs)
+
+    def apply_async(self, args=None, kwargs=None):
+        carrier = {}
+        inject(carrier)
+        item = (list(args or ()), dict(kwargs or {}), carrier)
+        if self._pid != os.getpid():
+            self.reinit()
+        with self._lock:
+            result = BatchItemResult(len(self._items))
+            self._items.append(item)
+            self._results.append(result)
+            if len(self._items) >= self.max_items or self._closed:
+                batch = self._take()
+            else:
+                batch = None
+                if self._deadline is None:
+                    self._deadline = time.monotonic() + self.window
+                    if self._thread is None or not self._thread.is_alive():
+                        self._start()
+                    self._wakeup.notify()
+        if batch is not None:
+            self._publish(*batch)
+        return result
+
+    def _take(self):
+        # Caller holds the lock
+        batch = (self._items, self._results)
+        self._items = []
+        self._results = []
+        self._deadline = None
+        return batch
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name=f"batch-{self.name}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed and (self._deadline is None or time.monotonic() < self._deadline):
+                    timeout = None if self._deadline is None else self._deadline - time.monotonic()
+                    self._wakeup.wait(timeout)
+                if self._closed:
+                    return
+                batch = self._take()
+            self._publish(*batch)
+
+    def _publish(self, items, results):
+        if not items:
+            return
+        links = []
+        for _, _, carrier in items[:MAX_LINKS]:
+            span_context = trace.get_current_span(extract(carrier)).get_span_context()
+            if span_context.is_valid:
+                links.append(Link(span_context))
+        # Outside any caller's context: the batch belongs to all its calls
+        token = context.attach(context.Context())
+        try:
+            with _tracer.start_as_current_span(f"batch/{self.name}", links=links) as span:
+                span.set_attribute("celery.batch_size", len(items))
+                batch = self.task.apply_async((items,))
+        except Exception as error:
+            # Broker down, unserializable arguments: the span has the
+            # exception, the calls get it, the publisher thread carries on
+            with self._lock:
+                self.failed_batches += 1
+                self.failed_items += len(items)
+            for result in results:
+                result._set(None, error)
+            return
+        finally:
+            context.detach(token)
+        with self._lock:
+            self.published_batches += 1
+            self.published_items += len(items)
+        for result in results:
+            result._set(batch)
+
+    def flush(self):
+        if self._pid != os.getpid():
+            self.reinit()
+        with self._lock:
+            batch = self._take()
+        self._publish(*batch)
+
+    def close(self, timeout=5):
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+            batch = self._take()
+        self._publish(*batch)
+
+    def _run_batch(self, items):
+        # Worker side; the current span is the batch's run/ span
+        batch_link = [Link(trace.get_current_span().get_span_context())]
+        results = []
+        for args, kwargs, carrier in items:
+            with _tracer.start_as_current_span(f"process/{self.name}", context=extract(carrier), links=batch_link,
+                                               record_exception=False, set_status_on_exception=False) as span:
+                try:
+                    results.append([True, self.fun(*args, **kwargs)])
+                except Exception as error:
+                    span.record_exception(error)
+                    span.set_status(Status(StatusCode.ERROR, f"{type(error).__name__}: {error}"))
+                    results.append([False, f"{type(error).__name__}: {error}"])
+        return results
+
+
+def batched(app, max_items=100, window=0.05, name=None, **task_options):
+    def decorator(fun):
+        return lifecycle.register(BatchedTask(app, fun, name, max_items, window, **task_options))
+
+    return decorator
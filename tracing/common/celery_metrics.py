@@ -0,0 +1,221 @@
+import threading
+import time
+
+from celery.worker import state
+from celery.worker.request import Request
+from opentelemetry import trace
+
+from common.metrics import REGISTRY, Histogram, start_http_server
+
+# Where the time of a Celery task goes, per queue:
+#   queue wait     enqueued by the producer -> received by a worker
+#   prefetch wait  received -> started by the pool
+#   execution      started -> finished
+#   unacked        received -> acknowledged; with task_acks_late this is how
+#                  long the message holds one of the worker's prefetch slots
+# The producer stamps `enqueued_at` into the message headers. The worker's
+# main process receives, dispatches and acknowledges the messages of every
+# pool type, so the histograms are recorded there by TimedRequest, which also
+# passes `received_at` on to the process running the task for its span. A
+# QueueSampler thread in the worker reads the broker's queue depth and the
+# worker's prefetch occupancy every `interval` seconds.
+#
+# Execution ends when the pool reports back; the main process sees that only
+# for failures and for acks_late tasks (their acknowledgement), so tasks that
+# ack early have no execution sample there. Their run/<task> span still has
+# the duration: execution ends when the span does. Ack and unacked times are
+# metrics only, with no span attribute; the acknowledgement happens in the
+# main process, apart from the span and often after it ended.
+
+WAIT_BUCKETS = (0.005, 0.025, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+QUEUE_WAIT = Histogram("celery_queue_wait_seconds", "Time from publish to a worker receiving the task",
+                       ("queue", "task"), WAIT_BUCKETS)
+PREFETCH_WAIT = Histogram("celery_prefetch_wait_seconds",
+                          "Time a received task waited in the worker's prefetch buffer", ("queue", "task"),
+                          WAIT_BUCKETS)
+EXECUTION = Histogram("celery_execution_seconds", "Task execution time seen by the worker",
+                      ("queue", "task"))
+UNACKED = Histogram("celery_unacked_seconds", "Time from a worker receiving a task to acknowledging it",
+                    ("queue", "task"), WAIT_BUCKETS)
+
+
+def _queue(delivery_info):
+    return (delivery_info or {}).get("routing_key") or "unknown"
+
+
+class TimedRequest(Request):
+    # Task.Request for the worker's main process; see instrument_celery_metrics
+    def __init__(self, message, *args, **kwargs):
+        super().__init__(message, *args, **kwargs)
+        self.received_at = time.time()
+        self.finished_at = None
+        # Sent to the pool with the request, read back as task.request.received_at
+        self.request_dict["received_at"] = self.received_at
+
+    def _labels(self):
+        return _queue(self.delivery_info), self.name
+
+    def on_accepted(self, pid, time_accepted):
+        super().on_accepted(pid, time_accepted)
+        labels = self._labels()
+        enqueued_at = self.request_dict.get("enqueued_at")
+        if enqueued_at is not None:
+            # Producer and worker clocks may disagree by a little
+            QUEUE_WAIT.observe(max(self.received_at - enqueued_at, 0.0), *labels)
+        PREFETCH_WAIT.observe(max(self.time_start - self.received_at, 0.0), *labels)
+
+    def on_failure(self, exc_info, send_failed_event=True, return_ok=False):
+        self.finished_at = time.time()
+        return super().on_failure(exc_info, send_failed_event, return_ok)
+
+    def acknowledge(self):
+        if not self.acknowledged:
+            now = time.time()
+            labels = self._labels()
+            UNACKED.observe(now - self.received_at, *labels)
+            if self.time_start is not None and self.task.acks_late:
+                EXECUTION.observe(max((self.finished_at or now) - self.time_start, 0.0), *labels)
+        super().acknowledge()
+
+
+class QueueSampler:
+    def __init__(self, app, queues=None, interval=15.0):
+        self.app = app
+        self.queues = list(queues) if queues else None
+        self.interval = interval
+        self.consumer = None
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._depth = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, consumer=None):
+        self.consumer = consumer
+        if self.queues is None:
+            if consumer is not None and consumer.task_consumer is not None:
+                self.queues = [queue.name for queue in consumer.task_consumer.queues]
+            else:
+                self.queues = list(self.app.amqp.queues)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="celery-queue-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def sample(self):
+        depth = {}
+        try:
+            with self.app.connection_for_read() as connection:
+                channel = connection.default_channel
+                for queue in self.queues or ():
+                    _, messages, consumers = channel.queue_declare(queue=queue, passive=True)
+                    depth[queue] = (messages, consumers)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self._depth = depth
+
+    def prefetch(self):
+        # Messages delivered to this worker and not yet acknowledged, per
+        # queue: reserved includes the active ones
+        reserved = {}
+        active = {}
+        for request in list(state.reserved_requests):
+            queue = _queue(request.delivery_info)
+            reserved[queue] = reserved.get(queue, 0) + 1
+        for request in list(state.active_requests):
+            queue = _queue(request.delivery_info)
+            active[queue] = active.get(queue, 0) + 1
+        limit = self.consumer.qos.value if self.consumer is not None and self.consumer.qos else 0
+        return reserved, active, limit
+
+    def collect(self):
+        with self._lock:
+            depth = dict(self._depth)
+            errors = self.errors
+        reserved, active, limit = self.prefetch()
+        occupancy = sum(reserved.values()) / limit if limit else 0.0
+        return [
+            ("celery_queue_messages", "gauge", "Messages ready in the broker queue",
+             [({"queue": queue}, messages) for queue, (messages, _) in sorted(depth.items())]),
+            ("celery_queue_consumers", "gauge", "Consumers attached to the broker queue",
+             [({"queue": queue}, consumers) for queue, (_, consumers) in sorted(depth.items())]),
+            ("celery_queue_sample_errors_total", "counter", "Failed queue depth samples", [({}, errors)]),
+            ("celery_worker_reserved_tasks", "gauge", "Tasks delivered to this worker and not yet finished",
+             [({"queue": queue}, count) for queue, count in sorted(reserved.items())]),
+            ("celery_worker_active_tasks", "gauge", "Tasks executing in this worker",
+             [({"queue": queue}, count) for queue, count in sorted(active.items())]),
+            ("celery_worker_prefetch_limit", "gauge", "Unacknowledged messages the worker may hold",
+             [({}, limit)]),
+            ("celery_worker_prefetch_occupancy", "gauge", "Reserved tasks over the prefetch limit",
+             [({}, occupancy)]),
+        ]
+
+
+def _before_publish(headers=None, **kwargs):
+    if headers is not None:
+        headers["enqueued_at"] = time.time()
+
+
+def _prerun(task=None, **kwargs):
+    # Runs after the tracing prerun, so the current span is run/<task>
+    span = trace.get_current_span()
+    if task is None or not span.is_recording():
+        return
+    request = task.request
+    started_at = time.time()
+    span.set_attribute("celery.started_at", started_at)
+    received_at = getattr(request, "received_at", None)
+    enqueued_at = getattr(request, "enqueued_at", None)
+    if enqueued_at is not None:
+        span.set_attribute("celery.enqueued_at", enqueued_at)
+    if received_at is not None:
+        span.set_attribute("celery.received_at", received_at)
+        span.set_attribute("celery.prefetch_wait_seconds", max(started_at - received_at, 0.0))
+        if enqueued_at is not None:
+            span.set_attribute("celery.queue_wait_seconds", max(received_at - enqueued_at, 0.0))
+
+
+_sampler = None
+
+
+def instrument_celery_metrics(app, queues=None, interval=15.0, port=None):
+    # Call after tracing is set up. `port` serves the metrics from a worker,
+    # which has no /metrics route of its own.
+    global _sampler
+    from celery.signals import before_task_publish, task_prerun, worker_ready, worker_shutdown
+
+    if _sampler is not None:
+        return _sampler
+    sampler = _sampler = QueueSampler(app, queues, interval)
+    app.Task.Request = TimedRequest
+    for histogram in (QUEUE_WAIT, PREFETCH_WAIT, EXECUTION, UNACKED):
+        REGISTRY.register(histogram.collect)
+    REGISTRY.register(sampler.collect)
+
+    def on_worker_ready(sender=None, **kwargs):
+        sampler.start(sender)
+        if port:
+            start_http_server(port)
+
+    def on_worker_shutdown(**kwargs):
+        sampler.close()
+
+    before_task_publish.connect(_before_publish, weak=False, dispatch_uid="common.celery_metrics.publish")
+    task_prerun.connect(_prerun, weak=False, dispatch_uid="common.celery_metrics.prerun")
+    worker_ready.connect(on_worker_ready, weak=False, dispatch_uid="common.celery_metrics.ready")
+    worker_shutdown.connect(on_worker_shutdown, weak=False, dispatch_uid="common.celery_metrics.shutdown")
+    return sampler
@@ -0,0 +1,200 @@
+import threading
+from functools import wraps
+
+from opentelemetry import context, trace
+from opentelemetry.propagate import extract, inject
+from opentelemetry.propagators.textmap import Getter
+from opentelemetry.trace import Link, SpanKind, Status, StatusCode
+
+# Trace context and baggage travel in the Celery message headers, never in
+# the task arguments. Publishing a task (delay, apply_async, and every task
+# a chain, group or chord sends, including those sent from inside a running
+# task) opens an apply_async/<task> PRODUCER span and injects it into the
+# headers; the worker extracts it and runs the task under a run/<task>
+# CONSUMER span. By default the consumer is a child of the producer; with
+# link_only=True it starts its own trace with a link to the producer, for
+# flows where one trace per request would grow unbounded.
+#
+# after_task_publish does not fire when publishing raises (broker down).
+# Celery.send_task is wrapped to end the producer spans of a failed publish
+# with the error, and at most MAX_PUBLISHING spans are kept open in any case.
+
+MAX_PUBLISHING = 10000
+
+_publishing = {}
+# Message IDs published by the send_task call running on this thread
+_local = threading.local()
+_running = {}
+_options = {"link_only": False}
+_installed = False
+
+_tracer = trace.get_tracer(__name__)
+
+
+class _RequestGetter(Getter):
+    # Custom message headers end up as attributes of task.request
+    def get(self, carrier, key):
+        value = getattr(carrier, key, None)
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return [value]
+        return list(value)
+
+    def keys(self, carrier):
+        return []
+
+
+_getter = _RequestGetter()
+
+
+def _before_publish(sender=None, headers=None, routing_key=None, **kwargs):
+    if headers is None or "id" not in headers:
+        return
+    task_name = headers.get("task") or sender
+    span = _tracer.start_span(f"apply_async/{task_name}", kind=SpanKind.PRODUCER)
+    if span.is_recording():
+        span.set_attribute("celery.action", "apply_async")
+        span.set_attribute("celery.task_name", task_name)
+        span.set_attribute("messaging.system", "celery")
+        span.set_attribute("messaging.message.id", headers["id"])
+        if routing_key:
+            span.set_attribute("messaging.destination.name", routing_key)
+    inject(headers, context=trace.set_span_in_context(span))
+    if len(_publishing) >= MAX_PUBLISHING:
+        # The oldest was never ended by after_task_publish or send_task
+        oldest = _publishing.pop(next(iter(_publishing), None), None)
+        if oldest is not None:
+            _end_failed(oldest)
+    _publishing[headers["id"]] = span
+    pending = getattr(_local, "pending", None)
+    if pending is not None:
+        pending.append(headers["id"])
+
+
+def _after_publish(headers=None, **kwargs):
+    span = _publishing.pop((headers or {}).get("id"), None)
+    if span is not None:
+        span.end()
+
+
+def _end_failed(span, error=None):
+    if span.is_recording():
+        if error is None:
+            span.set_status(Status(StatusCode.ERROR, "Publish not confirmed"))
+        else:
+            span.record_exception(error)
+            span.set_status(Status(StatusCode.ERROR, f"{type(error).__name__}: {error}"))
+    span.end()
+
+
+def _traced_send_task(send_task):
+    @wraps(send_task)
+    def wrapper(*args, **kwargs):
+        pending = getattr(_local, "pending", None)
+        outer = pending is None
+        if outer:
+            pending = _local.pending = []
+        mark = len(pending)
+        try:
+            return send_task(*args, **kwargs)
+        except BaseException as error:
+            for message_id in pending[mark:]:
+                span = _publishing.pop(message_id, None)
+                if span is not None:
+                    _end_failed(span, error)
+            raise
+        finally:
+            if outer:
+                _local.pending = None
+            else:
+                del pending[mark:]
+
+    return wrapper
+
+
+def _prerun(task_id=None, task=None, **kwargs):
+    if task is None:
+        return
+    request = task.request
+    links = None
+    if getattr(request, "traceparent", None) is None:
+        # Eager call or a message from an uninstrumented producer: the task
+        # runs inside whatever context is current
+        parent = None
+    else:
+        parent = extract(request, getter=_getter)
+        if _options["link_only"]:
+            links = [Link(trace.get_current_span(parent).get_span_context())]
+            # Keep the baggage, start a new trace
+            parent = trace.set_span_in_context(trace.INVALID_SPAN, parent)
+    span = _tracer.start_span(f"run/{task.name}", context=parent, kind=SpanKind.CONSUMER, links=links)
+    if span.is_recording():
+        span.set_attribute("celery.action", "run")
+        span.set_attribute("celery.task_name", task.name)
+        span.set_attribute("messaging.system", "celery")
+        span.set_attribute("messaging.message.id", task_id)
+        delivery = getattr(request, "delivery_info", None) or {}
+        if delivery.get("routing_key"):
+            span.set_attribute("messaging.destination.name", delivery["routing_key"])
+    token = context.attach(trace.set_span_in_context(span, parent))
+    _running[task_id] = (span, token)
+
+
+def _failure(task_id=None, exception=None, **kwargs):
+    entry = _running.get(task_id)
+    if entry is not None and exception is not None:
+        span = entry[0]
+        span.record_exception(exception)
+        span.set_status(Status(StatusCode.ERROR, f"{type(exception).__name__}: {exception}"))
+
+
+def _postrun(task_id=None, state=None, **kwargs):
+    entry = _running.pop(task_id, None)
+    if entry is None:
+        return
+    span, token = entry
+    if state is not None and span.is_recording():
+        span.set_attribute("celery.state", state)
+    context.detach(token)
+    span.end()
+
+
+def _signals():
+    from celery.signals import after_task_publish, before_task_publish, task_failure, task_postrun, task_prerun
+
+    return [
+        (before_task_publish, _before_publish, "common.celery_tracing.publish"),
+        (after_task_publish, _after_publish, "common.celery_tracing.published"),
+        (task_prerun, _prerun, "common.celery_tracing.prerun"),
+        (task_failure, _failure, "common.celery_tracing.failure"),
+        (task_postrun, _postrun, "common.celery_tracing.postrun"),
+    ]
+
+
+def instrument_celery(link_only=False, tracer_provider=None):
+    # `tracer_provider` defaults to the global one
+    global _installed, _tracer
+    from celery import Celery
+
+    _options["link_only"] = link_only
+    if _installed:
+        return
+    _tracer = trace.get_tracer(__name__, tracer_provider=tracer_provider)
+    for signal, receiver, dispatch_uid in _signals():
+        signal.connect(receiver, weak=False, dispatch_uid=dispatch_uid)
+    _options["send_task"] = Celery.send_task
+    Celery.send_task = _traced_send_task(Celery.send_task)
+    _installed = True
+
+
+def uninstrument_celery():
+    global _installed
+    from celery import Celery
+
+    if not _installed:
+        return
+    for signal, receiver, dispatch_uid in _signals():
+        signal.disconnect(receiver, dispatch_uid=dispatch_uid)
+    Celery.send_task = _options.pop("send_task")
+    _installed = False
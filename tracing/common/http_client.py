@@ -0,0 +1,155 @@
+import contextvars
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from retry.api import retry_call
+from opentelemetry.propagate import inject
+
+from common import lifecycle
+
+# Outbound HTTP for services set up through common/tracing.py: one keep-alive
+# session and connection pool per host, default timeouts, retries of
+# idempotent calls on connection errors and 502/503/504, and the trace
+# context injected once. When the requests instrumentation is active it
+# creates the client span and injects the headers itself; otherwise the
+# client injects them.
+#
+# fan_out() runs several calls at once on a thread pool. Each call runs in a
+# copy of the caller's context, so its span is a child of the caller's span
+# instead of a new root.
+
+DEFAULT_TIMEOUT = (2.0, 10.0)  # connect, read
+RETRY_STATUSES = frozenset({502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+def _requests_instrumented():
+    module = sys.modules.get("opentelemetry.instrumentation.requests")
+    return module is not None and module.RequestsInstrumentor().is_instrumented_by_opentelemetry
+
+
+class HttpClient:
+    def __init__(self, timeout=DEFAULT_TIMEOUT, tries=3, delay=0.1, backoff=2, max_delay=2.0,
+                 pool_size=10, max_workers=8, retry_methods=IDEMPOTENT_METHODS):
+        self.timeout = timeout
+        self.tries = tries
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.pool_size = pool_size
+        self.max_workers = max_workers
+        self.retry_methods = frozenset(method.upper() for method in retry_methods)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._executor = None
+
+    def reinit(self):
+        # Sockets and pool threads belong to the parent after a fork
+        if self._pid != os.getpid():
+            self._reset()
+
+    def close(self, timeout=5):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            executor = self._executor
+            self._sessions = {}
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        for session in sessions:
+            session.close()
+
+    def _session(self, url):
+        if self._pid != os.getpid():
+            self.reinit()
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount(f"{parts.scheme}://", adapter)
+                    self._sessions[key] = session
+        return session
+
+    def request(self, method, url, headers=None, timeout=None, **kwargs):
+        method = method.upper()
+        headers = dict(headers or {})
+        if not _requests_instrumented():
+            inject(headers)
+        session = self._session(url)
+        timeout = timeout or self.timeout
+
+        def attempt():
+            response = session.request(method, url, headers=headers, timeout=timeout, **kwargs)
+            if response.status_code in RETRY_STATUSES:
+                raise _RetryableStatus(response)
+            return response
+
+        tries = self.tries if method in self.retry_methods else 1
+        try:
+            return retry_call(attempt, exceptions=(requests.ConnectionError, requests.Timeout, _RetryableStatus),
+                              tries=tries, delay=self.delay, backoff=self.backoff,
+                              max_delay=self.max_delay, jitter=(0, self.delay), logger=None)
+        except _RetryableStatus as error:
+            return error.response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def _pool(self):
+        if self._pid != os.getpid():
+            self.reinit()
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="http-fan-out")
+        return self._executor
+
+    def fan_out(self, calls, return_exceptions=False):
+        # `calls` are request() keyword arguments, e.g.
+        # [{"method": "POST", "url": url, "json": payload}, ...]. Results come
+        # back in the same order; with return_exceptions=True a failed call
+        # yields its exception instead of raising the first one.
+        pool = self._pool()
+        futures = [pool.submit(contextvars.copy_context().run, self.request, **call) for call in calls]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as error:
+                if not return_exceptions:
+                    raise
+                results.append(error)
+        return results
+
+    async def afan_out(self, calls, return_exceptions=False):
+        # asyncio flavour; to_thread copies the current context itself
+        import asyncio
+
+        return await asyncio.gather(*(asyncio.to_thread(self.request, **call) for call in calls),
+                                    return_exceptions=return_exceptions)
+
+
+client = lifecycle.register(HttpClient())
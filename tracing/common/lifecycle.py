@@ -0,0 +1,63 @@
+# Export pipelines that keep threads, sockets or files must be rebuilt in a
+# forked child (prefork Celery pool, gunicorn/uwsgi workers) and flushed when
+# a worker exits. Components register here; each one also checks the pid on
+# its hot path, so a missed hook only delays the rebuild to the next record.
+_components = []
+
+
+def register(component):
+    # `component` needs reinit() and close(timeout); registering it again
+    # does not add its hooks twice
+    if not any(registered is component for registered in _components):
+        _components.append(component)
+    return component
+
+
+def after_fork():
+    for component in _components:
+        component.reinit()
+
+
+def shutdown(timeout=5):
+    for component in _components:
+        try:
+            component.close(timeout)
+        except Exception:
+            pass
+
+
+def _on_worker_process_init(**kwargs):
+    after_fork()
+
+
+def _on_worker_process_shutdown(**kwargs):
+    shutdown()
+
+
+def install_celery_hooks():
+    from celery.signals import worker_process_init, worker_process_shutdown
+
+    worker_process_init.connect(_on_worker_process_init, weak=False)
+    worker_process_shutdown.connect(_on_worker_process_shutdown, weak=False)
+
+
+def install_uwsgi_hooks():
+    # uwsgi forks from C, so os.register_at_fork callbacks never run there
+    try:
+        import uwsgi
+        from uwsgidecorators import postfork
+    except ImportError:
+        return False
+    postfork(after_fork)
+    uwsgi.atexit = shutdown
+    return True
+
+
+# gunicorn server hooks: `from common.lifecycle import post_fork, worker_exit`
+# in gunicorn.conf.py
+def post_fork(server, worker):
+    after_fork()
+
+
+def worker_exit(server, worker):
+    shutdown()
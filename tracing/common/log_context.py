@@ -0,0 +1,85 @@
+import contextvars
+import logging
+
+from opentelemetry.trace import get_current_span
+
+# Trace context for log records, shared by the loguru patcher and stdlib
+# logging handlers. The hex IDs of the active span are formatted once and
+# cached in a contextvar next to the span they belong to, so every further
+# record logged under that span reuses the same strings. Records logged
+# outside a recording span get no IDs and cost one context lookup.
+
+
+class TraceIds:
+    __slots__ = ("span", "trace_id", "span_id", "_project", "_cloud")
+
+    def __init__(self, span, context):
+        self.span = span
+        self.trace_id = f"{context.trace_id:032x}"
+        self.span_id = f"{context.span_id:016x}"
+        self._project = None
+        self._cloud = None
+
+    def cloud(self, project_id):
+        # Cloud Logging's trace / spanId fields
+        if self._project != project_id:
+            self._cloud = (f"projects/{project_id}/traces/{self.trace_id}",
+                           f"projects/{project_id}/spanId/{self.span_id}")
+            self._project = project_id
+        return self._cloud
+
+
+_current = contextvars.ContextVar("otel_log_trace_ids", default=None)
+
+
+def current_trace_ids():
+    span = get_current_span()
+    ids = _current.get()
+    if ids is not None and ids.span is span:
+        return ids
+    if not span.is_recording():
+        return None
+    ids = TraceIds(span, span.get_span_context())
+    _current.set(ids)
+    return ids
+
+
+def loguru_patcher(record):
+    # otel_trace_id / otel_span_id default to None through the logger's
+    # extra (see install_loguru), so nothing is set outside a span
+    ids = current_trace_ids()
+    if ids is not None:
+        extra = record["extra"]
+        extra["otel_trace_id"] = ids.trace_id
+        extra["otel_span_id"] = ids.span_id
+
+
+def install_loguru():
+    from loguru import logger
+
+    logger.configure(patcher=loguru_patcher, extra={"otel_trace_id": None, "otel_span_id": None})
+
+
+class TraceContextFilter(logging.Filter):
+    # Sets otelTraceID / otelSpanID on stdlib records, the attribute names the
+    # OpenTelemetry logging instrumentation uses, "0" outside a span
+    def filter(self, record):
+        ids = current_trace_ids()
+        if ids is None:
+            record.otelTraceID = record.otelSpanID = "0"
+        else:
+            record.otelTraceID = ids.trace_id
+            record.otelSpanID = ids.span_id
+        return True
+
+
+LOG_FORMAT = ("%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d] "
+              "[trace_id=%(otelTraceID)s span_id=%(otelSpanID)s] - %(message)s")
+
+
+def install_logging(format=LOG_FORMAT, level=None):
+    # On the root handlers, so records from every logger pass the filter
+    logging.basicConfig(format=format, level=level)
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(existing, TraceContextFilter) for existing in handler.filters):
+            handler.addFilter(TraceContextFilter())
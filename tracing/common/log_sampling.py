@@ -0,0 +1,144 @@
+import re
+import threading
+import time
+
+from opentelemetry.trace import get_current_span
+
+from common.metrics import REGISTRY
+
+# Decides which loguru records are shipped (used as the `filter` of a sink).
+# Per level, a record is shipped "always", "never", or only when the active
+# span is "sampled", so low-severity lines are kept exactly for the traces
+# that reach Tempo. Records logged outside any span have no trace to join
+# and follow `outside_span`. Then each message template may ship
+# `rate_limit` records per `rate_window` seconds; repeated(record) tells the
+# sink how many were collapsed into the next record shipped after a burst.
+# Records of ALWAYS levels are never rate limited.
+#
+# loguru formats the message before filters run, so the template is the
+# message with numbers and long hex IDs masked: "user 42 failed" and
+# "user 7 failed" share a limit, two different messages from one call site
+# do not.
+
+ALWAYS = "always"
+SAMPLED = "sampled"
+NEVER = "never"
+
+DEFAULT_LEVELS = {"TRACE": SAMPLED, "DEBUG": SAMPLED, "INFO": SAMPLED, "SUCCESS": SAMPLED}
+_OTHER_KEY = "__other__"
+_VARIABLE = re.compile(r"\b[0-9a-fA-F]{8,}\b|\d+")
+TEMPLATE_LENGTH = 200
+
+
+def message_template(message):
+    return _VARIABLE.sub("#", message[:TEMPLATE_LENGTH])
+
+
+class _Site:
+    __slots__ = ("window_start", "count", "suppressed")
+
+    def __init__(self, now):
+        self.window_start = now
+        self.count = 0
+        self.suppressed = 0
+
+
+class TraceAwareLogFilter:
+    def __init__(self, levels=None, default=ALWAYS, outside_span=True, rate_limit=20,
+                 rate_window=10.0, max_sites=2000):
+        # Level name -> ALWAYS / SAMPLED / NEVER; unlisted levels (WARNING and
+        # above with the defaults) use `default`
+        self.levels = dict(DEFAULT_LEVELS if levels is None else levels)
+        self.default = default
+        self.outside_span = outside_span
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.max_sites = max_sites
+        self._lock = threading.Lock()
+        self._sites = {}
+        self._local = threading.local()
+        self.shipped = 0
+        # (reason, level name) -> records not shipped
+        self.suppressed = {}
+
+    def __call__(self, record):
+        level = record["level"].name
+        policy = self.levels.get(level, self.default)
+        if policy != ALWAYS:
+            if policy == NEVER:
+                return self._suppress("level", level)
+            context = get_current_span().get_span_context()
+            if not context.is_valid:
+                if not self.outside_span:
+                    return self._suppress("outside_span", level)
+            elif not context.trace_flags.sampled:
+                return self._suppress("unsampled", level)
+            if self.rate_limit is not None and not self._admit(record):
+                return self._suppress("rate_limited", level)
+        with self._lock:
+            self.shipped += 1
+        return True
+
+    def _suppress(self, reason, level):
+        key = (reason, level)
+        with self._lock:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+        return False
+
+    def repeated(self, record):
+        # Records collapsed into `record`, for the sink it filters for. The
+        # record's extra is shared with every other sink, so it is not kept
+        # there; loguru calls the sink right after its filter, on the same
+        # thread
+        pending = getattr(self._local, "repeated", None)
+        if pending is not None and pending[0] is record:
+            return pending[1]
+        return 0
+
+    def _admit(self, record):
+        key = message_template(record["message"])
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                if len(self._sites) >= self.max_sites:
+                    key = _OTHER_KEY
+                    site = self._sites.get(key)
+                if site is None:
+                    site = self._sites[key] = _Site(now)
+            if now - site.window_start >= self.rate_window:
+                site.window_start = now
+                site.count = 0
+            site.count += 1
+            if site.count > self.rate_limit:
+                site.suppressed += 1
+                return False
+            repeated = site.suppressed
+            site.suppressed = 0
+        self._local.repeated = (record, repeated) if repeated else None
+        return True
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {"shipped": self.shipped,
+                    "suppressed": {f"{reason}:{level}": count
+                                   for (reason, level), count in self.suppressed.items()}}
+
+    def collect(self):
+        with self._lock:
+            shipped = self.shipped
+            suppressed = [({"reason": reason, "level": level}, count)
+                          for (reason, level), count in sorted(self.suppressed.items())]
+        return [
+            ("log_records_shipped_total", "counter", "Log records passed to the shipping sink",
+             [({}, shipped)]),
+            ("log_records_suppressed_total", "counter", "Log records not shipped, by reason and level",
+             suppressed),
+        ]
+
+
+def trace_aware_log_filter(**options):
+    log_filter = TraceAwareLogFilter(**options)
+    REGISTRY.register(log_filter.collect)
+    return log_filter
@@ -1,45 +1,395 @@
 
+import atexit
+import gzip
+import json
+import os
+import queue
+import threading
 import time
 import requests
-import json
 from loguru import logger
+from opentelemetry import context, trace
+from opentelemetry.context import _SUPPRESS_INSTRUMENTATION_KEY
+from common import lifecycle
+from common.log_sampling import trace_aware_log_filter
+from common.spool import DROP_OLDEST, Backoff, ExportBuffer, process_directory
+from common.telemetry import pipeline
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def loki_sink(message):
-    print(message)
-    timestamp_ns = str(int(time.time() * 1e9))  # Current timestamp in nanoseconds
-    log_level = message.record["level"].name
-    log_message = message.record["message"]
-    log_time = message.record["time"].isoformat() 
-    data = {
-        "streams": [
-            {
-                "stream": {
-                    "service": "example_service",
-                    "job": "bot_python",
-                    "task_id": "2022-03-01",
-                    "type": "execution",
-                    "log_level": log_level,
-                    "otel_trace_id": message.record["extra"].get("otel_trace_id", "0"*32)
-                },
-                "values": [
-                    [timestamp_ns, f"message: {log_message}"]
-                ]
-            }
-        ]
-    }
-    print(data)
-    headers = {
-        "Content-type": "application/json"
-    }
-    url = "http://localhost:3101/loki/api/v1/push"
+LOKI_URL = os.environ.get("LOKI_URL", "http://localhost:3101/loki/api/v1/push")
+
+# Stream labels come from the tracer provider's Resource; these are used for
+# whatever it does not set. Trace and span IDs never become labels: one
+# stream per trace would overload Loki's index and defeat batching.
+DEFAULT_LABELS = {
+    "service": "example_service",
+    "job": "bot_python",
+}
+RESOURCE_LABELS = {
+    "service": "service.name",
+    "job": "service.namespace",
+    "env": "deployment.environment",
+}
+OTHER_VALUE = "__other__"
+# extra keys set by the tracing/logging layers rather than by the caller
+RESERVED_EXTRA = frozenset({"otel_trace_id", "otel_span_id"})
+
+
+def dumps(value):
+    # Compact JSON, through orjson when it is installed
+    if orjson is not None:
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=str, separators=(",", ":")).encode("utf-8")
+
+
+def resource_labels(resource, defaults=DEFAULT_LABELS):
+    attributes = resource.attributes if resource is not None else {}
+    labels = {}
+    for label, attribute in RESOURCE_LABELS.items():
+        value = attributes.get(attribute)
+        if value is None or (label == "service" and str(value).startswith("unknown_service")):
+            value = defaults.get(label)
+        if value is not None:
+            labels[label] = str(value)
+    return labels
+
+
+class LabelCardinalityGuard:
+    # Caps the distinct values seen per label name. Past `max_values` a new
+    # value is folded into "__other__", or the label is left off the record
+    # when fold=False.
+    def __init__(self, max_values=20, fold=True):
+        self.max_values = max_values
+        self.fold = fold
+        self._lock = threading.Lock()
+        self._values = {}
+        self.folded = {}
+
+    def check(self, name, value):
+        seen = self._values.get(name)
+        if seen is not None and value in seen:
+            return value
+        with self._lock:
+            seen = self._values.setdefault(name, set())
+            if value in seen or len(seen) < self.max_values:
+                seen.add(value)
+                return value
+            self.folded[name] = self.folded.get(name, 0) + 1
+        return OTHER_VALUE if self.fold else None
+
+
+def _encode_record(item):
+    return dumps(list(item))
+
+
+def _decode_record(payload):
+    labels, timestamp_ns, line, level_no, *metadata = json.loads(payload)
+    return (tuple(tuple(label) for label in labels), timestamp_ns, line, level_no,
+            metadata[0] if metadata else None)
+
+
+def _record_size(item):
+    return len(item[2]) + 128
+
+
+UNREPRESENTABLE = "<unrepresentable>"
+
+
+def _render_value(value):
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        if response.status_code != 204:
-            print(f"Failed to send log to Loki: {response.text}")
-        print(response.__dict__)
+        return dumps(value).decode("utf-8")
+    except Exception:
         pass
-    except Exception as e:
-        print(f"Error sending log to Loki: {e}")
+    try:
+        return json.dumps(repr(value))
+    except Exception:
+        # __repr__ raised too
+        return None
+
+
+def _render_fields(fields):
+    # (JSON text, whether some field could not be rendered). Caller values
+    # can fail in any way (circular references, a raising __str__ or
+    # __repr__, a dict mutated meanwhile); the line still ships
+    try:
+        return dumps(fields).decode("utf-8"), False
+    except Exception:
+        pass
+    parts = []
+    failed = False
+    for key, value in list(fields.items()):
+        rendered = _render_value(value)
+        if rendered is None:
+            rendered = json.dumps(UNREPRESENTABLE)
+            failed = True
+        parts.append(f"{json.dumps(str(key))}:{rendered}")
+    return "{" + ",".join(parts) + "}", failed
+
+
+class _Flush:
+    def __init__(self, stop=False):
+        self.stop = stop
+        self.done = threading.Event()
+
+
+class LokiSink:
+    # Loguru sink that hands records to a background thread. The thread groups
+    # them by stream labels and pushes one gzip'd request per batch over a
+    # single keep-alive session, so logging never waits on Loki. While Loki is
+    # unreachable records wait in an ExportBuffer (spilling to `spool_dir` if
+    # set) and are replayed in order with backoff. Pushes, drops and the
+    # backlog are reported on the `name` telemetry pipeline.
+    #
+    # Level, trace and span IDs go in the line as logfmt fields, or trace and
+    # span IDs as Loki structured metadata with structured_metadata=True
+    # (needs a v13/tsdb schema). `labels` adds fixed labels; `extra_labels`
+    # names record extra fields promoted to labels, kept in check by
+    # `guard`.
+    #
+    # Structured fields are passed as keyword arguments and land in the
+    # record's extra: logger.info("Sending payload to queue", payload=data).
+    # They are JSON-encoded on the sink thread and appended to the line as
+    # fields={...}, so records dropped by a filter never pay for it. Values
+    # are encoded after the call returns; do not mutate them afterwards.
+    #
+    # `repeats(record)` returns how many similar records a rate limiting
+    # filter collapsed into this one (TraceAwareLogFilter.repeated); the line
+    # then says so.
+    def __init__(self, url=LOKI_URL, labels=None, batch_size=500, flush_interval=1.0,
+                 max_queue_size=10000, timeout=5, spool_dir=None,
+                 memory_limit=8 * 1024 * 1024, drop_policy=DROP_OLDEST, spill_priority=0,
+                 extra_labels=(), guard=None, structured_metadata=False, name="loki", repeats=None):
+        self.url = url
+        self.repeats = repeats
+        self.labels = dict(labels or {})
+        self.extra_labels = tuple(extra_labels)
+        self.guard = guard or LabelCardinalityGuard()
+        self.structured_metadata = structured_metadata
+        self._provider = None
+        self._stream = ()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.max_queue_size = max_queue_size
+        self.spool_dir = spool_dir
+        # Priorities are loguru level numbers, so spill_priority=30 keeps only
+        # WARNING and above once the memory budget is spent
+        self._buffer_options = {"memory_limit": memory_limit, "drop_policy": drop_policy,
+                                "spill_priority": spill_priority}
+        self.telemetry = pipeline(name)
+        self.telemetry.gauge("queue_depth", lambda: self._queue.qsize())
+        self.telemetry.gauge("buffered_records", lambda: len(self._buffer))
+        self._reset()
+        atexit.register(self.close)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._buffer = ExportBuffer(process_directory(self.spool_dir), encode=_encode_record,
+                                    decode=_decode_record, sizeof=_record_size,
+                                    on_drop=lambda reason, count: self.telemetry.drop(f"buffer_{reason}", count),
+                                    **self._buffer_options)
+        self._backoff = Backoff()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._session = None
+        self._closed = False
+        self._queued = 0
+
+    def reinit(self):
+        # In a forked child the worker thread is gone and the queue, session
+        # and spool files belong to the parent; start over
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _labels(self, record):
+        provider = trace.get_tracer_provider()
+        if provider is not self._provider:
+            # Before setup_tracing this is the proxy provider with no resource
+            labels = resource_labels(getattr(provider, "resource", None))
+            labels.update(self.labels)
+            self._stream = tuple(sorted(labels.items()))
+            self._provider = provider
+        if not self.extra_labels:
+            return self._stream
+        extra = record["extra"]
+        labels = list(self._stream)
+        for name in self.extra_labels:
+            value = extra.get(name)
+            if value is not None:
+                value = self.guard.check(name, str(value))
+                if value is not None:
+                    labels.append((name, value))
+        return tuple(labels)
+
+    def __call__(self, message):
+        record = message.record
+        extra = record["extra"]
+        labels = self._labels(record)
+        timestamp_ns = str(int(record["time"].timestamp() * 1e9))
+        trace_id = extra.get("otel_trace_id")
+        metadata = None
+        if trace_id is None:
+            line = f"level={record['level'].name} message: {record['message']}"
+        elif self.structured_metadata:
+            line = f"level={record['level'].name} message: {record['message']}"
+            metadata = {"trace_id": trace_id, "span_id": extra.get("otel_span_id")}
+        else:
+            line = (f"level={record['level'].name} trace_id={trace_id} "
+                    f"span_id={extra.get('otel_span_id')} message: {record['message']}")
+        repeated = self.repeats(record) if self.repeats is not None else 0
+        if repeated:
+            line = f"{line} (+{repeated} similar suppressed)"
+        fields = {key: value for key, value in extra.items()
+                  if key not in RESERVED_EXTRA and key not in self.extra_labels}
+        if self._pid != os.getpid():
+            self.reinit()
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((labels, timestamp_ns, line, record["level"].no, metadata, fields))
+        except queue.Full:
+            self.telemetry.drop("queue_full")
+            return
+        with self._lock:
+            self._queued += 1
+
+    @property
+    def stats(self):
+        telemetry = self.telemetry.snapshot()
+        with self._lock:
+            return {
+                "queued": self._queued,
+                "sent": telemetry["records_sent"],
+                "dropped": sum(telemetry["dropped"].values()),
+                "pending": self._queue.qsize(),
+                "buffered": len(self._buffer),
+                "spilled": self._buffer.spilled,
+                "labels_folded": dict(self.guard.folded),
+            }
+
+    def flush(self, timeout=None):
+        if self._thread is None or not self._thread.is_alive():
+            return False
+        marker = _Flush()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(timeout)
+
+    def close(self, timeout=5):
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is None or not self._thread.is_alive():
+            return
+        marker = _Flush(stop=True)
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return
+        marker.done.wait(timeout)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._session = requests.Session()
+            self._session.headers.update({
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+            })
+            self._thread = threading.Thread(target=self._run, name="loki-sink", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        # Pushes to Loki must not be traced by the requests instrumentation
+        context.attach(context.set_value(_SUPPRESS_INSTRUMENTATION_KEY, True))
+        pending = 0
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(next_flush - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, _Flush):
+                # One attempt regardless of backoff, then report back
+                self._backoff.next_try = 0.0
+                try:
+                    self._buffer.drain(self._push, self._backoff, self.batch_size)
+                    if item.stop:
+                        self._buffer.close()
+                        self._session.close()
+                except Exception:
+                    pass
+                pending = 0
+                item.done.set()
+                if item.stop:
+                    return
+                continue
+
+            # Only a stop marker ends this thread: anything else a record
+            # brings up costs that record, not every later one
+            try:
+                if item is not None:
+                    pending += 1
+                    self._add(item)
+                    if pending < self.batch_size and time.monotonic() < next_flush:
+                        continue
+                if len(self._buffer):
+                    self._buffer.drain(self._push, self._backoff, self.batch_size)
+            except Exception:
+                self.telemetry.drop("error")
+            pending = 0
+            next_flush = time.monotonic() + self.flush_interval
+
+    def _add(self, item):
+        labels, timestamp_ns, line, level_no, metadata, fields = item
+        if fields:
+            rendered, failed = _render_fields(fields)
+            if failed:
+                # The record ships with placeholders for the failed fields
+                self.telemetry.drop("render_error")
+            line = f"{line} fields={rendered}"
+        self._buffer.put((labels, timestamp_ns, line, level_no, metadata), level_no)
+
+    def _push(self, batch):
+        streams = {}
+        for labels, timestamp_ns, line, _, metadata in batch:
+            value = [timestamp_ns, line, metadata] if metadata else [timestamp_ns, line]
+            streams.setdefault(labels, []).append(value)
+        data = {
+            "streams": [
+                {"stream": dict(labels), "values": values}
+                for labels, values in streams.items()
+            ]
+        }
+        body = gzip.compress(dumps(data), compresslevel=5)
+        started = time.perf_counter()
+        try:
+            response = self._session.post(self.url, data=body, timeout=self.timeout)
+        except requests.RequestException:
+            self.telemetry.failed(time.perf_counter() - started)
+            return False
+        if response.status_code == 204:
+            self.telemetry.sent(len(batch), len(body), time.perf_counter() - started)
+            return True
+        self.telemetry.failed(time.perf_counter() - started)
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            # Loki rejected the batch itself, retrying would not help
+            self.telemetry.drop(f"http_{response.status_code}", len(batch))
+            return True
+        return False
+
 
-logger.add(loki_sink, format="{time} {level} {message}", level="INFO")
+# INFO and below reach Loki only for sampled traces; repeats are collapsed
+loki_filter = trace_aware_log_filter()
+loki_sink = lifecycle.register(LokiSink(spool_dir=os.environ.get("LOKI_SPOOL_DIR"),
+                                        repeats=loki_filter.repeated))
+logger.add(loki_sink, format="{time} {level} {message}", level="INFO", filter=loki_filter)
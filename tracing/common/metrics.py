@@ -0,0 +1,273 @@
+import os
+import threading
+from bisect import bisect_left
+
+from opentelemetry.sdk.trace import SpanProcessor
+from opentelemetry.trace import SpanKind, StatusCode
+
+# In-process metrics rendered in the Prometheus text format. Collectors are
+# callables returning (name, type, help, samples) tuples where samples is a
+# list of (labels dict, value), or (sample name, labels dict, value) for the
+# _bucket/_sum/_count series of a histogram; they run only when the metrics
+# are read.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_OTHER = "__other__"
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._collectors = []
+
+    def register(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def gauge(self, name, help, callback, labels=None):
+        # `callback` returns the current value
+        labels = dict(labels or {})
+        return self.register(lambda: [(name, "gauge", help, [(labels, callback())])])
+
+    def collect(self):
+        with self._lock:
+            collectors = list(self._collectors)
+        families = []
+        for collector in collectors:
+            families.extend(collector())
+        return families
+
+    def render(self):
+        lines = []
+        seen = set()
+        for name, kind, help, samples in self.collect():
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+            for sample in samples:
+                sample_name, labels, value = sample if len(sample) == 3 else (name,) + tuple(sample)
+                lines.append(f"{_sample_name(sample_name, labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample_name(name, labels):
+    if not labels:
+        return name
+    rendered = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return f"{name}{{{rendered}}}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+class Histogram:
+    # Observations keyed by a tuple of label values, e.g.
+    # Histogram("job_seconds", "...", ("queue",)).observe(0.2, "celery").
+    # Label combinations past `max_series` share one __other__ series.
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, max_series=1000):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.max_series = max_series
+        self._lock = threading.Lock()
+        # label values -> [bucket counts..., +Inf count, sum]
+        self._series = {}
+
+    def observe(self, value, *labels):
+        with self._lock:
+            values = self._series.get(labels)
+            if values is None:
+                if len(self._series) >= self.max_series:
+                    labels = (_OTHER,) * len(self.labelnames)
+                values = self._series.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+            values[bisect_left(self.buckets, value)] += 1
+            values[-1] += value
+
+    def collect(self):
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        buckets = []
+        sums = []
+        counts = []
+        for label_values, values in series:
+            labels = dict(zip(self.labelnames, label_values))
+            cumulative = 0
+            for bound, value in zip(self.buckets + (float("inf"),), values):
+                cumulative += value
+                buckets.append((f"{self.name}_bucket", dict(labels, le=_format_value(bound)), cumulative))
+            sums.append((f"{self.name}_sum", labels, values[-1]))
+            counts.append((f"{self.name}_count", labels, cumulative))
+        return [(self.name, "histogram", self.help, buckets + sums + counts)]
+
+
+_KINDS = {kind: kind.name.lower() for kind in SpanKind}
+_STATUSES = {code: code.name.lower() for code in StatusCode}
+
+
+class _Shard:
+    __slots__ = ("thread", "series")
+
+    def __init__(self, thread):
+        self.thread = thread
+        # (span name, kind, status) -> [bucket counts..., +Inf count, sum]
+        self.series = {}
+
+    def merge(self, other):
+        for key, values in list(other.series.items()):
+            mine = self.series.get(key)
+            if mine is None:
+                self.series[key] = list(values)
+            else:
+                for index, value in enumerate(values):
+                    mine[index] += value
+
+
+class SpanMetricsProcessor(SpanProcessor):
+    # Request rate, error rate and latency (RED) per span name, kind and
+    # status, counted from every recorded span before any export sampling.
+    # Each thread updates its own shard so on_end takes no lock; reading
+    # merges the shards and folds those of finished threads into one. Span
+    # names past `max_series` share the __other__ series.
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_series=1000):
+        self.buckets = tuple(sorted(buckets))
+        self.max_series = max_series
+        self._lock = threading.Lock()
+        self._names = {}
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # A forked child starts from zero; the parent keeps reporting its own
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard(None)
+
+    def _shard(self):
+        shard = _Shard(threading.current_thread())
+        self._local.shard = shard
+        with self._lock:
+            self._shards.append(shard)
+        return shard
+
+    def _name(self, name):
+        label = self._names.get(name)
+        if label is None:
+            with self._lock:
+                label = self._names.get(name)
+                if label is None:
+                    label = self._names[name] = name if len(self._names) < self.max_series else _OTHER
+        return label
+
+    def on_end(self, span):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        key = (self._name(span.name), _KINDS[span.kind], _STATUSES[span.status.status_code])
+        values = shard.series.get(key)
+        if values is None:
+            values = shard.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        duration = (span.end_time - span.start_time) / 1e9
+        values[bisect_left(self.buckets, duration)] += 1
+        values[-1] += duration
+
+    def snapshot(self):
+        with self._lock:
+            shards = list(self._shards)
+            finished = [shard for shard in shards if not shard.thread.is_alive()]
+            for shard in finished:
+                self._retired.merge(shard)
+                self._shards.remove(shard)
+            total = _Shard(None)
+            total.merge(self._retired)
+        for shard in shards:
+            if shard not in finished:
+                total.merge(shard)
+        return total.series
+
+    def collect(self):
+        requests = []
+        buckets = []
+        sums = []
+        counts = []
+        for (name, kind, status), values in sorted(self.snapshot().items()):
+            labels = {"span_name": name, "span_kind": kind, "status": status}
+            count = sum(values[:-1])
+            requests.append((labels, count))
+            cumulative = 0
+            for bound, value in zip(self.buckets + (float("inf"),), values):
+                cumulative += value
+                buckets.append(("span_duration_seconds_bucket", dict(labels, le=_format_value(bound)),
+                                cumulative))
+            sums.append(("span_duration_seconds_sum", labels, values[-1]))
+            counts.append(("span_duration_seconds_count", labels, count))
+        return [
+            ("span_requests_total", "counter", "Finished spans by name, kind and status", requests),
+            ("span_duration_seconds", "histogram", "Span duration in seconds", buckets + sums + counts),
+        ]
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self, timeout_millis=30000):
+        return True
+
+
+REGISTRY = Registry()
+
+_span_metrics = None
+
+
+def span_metrics_processor():
+    # One per process however many times tracing is set up
+    global _span_metrics
+    if _span_metrics is None:
+        _span_metrics = SpanMetricsProcessor()
+        REGISTRY.register(_span_metrics.collect)
+    return _span_metrics
+
+
+def start_http_server(port, host="", registry=REGISTRY, routes=None):
+    # For processes without a web app, such as Celery workers: serves the
+    # registry from a daemon thread, on every path but those in `routes`
+    # (path -> callable returning a content type and body bytes)
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    routes = dict(routes or {})
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            route = routes.get(self.path.split("?", 1)[0])
+            if route is None:
+                content_type, body = CONTENT_TYPE, registry.render().encode("utf-8")
+            else:
+                content_type, body = route()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,290 @@
+import gzip
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from opentelemetry import context
+from opentelemetry.context import _SUPPRESS_INSTRUMENTATION_KEY
+from opentelemetry.sdk.trace import SpanProcessor
+
+from common.spool import Backoff
+from common.telemetry import pipeline
+
+# OTLP/HTTP export pipeline in one span processor, in place of
+# BatchSpanProcessor + OTLPSpanExporter. Finished sampled spans go into a
+# bounded queue (full queue: the span is dropped and counted). A batcher
+# thread cuts batches of `max_batch_size`, or whatever is queued every
+# `flush_interval` seconds, and hands each to one of `max_in_flight` sender
+# threads. Senders encode, gzip and POST over a shared keep-alive pool, so
+# encoding and compression of one batch overlap the network wait of others.
+# When every sender is busy the batcher waits and the queue absorbs the
+# burst.
+#
+# 429, 502, 503, 504 and connection errors are retried up to `max_retries`
+# times with full-jitter exponential backoff, or after Retry-After. A batch
+# that still fails goes to `buffer` (an ExportBuffer, spilling to disk with
+# a spool directory). Once the collector answers again the batcher replays
+# it, in order and ahead of new batches, whether or not traffic keeps
+# flowing; without a buffer it is dropped. shutdown() drains for at most
+# `shutdown_timeout` seconds, then spools or drops what is left. Counters,
+# latency and queue depth are reported on the `name` telemetry pipeline.
+
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+_HEADERS = {"Content-Type": "application/x-protobuf"}
+
+
+def _encode(spans):
+    from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+
+    return encode_spans(spans).SerializeToString()
+
+
+def _retry_after(response, maximum):
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return min(max(float(value), 0.0), maximum)
+    except ValueError:
+        return None
+
+
+class OTLPExportProcessor(SpanProcessor):
+    def __init__(self, endpoint, headers=None, max_batch_size=512, max_queue_size=8192, flush_interval=1.0,
+                 max_in_flight=4, compression="gzip", compresslevel=6, timeout=10.0, max_retries=5,
+                 backoff_base=0.2, backoff_max=10.0, shutdown_timeout=5.0, buffer=None, name="otlp"):
+        if compression not in ("gzip", None, "none"):
+            raise ValueError(f"Unsupported OTLP compression: {compression}")
+        self.endpoint = endpoint
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.flush_interval = flush_interval
+        self.max_in_flight = max_in_flight
+        self.gzip = compression == "gzip"
+        self.compresslevel = compresslevel
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.shutdown_timeout = shutdown_timeout
+        self._buffer = buffer
+        self._backoff = Backoff()
+        self._headers = dict(_HEADERS, **(headers or {}))
+        if self.gzip:
+            self._headers["Content-Encoding"] = "gzip"
+        self._session = requests.Session()
+        self._session.mount(endpoint, HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight))
+        self._executor = ThreadPoolExecutor(max_in_flight, thread_name_prefix="otlp-export")
+        self._slots = threading.Semaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._queue = deque()
+        self._in_flight = 0
+        self._idle = threading.Condition(threading.Lock())
+        self._deadline = None
+        self._stopping = False
+        self._shutdown = False
+        self.telemetry = pipeline(name)
+        self.telemetry.gauge("queue_depth", lambda: len(self._queue))
+        self.telemetry.gauge("in_flight", lambda: self._in_flight)
+        if buffer is not None:
+            # Spool entries are whole batches, so these are not span counts
+            buffer.on_drop = lambda reason, count: self.telemetry.count(f"spool_dropped_{reason}", count)
+            self.telemetry.gauge("spooled_batches", lambda: len(buffer))
+        self._thread = threading.Thread(target=self._run, name="otlp-batcher", daemon=True)
+        self._thread.start()
+
+    def on_start(self, span, parent_context=None):
+        pass
+
+    def on_end(self, span):
+        if not span.context.trace_flags.sampled or self._shutdown:
+            return
+        with self._lock:
+            if len(self._queue) < self.max_queue_size:
+                self._queue.append(span)
+                if len(self._queue) == self.max_batch_size:
+                    self._wakeup.notify()
+                return
+        self.telemetry.drop("queue_full")
+
+    def _take(self):
+        with self._lock:
+            count = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _run(self):
+        # Export requests must not be traced by the requests instrumentation
+        context.attach(context.set_value(_SUPPRESS_INSTRUMENTATION_KEY, True))
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            with self._lock:
+                while (not self._stopping and len(self._queue) < self.max_batch_size
+                       and time.monotonic() < next_flush):
+                    self._wakeup.wait(next_flush - time.monotonic())
+                if self._stopping:
+                    return
+            if self._buffer is not None and len(self._buffer) and self._backoff.ready():
+                self._replay_spooled()
+            batch = self._take()
+            if len(batch) < self.max_batch_size:
+                next_flush = time.monotonic() + self.flush_interval
+            if batch:
+                self._submit(batch)
+
+    def _replay_spooled(self):
+        # Spooled batches go out, oldest first, ahead of the next new batch.
+        # Replay stops at the first failure (until the backoff allows another
+        # try) and, so the queue does not overflow meanwhile, once half of it
+        # is waiting; the rest follows on the next passes
+        while (len(self._buffer) and self._backoff.ready() and not self._stopping
+               and len(self._queue) < self.max_queue_size // 2):
+            items, token = self._buffer.peek(1)
+            if not self._replay(items):
+                self._backoff.failure()
+                return
+            self._backoff.success()
+            self._buffer.commit(token)
+
+    def _submit(self, batch, deadline=None):
+        # Waits for a free sender; False (batch not taken) past `deadline`
+        if not self._slots.acquire(blocking=False):
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            started = time.perf_counter()
+            acquired = self._slots.acquire(timeout=timeout)
+            self.telemetry.blocked(time.perf_counter() - started)
+            if not acquired:
+                return False
+        with self._idle:
+            self._in_flight += 1
+        try:
+            self._executor.submit(self._send, batch)
+        except RuntimeError:
+            # Interpreter exit stops thread pools before the provider's
+            # atexit shutdown runs; send from this thread instead
+            self._send(batch)
+        return True
+
+    def _send(self, batch):
+        token = context.attach(context.set_value(_SUPPRESS_INSTRUMENTATION_KEY, True))
+        try:
+            payload = _encode(batch)
+            if not self._post(payload, len(batch)):
+                self._give_up(payload, len(batch))
+        except Exception:
+            self.telemetry.drop("error", len(batch))
+        finally:
+            context.detach(token)
+            self._slots.release()
+            with self._idle:
+                self._in_flight -= 1
+                self._idle.notify_all()
+
+    def _post(self, payload, count, retries=None):
+        body = gzip.compress(payload, self.compresslevel) if self.gzip else payload
+        retries = self.max_retries if retries is None else retries
+        attempt = 0
+        while True:
+            response = None
+            timeout = self.timeout
+            deadline = self._deadline
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    return False
+            started = time.perf_counter()
+            try:
+                response = self._session.post(self.endpoint, data=body, headers=self._headers, timeout=timeout)
+            except requests.RequestException:
+                self.telemetry.failed(time.perf_counter() - started)
+            else:
+                if response.status_code < 300:
+                    self.telemetry.sent(count, len(body), time.perf_counter() - started)
+                    self.telemetry.count("bytes_uncompressed", len(payload))
+                    return True
+                self.telemetry.failed(time.perf_counter() - started)
+                if response.status_code not in RETRY_STATUSES:
+                    # The collector refused the data; sending it again will not help
+                    self.telemetry.drop(f"http_{response.status_code}", count)
+                    return True
+            if attempt >= retries:
+                return False
+            delay = _retry_after(response, self.backoff_max)
+            if delay is None:
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            deadline = self._deadline
+            if deadline is not None and time.monotonic() + delay > deadline:
+                return False
+            attempt += 1
+            self.telemetry.count("retries")
+            time.sleep(delay)
+
+    def _give_up(self, payload, count):
+        if self._buffer is not None and self._buffer.put(payload):
+            self.telemetry.count("spooled", count)
+            if self._backoff.ready():
+                # Later batches spooled during the same outage do not
+                # lengthen the wait; failed replays do
+                self._backoff.failure()
+            return
+        self.telemetry.drop("retries_exhausted", count)
+
+    def _replay(self, payloads):
+        # One attempt per spooled batch; the buffer's own backoff paces
+        # replays. Spooled spans were counted as such, not as sent again
+        if self._post(payloads[0], 0, retries=0):
+            self.telemetry.count("replayed")
+            return True
+        return False
+
+    def _wait_idle(self, deadline):
+        with self._idle:
+            while self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def force_flush(self, timeout_millis=30000):
+        deadline = time.monotonic() + timeout_millis / 1000
+        while True:
+            batch = self._take()
+            if not batch:
+                break
+            if not self._submit(batch, deadline):
+                with self._lock:
+                    self._queue.extendleft(reversed(batch))
+                return False
+        return self._wait_idle(deadline)
+
+    def shutdown(self):
+        if self._shutdown:
+            return
+        self._shutdown = True
+        deadline = time.monotonic() + self.shutdown_timeout
+        # Senders give up a little earlier, leaving time to spool their batch
+        self._deadline = deadline - min(0.5, self.shutdown_timeout / 4)
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+        self._thread.join(max(deadline - time.monotonic(), 0.0))
+        while True:
+            batch = self._take()
+            if not batch:
+                break
+            if not self._submit(batch, deadline):
+                self._give_up(_encode(batch), len(batch))
+                for leftover in iter(self._take, []):
+                    self._give_up(_encode(leftover), len(leftover))
+                break
+        self._wait_idle(deadline)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._buffer is not None:
+            self._buffer.close()
+        self._session.close()
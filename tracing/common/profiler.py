@@ -0,0 +1,213 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+from opentelemetry.sdk.trace import SpanProcessor
+
+from common import lifecycle
+from common.metrics import REGISTRY
+
+# Opt-in sampling profiler that attributes CPU time to spans. As a span
+# processor it tracks which spans are open on which thread; a background
+# thread reads sys._current_frames() `hz` times a second and, for every
+# thread with an open span, records the stack tagged with the innermost
+# span's trace and span IDs and the thread's local root span name (the
+# route or run/<task>). Stacks are kept folded (root first, ";"-separated)
+# and aggregated per root span name; collapsed() renders them for
+# flamegraph.pl / speedscope. With span_events=True sampled spans also get
+# up to `max_events_per_span` profile.sample events.
+#
+# The sampler measures its own cost and stretches the interval whenever it
+# would spend more than `max_overhead` of one CPU; `max_frames` bounds the
+# stack walk (the innermost frames are kept).
+
+MAX_STACKS = 5000  # distinct stacks per profile before they fold into [other]
+
+
+def _frame_name(code):
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def fold_stack(frame, max_frames):
+    names = []
+    while frame is not None and len(names) < max_frames:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    if frame is not None:
+        names.append("[truncated]")
+    names.reverse()
+    return ";".join(names)
+
+
+class SpanProfiler(SpanProcessor):
+    def __init__(self, hz=50.0, max_frames=64, max_overhead=0.01, span_events=False,
+                 max_events_per_span=10, recent=10000):
+        self.hz = hz
+        self.max_frames = max_frames
+        self.max_overhead = max_overhead
+        self.span_events = span_events
+        self.max_events_per_span = max_events_per_span
+        self.recent_size = recent
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # thread ident -> open spans started on it, outermost first
+        self._open = {}
+        # span id -> [thread ident, profile.sample events added, live span]
+        self._owner = {}
+        self._lock = threading.Lock()
+        self._profiles = {}
+        # (time, trace id, span id, root span name, folded stack)
+        self.recent = collections.deque(maxlen=self.recent_size)
+        self.samples = 0
+        self.interval = 1.0 / self.hz
+        self._cost = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def reinit(self):
+        # The sampler thread does not survive a fork
+        if self._pid != os.getpid():
+            self._reset()
+
+    def close(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def on_start(self, span, parent_context=None):
+        if self._pid != os.getpid():
+            self.reinit()
+        if self._thread is None:
+            self._start()
+        ident = threading.get_ident()
+        spans = self._open.get(ident)
+        if spans is None:
+            spans = self._open[ident] = []
+        spans.append(span)
+        self._owner[span.context.span_id] = [ident, 0, span]
+
+    def on_end(self, span):
+        owner = self._owner.pop(span.context.span_id, None)
+        if owner is None:
+            return
+        # on_end gets a ReadableSpan copy, so remove the live span. Only the
+        # owning thread adds to its list, so only it drops the list once
+        # empty; sample() prunes those of threads that have exited
+        ident = owner[0]
+        spans = self._open.get(ident)
+        if spans:
+            try:
+                spans.remove(owner[2])
+            except ValueError:
+                pass
+            if not spans and ident == threading.get_ident():
+                del self._open[ident]
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-profiler", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            begin = time.perf_counter()
+            self.sample(skip=own)
+            cost = time.perf_counter() - begin
+            # Smoothed cost per sample; the interval never drops below 1/hz
+            self._cost = cost if not self._cost else 0.8 * self._cost + 0.2 * cost
+            self.interval = max(1.0 / self.hz, self._cost / self.max_overhead)
+
+    def sample(self, skip=None):
+        frames = sys._current_frames()
+        now = time.time()
+        taken = []
+        for ident, spans in list(self._open.items()):
+            frame = frames.get(ident)
+            if frame is None and not spans:
+                # Exited with its spans ended on other threads
+                self._open.pop(ident, None)
+                continue
+            if frame is None or ident == skip or not spans:
+                continue
+            try:
+                root, span = spans[0], spans[-1]
+            except IndexError:
+                continue
+            stack = fold_stack(frame, self.max_frames)
+            context = span.get_span_context()
+            taken.append((now, f"{context.trace_id:032x}", f"{context.span_id:016x}", root.name, stack))
+            if self.span_events and context.trace_flags.sampled:
+                owner = self._owner.get(context.span_id)
+                if owner is not None and owner[1] < self.max_events_per_span:
+                    owner[1] += 1
+                    span.add_event("profile.sample", {"profile.stack": stack, "profile.hz": self.hz})
+        del frames
+        with self._lock:
+            for sample in taken:
+                profile = self._profiles.get(sample[3])
+                if profile is None:
+                    profile = self._profiles[sample[3]] = {}
+                stack = sample[4]
+                if stack not in profile and len(profile) >= MAX_STACKS:
+                    stack = "[other]"
+                profile[stack] = profile.get(stack, 0) + 1
+            self.recent.extend(taken)
+            self.samples += len(taken)
+        return taken
+
+    def profiles(self):
+        with self._lock:
+            return {name: dict(stacks) for name, stacks in self._profiles.items()}
+
+    def collapsed(self, name=None):
+        # One "root span name;frame;...;frame count" line per stack
+        lines = []
+        for root, stacks in sorted(self.profiles().items()):
+            if name is not None and root != name:
+                continue
+            for stack, count in sorted(stacks.items()):
+                lines.append(f"{root};{stack} {count}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def clear(self):
+        with self._lock:
+            self._profiles = {}
+            self.recent.clear()
+
+    def collect(self):
+        return [
+            ("profiler_samples_total", "counter", "Stack samples taken of threads with an open span",
+             [({}, self.samples)]),
+            ("profiler_interval_seconds", "gauge", "Current sampling interval after the overhead cap",
+             [({}, self.interval)]),
+            ("profiler_sample_cost_seconds", "gauge", "Smoothed cost of one sampling pass",
+             [({}, self._cost)]),
+        ]
+
+    def shutdown(self):
+        self.close()
+
+    def force_flush(self, timeout_millis=30000):
+        return True
+
+
+_profiler = None
+
+
+def span_profiler(**options):
+    # One per process however many times tracing is set up
+    global _profiler
+    if _profiler is None:
+        _profiler = lifecycle.register(SpanProfiler(**options))
+        REGISTRY.register(_profiler.collect)
+    return _profiler
+
+
+def current_profiler():
+    return _profiler
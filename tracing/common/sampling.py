@@ -0,0 +1,277 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from opentelemetry.sdk.trace import SpanProcessor
+from opentelemetry.sdk.trace.sampling import Decision, Sampler, SamplingResult, TraceIdRatioBased
+from opentelemetry.trace import StatusCode
+
+# Rough per-span footprint used for the memory budget
+_SPAN_BASE_BYTES = 512
+_ATTRIBUTE_BYTES = 64
+_EVENT_BYTES = 256
+
+
+def _span_bytes(span):
+    return (_SPAN_BASE_BYTES
+            + _ATTRIBUTE_BYTES * len(span.attributes or ())
+            + _EVENT_BYTES * len(span.events or ()))
+
+
+class _TraceBuffer:
+    __slots__ = ("spans", "bytes", "created")
+
+    def __init__(self):
+        self.spans = []
+        self.bytes = 0
+        self.created = time.monotonic()
+
+
+class TailSamplingSpanProcessor(SpanProcessor):
+    # Holds every span of a trace until its local root ends, then forwards the
+    # whole trace to `next_processor` only if it is interesting: an error
+    # status, an HTTP 5xx, a root slower than its route threshold, or the
+    # probabilistic baseline. The baseline is decided on the trace ID, as
+    # TraceIdRatioBased does, so a trace evicted in parts or tail sampled in
+    # several services is kept or dropped as a whole. Needs the head sampler
+    # to record the trace, otherwise there is nothing left to choose from.
+    def __init__(self, next_processor, baseline_rate=0.01, latency_thresholds=None,
+                 default_latency_threshold=1.0, max_traces=10000, max_spans=200000,
+                 max_memory_bytes=64 * 1024 * 1024, max_age=30.0, decided_cache_size=10000):
+        self._next = next_processor
+        self.baseline_rate = baseline_rate
+        # Seconds, keyed by http.route or span name of the root span
+        self.latency_thresholds = dict(latency_thresholds or {})
+        self.default_latency_threshold = default_latency_threshold
+        self.max_traces = max_traces
+        self.max_spans = max_spans
+        self.max_memory_bytes = max_memory_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._traces = OrderedDict()
+        self._span_count = 0
+        self._bytes = 0
+        # Decisions for traces whose root already ended, for late children
+        self._decided = OrderedDict()
+        self._decided_cache_size = decided_cache_size
+        self.stats = {"traces_kept": 0, "traces_dropped": 0, "spans_kept": 0,
+                      "spans_dropped": 0, "traces_evicted": 0}
+
+    def on_start(self, span, parent_context=None):
+        pass
+
+    def on_end(self, span):
+        if not span.context.trace_flags.sampled:
+            # Recorded only for metrics (RecordingSampler), never exported
+            return
+        trace_id = span.context.trace_id
+        finished = []
+        with self._lock:
+            decision = self._decided.get(trace_id)
+            if decision is not None:
+                finished.append((decision, [span]))
+            else:
+                buffer = self._traces.get(trace_id)
+                if buffer is None:
+                    buffer = self._traces[trace_id] = _TraceBuffer()
+                size = _span_bytes(span)
+                buffer.spans.append(span)
+                buffer.bytes += size
+                self._span_count += 1
+                self._bytes += size
+                if span.parent is None or span.parent.is_remote:
+                    self._remove(trace_id)
+                    finished.append((self._decide(buffer.spans, span), buffer.spans))
+                    self._remember(trace_id, finished[-1][0])
+                finished.extend(self._evict())
+        for keep, spans in finished:
+            self._emit(keep, spans)
+
+    def force_flush(self, timeout_millis=30000):
+        with self._lock:
+            pending = [self._remove(trace_id) for trace_id in list(self._traces)]
+        for buffer in pending:
+            self._emit(self._decide(buffer.spans, None), buffer.spans)
+        return self._next.force_flush(timeout_millis)
+
+    def shutdown(self):
+        self.force_flush()
+        self._next.shutdown()
+
+    def _decide(self, spans, root):
+        for span in spans:
+            if span.status.status_code is StatusCode.ERROR:
+                return True
+            status_code = span.attributes.get("http.status_code") if span.attributes else None
+            if isinstance(status_code, int) and status_code >= 500:
+                return True
+        if root is not None and root.end_time and root.start_time:
+            route = root.attributes.get("http.route", root.name) if root.attributes else root.name
+            threshold = self.latency_thresholds.get(route, self.default_latency_threshold)
+            if threshold is not None and (root.end_time - root.start_time) / 1e9 > threshold:
+                return True
+        bound = TraceIdRatioBased.get_bound_for_rate(self.baseline_rate)
+        return spans[0].context.trace_id & TraceIdRatioBased.TRACE_ID_LIMIT < bound
+
+    def _emit(self, keep, spans):
+        with self._lock:
+            self.stats["spans_kept" if keep else "spans_dropped"] += len(spans)
+        if keep:
+            for span in spans:
+                self._next.on_end(span)
+
+    def _remove(self, trace_id):
+        buffer = self._traces.pop(trace_id)
+        self._span_count -= len(buffer.spans)
+        self._bytes -= buffer.bytes
+        return buffer
+
+    def _remember(self, trace_id, keep):
+        self.stats["traces_kept" if keep else "traces_dropped"] += 1
+        self._decided[trace_id] = keep
+        if len(self._decided) > self._decided_cache_size:
+            self._decided.popitem(last=False)
+
+    def _evict(self):
+        # Oldest traces go first; they are judged on what has arrived so far
+        evicted = []
+        deadline = time.monotonic() - self.max_age
+        while self._traces:
+            trace_id, buffer = next(iter(self._traces.items()))
+            if (buffer.created >= deadline and len(self._traces) <= self.max_traces
+                    and self._span_count <= self.max_spans and self._bytes <= self.max_memory_bytes):
+                break
+            self._remove(trace_id)
+            keep = self._decide(buffer.spans, None)
+            self._remember(trace_id, keep)
+            self.stats["traces_evicted"] += 1
+            evicted.append((keep, buffer.spans))
+        return evicted
+
+
+_DROP = SamplingResult(Decision.DROP)
+_OTHER_KEY = "__other__"
+
+
+class _Budget:
+    __slots__ = ("target", "tokens", "last", "window_start", "seen", "arrival_rate",
+                 "probability", "result", "carried")
+
+    def __init__(self, target, now):
+        self.target = target
+        self.tokens = target
+        self.last = now
+        self.window_start = now
+        self.seen = 0
+        self.arrival_rate = None
+        self.probability = 1.0
+        self.result = SamplingResult(Decision.RECORD_AND_SAMPLE, {"sampling.probability": 1.0})
+        # Weight (1/probability) of spans the bucket turned away since the
+        # last one it let through
+        self.carried = 0.0
+
+
+class RateLimitingSampler(Sampler):
+    # Aims for `spans_per_second` root spans per key, where the key is the span
+    # name: the Flask route template or the Celery "run/<task>" name. Each
+    # window the sampling probability is re-derived from the observed arrival
+    # rate, and a token bucket caps bursts inside the window. The probability
+    # is put on the root span as `sampling.probability` so counts can be
+    # extrapolated: sum(1 / sampling.probability) over the kept spans is the
+    # number of arrivals. A span that passes the probability draw but finds
+    # the bucket empty hands its weight on to the next span kept, whose
+    # probability is lowered to match. Use it as the root of ParentBased(...).
+    #
+    # Budgets are updated without a lock: a race between two threads can let
+    # an extra span through, which is cheaper than contending on every call.
+    def __init__(self, spans_per_second=10.0, budgets=None, window=10.0, max_keys=1000):
+        self.spans_per_second = spans_per_second
+        # Per-key overrides; Celery tasks can be given by their short name
+        self.budgets = dict(budgets or {})
+        self.window = window
+        self.max_keys = max_keys
+        self._budgets = {}
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None,
+                      links=None, trace_state=None):
+        budget = self._budgets.get(name)
+        now = time.monotonic()
+        if budget is None:
+            budget = self._new_budget(name, now)
+        budget.seen += 1
+        if now - budget.window_start >= self.window:
+            self._adapt(budget, now)
+        tokens = budget.tokens + (now - budget.last) * budget.target
+        if tokens > budget.target:
+            tokens = budget.target
+        budget.last = now
+        if budget.probability < 1.0 and random.random() >= budget.probability:
+            budget.tokens = tokens
+            return _DROP
+        if tokens < 1.0:
+            budget.tokens = tokens
+            budget.carried += 1.0 / budget.probability
+            return _DROP
+        budget.tokens = tokens - 1.0
+        if not budget.carried:
+            return budget.result
+        weight = 1.0 / budget.probability + budget.carried
+        budget.carried = 0.0
+        return SamplingResult(Decision.RECORD_AND_SAMPLE, {"sampling.probability": 1.0 / weight})
+
+    def get_description(self):
+        return f"RateLimitingSampler{{{self.spans_per_second}/s}}"
+
+    def _new_budget(self, name, now):
+        if len(self._budgets) >= self.max_keys:
+            # Unbounded span names (raw paths) share one budget
+            budget = self._budgets.get(_OTHER_KEY)
+            if budget is None:
+                budget = self._budgets[_OTHER_KEY] = _Budget(self.spans_per_second, now)
+            return budget
+        target = self.budgets.get(name)
+        if target is None:
+            target = self.budgets.get(name.rpartition("/")[2].rpartition(".")[2], self.spans_per_second)
+        budget = self._budgets[name] = _Budget(target, now)
+        return budget
+
+    def _adapt(self, budget, now):
+        rate = budget.seen / (now - budget.window_start)
+        if budget.arrival_rate is None:
+            budget.arrival_rate = rate
+        else:
+            # Smooth over windows so one quiet window does not open the gates
+            budget.arrival_rate = 0.5 * budget.arrival_rate + 0.5 * rate
+        probability = 1.0 if budget.arrival_rate <= budget.target else budget.target / budget.arrival_rate
+        if probability != budget.probability:
+            budget.probability = probability
+            budget.result = SamplingResult(Decision.RECORD_AND_SAMPLE,
+                                           {"sampling.probability": probability})
+        budget.seen = 0
+        budget.window_start = now
+
+
+_RECORD_ONLY = SamplingResult(Decision.RECORD_ONLY)
+
+
+class RecordingSampler(Sampler):
+    # Turns the DROP decisions of `sampler` into RECORD_ONLY: the span is not
+    # exported (exporting processors skip unsampled spans) but processors such
+    # as SpanMetricsProcessor still see it end, so counts and latencies stay
+    # exact at any sampling rate.
+    def __init__(self, sampler):
+        self.sampler = sampler
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None,
+                      links=None, trace_state=None):
+        result = self.sampler.should_sample(parent_context, trace_id, name, kind=kind,
+                                            attributes=attributes, links=links, trace_state=trace_state)
+        if result.decision is not Decision.DROP:
+            return result
+        if result.trace_state is None:
+            return _RECORD_ONLY
+        return SamplingResult(Decision.RECORD_ONLY, trace_state=result.trace_state)
+
+    def get_description(self):
+        return f"RecordingSampler{{{self.sampler.get_description()}}}"
@@ -0,0 +1,276 @@
+import fcntl
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from opentelemetry.sdk.trace import SpanProcessor
+
+from common.metrics import REGISTRY
+from common.telemetry import pipeline
+from common.span_codec import SpanDecoder, encode_span
+
+# Host-local span collection: every process appends encoded spans to one
+# shared-memory ring and a single elected drainer hands them to an export
+# span processor (OTLPExportProcessor under setup_tracing), so a host runs
+# one export pipeline and one set of collector connections instead of one
+# per worker process.
+#
+# Ring file layout: a 64 byte header (magic, capacity, head, tail, dropped),
+# then `capacity` bytes of records. A record is a u32 length and the encoded
+# span; a length of _WRAP means "continue at offset 0". head and tail are
+# byte counters that only grow, so head - tail is the fill level.
+_MAGIC = 0x5350414E
+_HEADER = struct.Struct("<IIQQQQ")
+_HEADER_SIZE = 64
+_LENGTH = struct.Struct("<I")
+_WRAP = 0xFFFFFFFF
+
+DEFAULT_RING_SIZE = 16 * 1024 * 1024
+
+
+def default_ring_path(service_name):
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"otel-spans-{service_name}")
+
+
+class SpanRing:
+    def __init__(self, path, capacity=DEFAULT_RING_SIZE):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset_lock)
+        # lockf locks belong to the process, so they exclude other workers;
+        # the thread lock covers threads of this one
+        with self._locked():
+            if os.fstat(self._fd).st_size < _HEADER_SIZE:
+                os.ftruncate(self._fd, _HEADER_SIZE + capacity)
+                os.pwrite(self._fd, _HEADER.pack(_MAGIC, 0, capacity, 0, 0, 0), 0)
+            size = os.fstat(self._fd).st_size
+            self._map = mmap.mmap(self._fd, size)
+            magic, _, self.capacity, _, _, _ = _HEADER.unpack_from(self._map, 0)
+            if magic != _MAGIC:
+                raise ValueError(f"{path} is not a span ring")
+
+    def _reset_lock(self):
+        self._thread_lock = threading.Lock()
+
+    def _locked(self):
+        return _RingLock(self)
+
+    def _positions(self):
+        _, _, _, head, tail, dropped = _HEADER.unpack_from(self._map, 0)
+        return head, tail, dropped
+
+    def _store(self, head, tail, dropped):
+        _HEADER.pack_into(self._map, 0, _MAGIC, 0, self.capacity, head, tail, dropped)
+
+    def write(self, payload):
+        needed = _LENGTH.size + len(payload)
+        with self._locked():
+            head, tail, dropped = self._positions()
+            offset = head % self.capacity
+            wrap = 0
+            if offset + needed > self.capacity:
+                # Not enough room before the end; skip to the start
+                wrap = self.capacity - offset
+            if head + wrap + needed - tail > self.capacity:
+                self._store(head, tail, dropped + 1)
+                return False
+            if wrap:
+                if wrap >= _LENGTH.size:
+                    _LENGTH.pack_into(self._map, _HEADER_SIZE + offset, _WRAP)
+                head += wrap
+                offset = 0
+            start = _HEADER_SIZE + offset
+            _LENGTH.pack_into(self._map, start, len(payload))
+            self._map[start + _LENGTH.size:start + needed] = payload
+            self._store(head + needed, tail, dropped)
+            return True
+
+    def read(self, max_records=512):
+        records = []
+        with self._locked():
+            head, tail, dropped = self._positions()
+            while tail < head and len(records) < max_records:
+                offset = tail % self.capacity
+                if self.capacity - offset < _LENGTH.size:
+                    tail += self.capacity - offset
+                    continue
+                (length,) = _LENGTH.unpack_from(self._map, _HEADER_SIZE + offset)
+                if length == _WRAP:
+                    tail += self.capacity - offset
+                    continue
+                start = _HEADER_SIZE + offset + _LENGTH.size
+                records.append(bytes(self._map[start:start + length]))
+                tail += _LENGTH.size + length
+            self._store(head, tail, dropped)
+        return records
+
+    def fill_level(self):
+        head, tail, _ = self._positions()
+        return (head - tail) / self.capacity
+
+    def dropped(self):
+        return self._positions()[2]
+
+
+class _RingLock:
+    __slots__ = ("_ring",)
+
+    def __init__(self, ring):
+        self._ring = ring
+
+    def __enter__(self):
+        self._ring._thread_lock.acquire()
+        fcntl.lockf(self._ring._fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.lockf(self._ring._fd, fcntl.LOCK_UN)
+        self._ring._thread_lock.release()
+
+
+class SpanRingDrain:
+    # Moves spans from the ring to `processor`, on one thread. Every
+    # `max_pending` spans it waits for the processor to send what it was
+    # given, so a backlog stays in the ring instead of overflowing the
+    # processor's queue. A record that does not decode is skipped and
+    # counted as a decode_error drop on `telemetry`.
+    def __init__(self, ring, processor, batch_size=512, interval=1.0, max_pending=2048, telemetry=None):
+        self.ring = ring
+        self.processor = processor
+        self.telemetry = telemetry or pipeline("shm")
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self._decoder = SpanDecoder()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="span-ring-drain", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def drain_once(self):
+        drained = 0
+        pending = 0
+        while True:
+            records = self.ring.read(self.batch_size)
+            if not records:
+                return drained
+            for record in records:
+                try:
+                    span = self._decoder.decode(record)
+                except Exception:
+                    self.telemetry.drop("decode_error")
+                    continue
+                self.processor.on_end(span)
+            drained += len(records)
+            pending += len(records)
+            if pending >= self.max_pending:
+                self.processor.force_flush()
+                pending = 0
+
+    def _run(self):
+        from opentelemetry import context
+        from opentelemetry.context import _SUPPRESS_INSTRUMENTATION_KEY
+
+        context.attach(context.set_value(_SUPPRESS_INSTRUMENTATION_KEY, True))
+        while not self._stop.wait(self.interval):
+            try:
+                self.drain_once()
+            except Exception:
+                pass
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        self.drain_once()
+        self.processor.shutdown()
+
+
+class SharedMemorySpanProcessor(SpanProcessor):
+    # Producer side: encodes each sampled span into the ring. The process
+    # that wins the drain lock (a per-process lockf, so forked children do
+    # not inherit it) also runs the drain thread, into a span processor from
+    # `processor_factory`; the others retry the election every
+    # `election_interval` seconds in case the drainer died.
+    def __init__(self, ring, processor_factory, election_interval=5.0, drain_interval=1.0):
+        self.ring = ring
+        self._processor_factory = processor_factory
+        self._election_interval = election_interval
+        self._drain_interval = drain_interval
+        self._next_election = 0.0
+        self._drain = None
+        self._lock_fd = os.open(ring.path + ".drain.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        self._elect()
+
+    def _elect(self):
+        self._next_election = time.monotonic() + self._election_interval
+        try:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return
+        self._drain = SpanRingDrain(self.ring, self._processor_factory(),
+                                    interval=self._drain_interval).start()
+
+    def on_end(self, span):
+        if not span.context.trace_flags.sampled:
+            return
+        self.ring.write(encode_span(span))
+        if self._drain is None and time.monotonic() >= self._next_election:
+            self._elect()
+
+    def force_flush(self, timeout_millis=30000):
+        if self._drain is not None:
+            self._drain.drain_once()
+            return self._drain.processor.force_flush(timeout_millis)
+        return True
+
+    def shutdown(self):
+        if self._drain is not None:
+            self._drain.stop()
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_UN)
+            self._drain = None
+
+
+_rings = {}
+
+
+def shared_memory_span_processor(config, processor_factory):
+    path = config["shm_path"] or default_ring_path(config["service_name"])
+    ring = _rings.get(path)
+    if ring is None:
+        # One ring object per path: lockf locks are per process, so a second
+        # descriptor on the same file would not exclude this one. Forked
+        # children inherit the ring, its mapping and the gauges.
+        ring = _rings[path] = SpanRing(path, config["shm_size"])
+        REGISTRY.gauge("span_ring_fill_ratio", "Fill level of the shared-memory span ring",
+                       ring.fill_level, {"ring": os.path.basename(path)})
+        REGISTRY.gauge("span_ring_dropped_total", "Spans dropped because the ring was full",
+                       ring.dropped, {"ring": os.path.basename(path)})
+        telemetry = pipeline("shm")
+        telemetry.gauge("ring_fill_ratio", ring.fill_level)
+        # Host-wide: every process writing to the ring shares it
+        telemetry.gauge("ring_dropped", ring.dropped)
+    return SharedMemorySpanProcessor(ring, processor_factory)
+
+
+if __name__ == "__main__":
+    # Standalone drainer: python -m common.shm_collector <ring path> [endpoint]
+    from common.otlp_export import OTLPExportProcessor
+
+    path = sys.argv[1]
+    endpoint = sys.argv[2] if len(sys.argv) > 2 else "http://localhost:4318/v1/traces"
+    processor = SharedMemorySpanProcessor(SpanRing(path), lambda: OTLPExportProcessor(endpoint, name="shm"))
+    if processor._drain is None:
+        sys.exit(f"another process is already draining {path}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        processor.shutdown()
@@ -0,0 +1,164 @@
+import json
+import struct
+
+from opentelemetry.attributes import BoundedAttributes
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import Event, ReadableSpan
+from opentelemetry.sdk.util.instrumentation import InstrumentationScope
+from opentelemetry.trace import Link, SpanContext, SpanKind, Status, StatusCode, TraceFlags
+
+# Compact binary form of a finished span, used where spans cross a process
+# boundary or land on disk. Fixed fields first, then length-prefixed strings;
+# attributes, events and links are JSON since they are free-form and usually
+# small.
+#
+#   trace_id 16s | span_id 8s | parent_span_id 8s | flags B | kind B |
+#   status B | parent_is_remote B | start q | end q
+#   name, status description, scope name, scope version: u16 + utf-8
+#   resource, attributes, events, links: u32 + JSON
+_HEADER = struct.Struct("<16s8s8sBBBBqq")
+_SHORT = struct.Struct("<H")
+_LONG = struct.Struct("<I")
+
+_NO_PARENT = bytes(8)
+
+
+def _short(value):
+    data = (value or "").encode("utf-8")
+    if len(data) > 0xFFFF:
+        # Cut on a character boundary, or decoding the span fails
+        data = data[:0xFFFF].decode("utf-8", "ignore").encode("utf-8")
+    return _SHORT.pack(len(data)) + data
+
+
+def _long(value):
+    data = json.dumps(value, separators=(",", ":"), default=str).encode("utf-8")
+    return _LONG.pack(len(data)) + data
+
+
+_EMPTY_LIST = _LONG.pack(2) + b"[]"
+_EMPTY_DICT = _LONG.pack(2) + b"{}"
+
+# Resource and scope are shared by every span of a process, so their encoded
+# form is computed once per object
+_static = {}
+
+
+def _static_part(resource, scope):
+    key = (id(resource), id(scope))
+    cached = _static.get(key)
+    if cached is None or cached[0] is not resource or cached[1] is not scope:
+        encoded = (_short(scope.name if scope else None) + _short(scope.version if scope else None)
+                   + _long(dict(resource.attributes) if resource else {}))
+        cached = _static[key] = (resource, scope, encoded)
+    return cached[2]
+
+
+def encode_span(span):
+    context = span.context
+    parent = span.parent
+    header = _HEADER.pack(
+        context.trace_id.to_bytes(16, "big"),
+        context.span_id.to_bytes(8, "big"),
+        parent.span_id.to_bytes(8, "big") if parent is not None else _NO_PARENT,
+        int(context.trace_flags),
+        span.kind.value,
+        span.status.status_code.value,
+        1 if parent is not None and parent.is_remote else 0,
+        span.start_time or 0,
+        span.end_time or 0,
+    )
+    attributes = span.attributes
+    events = span.events
+    links = span.links
+    return b"".join((
+        header,
+        _short(span.name),
+        _short(span.status.description),
+        _static_part(span.resource, span.instrumentation_scope),
+        _long(dict(attributes)) if attributes else _EMPTY_DICT,
+        _long([[event.name, event.timestamp, dict(event.attributes or {})] for event in events])
+        if events else _EMPTY_LIST,
+        _long([[link.context.trace_id, link.context.span_id, dict(link.attributes or {})] for link in links])
+        if links else _EMPTY_LIST,
+    ))
+
+
+def peek_span(data):
+    # The indexed fields of an encoded span, without decoding the rest:
+    # (trace id, span id, parent span id, status, start, end, name), IDs as
+    # raw bytes and a zero parent for a root span
+    (trace_id, span_id, parent_span_id, _, _, status, _, start, end) = _HEADER.unpack_from(data, 0)
+    (length,) = _SHORT.unpack_from(data, _HEADER.size)
+    offset = _HEADER.size + _SHORT.size
+    return (trace_id, span_id, parent_span_id, status, start, end,
+            bytes(data[offset:offset + length]).decode("utf-8"))
+
+
+def _attributes(values):
+    # The OTLP encoder reads `.dropped` off event and link attributes
+    return BoundedAttributes(attributes=values, immutable=True, max_value_len=None)
+
+
+class SpanDecoder:
+    # Keeps Resource and scope objects shared between decoded spans so the
+    # OTLP encoder groups them instead of emitting one resource per span
+    def __init__(self):
+        self._resources = {}
+        self._scopes = {}
+
+    def decode(self, data):
+        view = memoryview(data)
+        (trace_id, span_id, parent_span_id, flags, kind, status, parent_remote,
+         start, end) = _HEADER.unpack_from(view, 0)
+        offset = _HEADER.size
+        strings = []
+        for _ in range(4):
+            (length,) = _SHORT.unpack_from(view, offset)
+            offset += _SHORT.size
+            strings.append(bytes(view[offset:offset + length]).decode("utf-8"))
+            offset += length
+        blobs = []
+        for _ in range(4):
+            (length,) = _LONG.unpack_from(view, offset)
+            offset += _LONG.size
+            blobs.append(bytes(view[offset:offset + length]))
+            offset += length
+        name, description, scope_name, scope_version = strings
+        resource_json, attributes, events, links = blobs
+
+        trace_id = int.from_bytes(trace_id, "big")
+        context = SpanContext(trace_id, int.from_bytes(span_id, "big"), False, TraceFlags(flags))
+        parent = None
+        if parent_span_id != _NO_PARENT:
+            parent = SpanContext(trace_id, int.from_bytes(parent_span_id, "big"), bool(parent_remote),
+                                 TraceFlags(flags))
+        return ReadableSpan(
+            name,
+            context=context,
+            parent=parent,
+            resource=self._resource(resource_json),
+            attributes=json.loads(attributes),
+            events=[Event(event_name, _attributes(event_attributes), timestamp)
+                    for event_name, timestamp, event_attributes in json.loads(events)],
+            links=[Link(SpanContext(link_trace_id, link_span_id, True), _attributes(link_attributes))
+                   for link_trace_id, link_span_id, link_attributes in json.loads(links)],
+            kind=SpanKind(kind),
+            status=Status(StatusCode(status), description or None),
+            start_time=start,
+            end_time=end,
+            instrumentation_scope=self._scope(scope_name, scope_version),
+        )
+
+    def _resource(self, resource_json):
+        resource = self._resources.get(resource_json)
+        if resource is None:
+            resource = self._resources[resource_json] = Resource(json.loads(resource_json))
+        return resource
+
+    def _scope(self, name, version):
+        key = (name, version)
+        scope = self._scopes.get(key)
+        if scope is None:
+            scope = self._scopes[key] = InstrumentationScope(name, version or None)
+        return scope
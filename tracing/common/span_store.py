@@ -0,0 +1,539 @@
+import argparse
+import fcntl
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+from common.span_codec import SpanDecoder, encode_span, peek_span
+
+# File-backed span store for local runs and load tests. FileSpanExporter
+# appends each batch to the current segment of `directory` with one write:
+# [u32 length][span_codec record] per span. Next to every <stem>.spans
+# segment, <stem>.idx gets one entry per span (trace, span and parent IDs,
+# start, end, status, offset, length, name), appended right after the data.
+# A segment is rotated past `segment_size` bytes, and the oldest are deleted
+# once the directory holds more than `max_bytes`.
+#
+# Each process writes its own segments (<start time ns>-<pid>) and holds a
+# flock lock on the one it is appending to. flock belongs to the open file,
+# not the process, so compaction run by another exporter of the same process
+# cannot take it either. A segment is created and locked under a temporary
+# name and only then renamed into place. Segments nobody holds, whether
+# rotated or left by a dead process, may be compacted: runs of small ones
+# are merged into one segment with the spans of a trace stored together.
+# Exporters compact what earlier runs left behind when they start.
+#
+# SpanStore reads a directory: trace trees, the slowest spans of a name and
+# attribute filters, through the index and decoding only the spans
+# returned. The part of a segment its index does not cover yet (a crash
+# between the two writes) is indexed by scanning it.
+#
+#   python -m common.span_store <directory> trace <trace id>
+#   python -m common.span_store <directory> slowest "GET /hello/<name>" -n 10
+#   python -m common.span_store <directory> find http.status_code=500 --name "GET /hello/<name>"
+#   python -m common.span_store <directory> names | compact
+
+SEGMENT_SUFFIX = ".spans"
+INDEX_SUFFIX = ".idx"
+
+_MAGIC = b"OTSPANS1"
+_FRAME = struct.Struct("<I")
+# trace id, span id, parent span id, start, end, status, offset, length,
+# name length; the utf-8 name follows
+_ENTRY = struct.Struct("<16s8s8sqqBIIH")
+_COMPACT_LOCK = "compact.lock"
+# Suffix of a segment being created, before it is locked and renamed
+_PENDING_SUFFIX = ".new"
+
+
+def default_store_directory(service_name):
+    return os.path.join(tempfile.gettempdir(), f"otel-span-store-{service_name}")
+
+
+class IndexEntry:
+    __slots__ = ("trace_id", "span_id", "parent_id", "status", "start", "end", "name", "segment", "offset",
+                 "length")
+
+    def __init__(self, trace_id, span_id, parent_id, status, start, end, name, segment, offset, length):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.status = status
+        self.start = start
+        self.end = end
+        self.name = name
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def pack(self, offset=None):
+        name = self.name.encode("utf-8")[:0xFFFF]
+        return _ENTRY.pack(self.trace_id, self.span_id, self.parent_id, self.start, self.end, self.status,
+                           self.offset if offset is None else offset, self.length, len(name)) + name
+
+
+def _entry(payload, segment, offset):
+    return IndexEntry(*peek_span(payload), segment, offset, len(payload))
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _segments(directory):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, name) for name in names if name.endswith(SEGMENT_SUFFIX))
+
+
+def _index_path(segment):
+    return segment[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+
+def _idle(segment):
+    # A descriptor holding the segment's lock, or None while a writer
+    # appends to it. Closing the descriptor releases the lock
+    try:
+        fd = os.open(segment, os.O_RDWR)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _remove(segment):
+    for path in (segment, _index_path(segment)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def read_index(segment):
+    # Index entries of one segment, completed by scanning what the index
+    # file does not cover
+    entries = []
+    covered = len(_MAGIC)
+    try:
+        with open(_index_path(segment), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b""
+    offset = len(_MAGIC)
+    while offset + _ENTRY.size <= len(data):
+        (trace_id, span_id, parent_id, start, end, status, span_offset, length,
+         name_length) = _ENTRY.unpack_from(data, offset)
+        name_end = offset + _ENTRY.size + name_length
+        if name_end > len(data):
+            break
+        name = data[offset + _ENTRY.size:name_end].decode("utf-8")
+        entries.append(IndexEntry(trace_id, span_id, parent_id, status, start, end, name, segment,
+                                  span_offset, length))
+        covered = max(covered, span_offset + length)
+        offset = name_end
+    try:
+        with open(segment, "rb") as f:
+            f.seek(covered)
+            tail = f.read()
+    except FileNotFoundError:
+        return []
+    offset = 0
+    while offset + _FRAME.size <= len(tail):
+        (length,) = _FRAME.unpack_from(tail, offset)
+        start = offset + _FRAME.size
+        if start + length > len(tail):
+            # Torn write at the end of a crashed writer's segment
+            break
+        entries.append(_entry(tail[start:start + length], segment, covered + start))
+        offset = start + length
+    return entries
+
+
+class FileSpanExporter(SpanExporter):
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, max_bytes=1024 * 1024 * 1024, compact=True):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._segment = None
+        self._closed = False
+        os.makedirs(directory, exist_ok=True)
+        if compact:
+            threading.Thread(target=compact_store, args=(directory, segment_size), name="span-store-compact",
+                             daemon=True).start()
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f"{time.time_ns():020d}-{os.getpid()}{SEGMENT_SUFFIX}")
+        data_fd = os.open(path + _PENDING_SUFFIX, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+        fcntl.flock(data_fd, fcntl.LOCK_EX)
+        index_fd = os.open(_index_path(path), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        _write_all(data_fd, _MAGIC)
+        _write_all(index_fd, _MAGIC)
+        os.rename(path + _PENDING_SUFFIX, path)
+        # [path, data fd, index fd, size, pid]
+        self._segment = [path, data_fd, index_fd, len(_MAGIC), os.getpid()]
+
+    def _close_segment(self):
+        if self._segment is not None:
+            os.close(self._segment[1])
+            os.close(self._segment[2])
+            self._segment = None
+
+    def export(self, spans):
+        with self._lock:
+            if self._closed:
+                return SpanExportResult.FAILURE
+            if self._segment is not None and self._segment[4] != os.getpid():
+                # Inherited over a fork: the parent keeps appending to it. Our
+                # copies of its descriptors would keep it locked after the
+                # parent is done with it
+                self._close_segment()
+            if self._segment is None:
+                self._open_segment()
+            path, data_fd, index_fd, size, _ = self._segment
+            frames = []
+            entries = []
+            offset = size
+            for span in spans:
+                payload = encode_span(span)
+                frames.append(_FRAME.pack(len(payload)))
+                frames.append(payload)
+                offset += _FRAME.size
+                entries.append(_entry(payload, path, offset).pack())
+                offset += len(payload)
+            _write_all(data_fd, b"".join(frames))
+            _write_all(index_fd, b"".join(entries))
+            self._segment[3] = offset
+            if offset >= self.segment_size:
+                self._close_segment()
+                enforce_retention(self.directory, self.max_bytes)
+        return SpanExportResult.SUCCESS
+
+    def force_flush(self, timeout_millis=30000):
+        return True
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            if self._segment is not None and self._segment[4] == os.getpid():
+                self._close_segment()
+
+
+def _store_lock(directory):
+    fd = os.open(os.path.join(directory, _COMPACT_LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def enforce_retention(directory, max_bytes):
+    # Deletes the oldest idle segments while the store is over `max_bytes`
+    lock = _store_lock(directory)
+    if lock is None:
+        return 0
+    removed = 0
+    try:
+        sizes = []
+        for segment in _segments(directory):
+            try:
+                sizes.append((segment, os.path.getsize(segment) + os.path.getsize(_index_path(segment))))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size in sizes)
+        for segment, size in sizes:
+            if total <= max_bytes:
+                break
+            fd = _idle(segment)
+            if fd is None:
+                continue
+            _remove(segment)
+            os.close(fd)
+            total -= size
+            removed += 1
+    finally:
+        os.close(lock)
+    return removed
+
+
+def compact_store(directory, segment_size=64 * 1024 * 1024):
+    # Merges runs of idle segments smaller together than `segment_size`
+    # into one, the spans of each trace together and in start order. Returns
+    # the number of segments merged away
+    lock = _store_lock(directory)
+    if lock is None:
+        return 0
+    merged = 0
+    held = []
+    try:
+        _remove_pending(directory)
+        groups = [[]]
+        group_size = 0
+        for segment in _segments(directory):
+            fd = _idle(segment)
+            if fd is None:
+                groups.append([])
+                group_size = 0
+                continue
+            held.append(fd)
+            size = os.fstat(fd).st_size
+            if group_size + size > segment_size and groups[-1]:
+                groups.append([])
+                group_size = 0
+            groups[-1].append(segment)
+            group_size += size
+        for group in groups:
+            if len(group) > 1:
+                _merge(directory, group)
+                merged += len(group) - 1
+    finally:
+        for fd in held:
+            os.close(fd)
+        os.close(lock)
+    return merged
+
+
+def _remove_pending(directory):
+    # Segments a crashed writer created but never renamed into place
+    for name in os.listdir(directory):
+        if not name.endswith(SEGMENT_SUFFIX + _PENDING_SUFFIX):
+            continue
+        pending = os.path.join(directory, name)
+        fd = _idle(pending)
+        if fd is None:
+            continue
+        _remove(pending[:-len(_PENDING_SUFFIX)])
+        os.remove(pending)
+        os.close(fd)
+
+
+def _merge(directory, segments):
+    entries = []
+    for segment in segments:
+        entries.extend(read_index(segment))
+    entries.sort(key=lambda entry: (entry.trace_id, entry.start))
+    stem = f"{os.path.basename(segments[0]).split('-', 1)[0]}-c{time.time_ns()}"
+    path = os.path.join(directory, stem + SEGMENT_SUFFIX)
+    frames = [_MAGIC]
+    index = [_MAGIC]
+    offset = len(_MAGIC)
+    files = {}
+    try:
+        for entry in entries:
+            source = files.get(entry.segment)
+            if source is None:
+                source = files[entry.segment] = open(entry.segment, "rb")
+            source.seek(entry.offset)
+            payload = source.read(entry.length)
+            frames.append(_FRAME.pack(len(payload)))
+            frames.append(payload)
+            offset += _FRAME.size
+            index.append(entry.pack(offset))
+            offset += len(payload)
+    finally:
+        for source in files.values():
+            source.close()
+    # Written under temporary names and renamed, index first: a reader sees
+    # the merged segment whole or not at all
+    for target, parts in ((_index_path(path), index), (path, frames)):
+        with open(target + ".tmp", "wb") as f:
+            f.write(b"".join(parts))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(target + ".tmp", target)
+    for segment in segments:
+        _remove(segment)
+
+
+def _trace_id(value):
+    if isinstance(value, int):
+        return value.to_bytes(16, "big")
+    if isinstance(value, bytes):
+        return value
+    return int(value, 16).to_bytes(16, "big")
+
+
+class SpanStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self._decoder = SpanDecoder()
+        self._files = {}
+        self.refresh()
+
+    def refresh(self):
+        # Reloads the index; a store object sees the segments as they were
+        # when it was created or last refreshed
+        self.close()
+        entries = []
+        for segment in _segments(self.directory):
+            entries.extend(read_index(segment))
+        entries.sort(key=lambda entry: entry.start)
+        self._entries = entries
+        self._starts = [entry.start for entry in entries]
+        self._by_trace = {}
+        self._by_name = {}
+        for entry in entries:
+            self._by_trace.setdefault(entry.trace_id, []).append(entry)
+            self._by_name.setdefault(entry.name, []).append(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def names(self):
+        return {name: len(entries) for name, entries in sorted(self._by_name.items())}
+
+    def _window(self, entries, since, until):
+        # `entries` are in start order; since/until are epoch nanoseconds
+        if since is None and until is None:
+            return entries
+        if entries is self._entries:
+            starts = self._starts
+        else:
+            starts = [entry.start for entry in entries]
+        low = 0 if since is None else bisect_left(starts, since)
+        high = len(entries) if until is None else bisect_right(starts, until)
+        return entries[low:high]
+
+    def read(self, entry):
+        fd = self._files.get(entry.segment)
+        if fd is None:
+            try:
+                fd = self._files[entry.segment] = os.open(entry.segment, os.O_RDONLY)
+            except FileNotFoundError:
+                # Compacted or deleted since the index was read
+                return None
+        return self._decoder.decode(os.pread(fd, entry.length, entry.offset))
+
+    def close(self):
+        for fd in self._files.values():
+            os.close(fd)
+        self._files = {}
+
+    def _spans(self, entries):
+        spans = []
+        for entry in entries:
+            span = self.read(entry)
+            if span is not None:
+                spans.append(span)
+        return spans
+
+    def trace(self, trace_id):
+        return self._spans(self._by_trace.get(_trace_id(trace_id), []))
+
+    def trace_tree(self, trace_id):
+        # [(span, children)] for the trace's roots, children in start order.
+        # Spans whose parent is not in the store count as roots
+        spans = self.trace(trace_id)
+        nodes = {span.context.span_id: (span, []) for span in spans}
+        roots = []
+        for span in spans:
+            parent = nodes.get(span.parent.span_id) if span.parent is not None else None
+            (parent[1] if parent is not None else roots).append(nodes[span.context.span_id])
+        return roots
+
+    def slowest(self, name, limit=10, since=None, until=None):
+        entries = self._window(self._by_name.get(name, []), since, until)
+        return self._spans(sorted(entries, key=lambda entry: entry.duration, reverse=True)[:limit])
+
+    def find(self, attributes=None, name=None, since=None, until=None, limit=100):
+        # Spans, newest first, whose attributes include every key / value of
+        # `attributes`; values compare as strings
+        wanted = {key: str(value) for key, value in (attributes or {}).items()}
+        entries = self._window(self._by_name.get(name, []) if name is not None else self._entries, since, until)
+        found = []
+        for entry in reversed(entries):
+            span = self.read(entry)
+            if span is None:
+                continue
+            span_attributes = span.attributes or {}
+            if all(key in span_attributes and str(span_attributes[key]) == value for key, value in wanted.items()):
+                found.append(span)
+                if len(found) >= limit:
+                    break
+        return found
+
+
+def _describe(span):
+    started = datetime.fromtimestamp(span.start_time / 1e9, timezone.utc).isoformat(timespec="milliseconds")
+    status = " ERROR" if span.status.status_code.name == "ERROR" else ""
+    return (f"{(span.end_time - span.start_time) / 1e6:10.3f} ms  {span.name}{status}  "
+            f"trace={span.context.trace_id:032x} span={span.context.span_id:016x} start={started}")
+
+
+def _print_tree(nodes, depth=0):
+    for span, children in nodes:
+        print(f"{'  ' * depth}{(span.end_time - span.start_time) / 1e6:.3f} ms  {span.name}"
+              f"{' ERROR' if span.status.status_code.name == 'ERROR' else ''}  "
+              f"{json.dumps(dict(span.attributes or {}), default=str)}")
+        _print_tree(children, depth + 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m common.span_store")
+    parser.add_argument("directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("trace", help="print a trace as a tree")
+    command.add_argument("trace_id")
+    command = commands.add_parser("slowest", help="slowest spans of a name")
+    command.add_argument("name")
+    command.add_argument("-n", "--limit", type=int, default=10)
+    command = commands.add_parser("find", help="spans with the given attribute values, newest first")
+    command.add_argument("filters", nargs="*", metavar="key=value")
+    command.add_argument("--name")
+    command.add_argument("-n", "--limit", type=int, default=20)
+    commands.add_parser("names", help="span names and counts")
+    commands.add_parser("compact", help="merge idle segments")
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        print(f"{compact_store(args.directory)} segments merged")
+        return 0
+    if args.command == "find" and any("=" not in item for item in args.filters):
+        parser.error("filters are key=value")
+    store = SpanStore(args.directory)
+    try:
+        if args.command == "trace":
+            tree = store.trace_tree(args.trace_id)
+            if not tree:
+                print(f"trace {args.trace_id} not found", file=sys.stderr)
+                return 1
+            _print_tree(tree)
+        elif args.command == "slowest":
+            for span in store.slowest(args.name, args.limit):
+                print(_describe(span))
+        elif args.command == "find":
+            attributes = dict(item.split("=", 1) for item in args.filters)
+            for span in store.find(attributes, name=args.name, limit=args.limit):
+                print(_describe(span))
+        else:
+            for name, count in store.names().items():
+                print(f"{count:8d}  {name}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+import fcntl
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+# Every frame is [payload length + 1][priority][payload]. A zero length marks
+# the end of the written part of a segment, which also makes a frame whose
+# header was never written (crash mid-append) invisible on restart.
+_FRAME = struct.Struct("<IB")
+# Read position persisted next to the segments: segment id, offset
+_CURSOR = struct.Struct("<qQ")
+
+DROP_OLDEST = "oldest"
+DROP_NEWEST = "newest"
+DROP_PRIORITY = "priority"
+
+_ROOT_PID = os.getpid()
+# directory -> (pid, slot directory, descriptor holding its lock)
+_slots = {}
+
+
+def process_directory(directory):
+    # Forked workers get their own subdirectory instead of sharing the
+    # parent's segments and cursor: worker-<n>, the lowest slot no live
+    # process holds. A restarted worker takes over the slot, and so the
+    # spooled backlog, of the one that exited, and the number of slots stays
+    # that of the most workers alive at once
+    if not directory or os.getpid() == _ROOT_PID:
+        return directory
+    slot = _slots.get(directory)
+    if slot is None or slot[0] != os.getpid():
+        if slot is not None:
+            # Inherited over a fork; the parent keeps its slot
+            os.close(slot[2])
+        slot = _slots[directory] = (os.getpid(),) + _claim_slot(directory)
+    return slot[1]
+
+
+def _claim_slot(directory):
+    index = 0
+    while True:
+        path = os.path.join(directory, f"worker-{index}")
+        os.makedirs(path, exist_ok=True)
+        fd = os.open(os.path.join(path, "lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # flock belongs to the open file: released when the process
+            # exits, however it exits
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            index += 1
+            continue
+        return path, fd
+
+
+class Backoff:
+    def __init__(self, base=0.5, maximum=30.0):
+        self.base = base
+        self.maximum = maximum
+        self.attempt = 0
+        self.next_try = 0.0
+
+    def ready(self):
+        return time.monotonic() >= self.next_try
+
+    def success(self):
+        self.attempt = 0
+        self.next_try = 0.0
+
+    def failure(self):
+        delay = min(self.maximum, self.base * (2 ** self.attempt))
+        self.attempt += 1
+        self.next_try = time.monotonic() + random.uniform(delay / 2, delay)
+
+
+class _Segment:
+    def __init__(self, path, segment_id, size=None):
+        self.path = path
+        self.id = segment_id
+        with open(path, "a+b") as f:
+            if size is not None:
+                f.truncate(size)
+            self.size = os.fstat(f.fileno()).st_size
+            self._map = mmap.mmap(f.fileno(), self.size)
+        self.write_offset = 0
+        self.count = 0
+        offset = 0
+        while True:
+            frame = self.read(offset)
+            if frame is None:
+                break
+            self.count += 1
+            offset = frame[2]
+        self.write_offset = offset
+
+    def append(self, payload, priority):
+        end = self.write_offset + _FRAME.size + len(payload)
+        if end > self.size:
+            return False
+        self._map[self.write_offset + _FRAME.size:end] = payload
+        _FRAME.pack_into(self._map, self.write_offset, len(payload) + 1, priority)
+        self.write_offset = end
+        self.count += 1
+        return True
+
+    def read(self, offset):
+        if offset + _FRAME.size > self.size:
+            return None
+        length, priority = _FRAME.unpack_from(self._map, offset)
+        if length == 0:
+            return None
+        start = offset + _FRAME.size
+        end = start + length - 1
+        return bytes(self._map[start:end]), priority, end
+
+    def remove(self):
+        self._map.close()
+        os.remove(self.path)
+
+
+class ExportBuffer:
+    # Ordered export backlog with a fixed RAM budget. Items live in memory
+    # until the budget is used up, then spill into memory-mapped segment files
+    # under `directory`; once anything is on disk, new items follow it there
+    # so replay order is preserved. Consumers peek() a batch, try to send it
+    # and commit() on success. The read cursor is persisted on commit, so a
+    # restarted process resumes after the last acknowledged item.
+    #
+    # Without a directory the buffer is memory-only and the drop policy
+    # applies as soon as the budget is exhausted. `on_drop(reason, count)`
+    # is told about every drop, under the buffer's lock.
+    def __init__(self, directory=None, memory_limit=8 * 1024 * 1024, segment_size=4 * 1024 * 1024,
+                 max_segments=16, drop_policy=DROP_OLDEST, spill_priority=0,
+                 encode=None, decode=None, sizeof=len, on_drop=None):
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST, DROP_PRIORITY):
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.drop_policy = drop_policy
+        # With the priority policy, items below this priority are dropped
+        # instead of spilled once memory is full
+        self.spill_priority = spill_priority
+        self._encode = encode or (lambda item: item)
+        self._decode = decode or (lambda payload: payload)
+        self._sizeof = sizeof
+        self.on_drop = on_drop
+        self._lock = threading.Lock()
+        self._memory = deque()
+        self._memory_bytes = 0
+        self._segments = []
+        self._cursor = (0, 0)
+        self._cursor_fd = None
+        self._disk_count = 0
+        self.dropped = {}
+        self.spilled = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    def __len__(self):
+        return len(self._memory) + self._disk_count
+
+    def put(self, item, priority=0):
+        size = self._sizeof(item)
+        with self._lock:
+            if not self._segments and self._memory_bytes + size <= self.memory_limit:
+                self._memory.append((priority, item, size))
+                self._memory_bytes += size
+                return True
+            if self.directory is None:
+                return self._put_memory_full(item, priority, size)
+            if self.drop_policy == DROP_PRIORITY and priority < self.spill_priority:
+                self._drop("priority")
+                return False
+            return self._spill(self._encode(item), priority)
+
+    def peek(self, max_items=500):
+        # Returns (items, token); pass the token to commit() once sent
+        with self._lock:
+            entries = list(islice(self._memory, max_items))
+            items = [item for _, item, _ in entries]
+            position = self._cursor
+            if len(items) < max_items and self._segments:
+                segment_id, offset = self._cursor
+                for segment in self._segments:
+                    if segment.id < segment_id:
+                        continue
+                    if segment.id > segment_id:
+                        offset = 0
+                    while len(items) < max_items:
+                        frame = segment.read(offset)
+                        if frame is None:
+                            break
+                        items.append(self._decode(frame[0]))
+                        offset = frame[2]
+                        position = (segment.id, offset)
+                    if len(items) >= max_items:
+                        break
+            return items, (entries, position)
+
+    def commit(self, token):
+        entries, position = token
+        with self._lock:
+            # Entries evicted since peek() are simply no longer at the head
+            for entry in entries:
+                if self._memory and self._memory[0] is entry:
+                    self._memory.popleft()
+                    self._memory_bytes -= entry[2]
+            if self._segments and position > self._cursor:
+                self._advance(position)
+
+    def drain(self, send, backoff, max_items=500):
+        # Replays buffered items in order while `send(items)` succeeds
+        while len(self) and backoff.ready():
+            items, token = self.peek(max_items)
+            try:
+                ok = send(items)
+            except Exception:
+                ok = False
+            if not ok:
+                backoff.failure()
+                return False
+            backoff.success()
+            self.commit(token)
+        return not len(self)
+
+    def close(self):
+        # Persist what is still in memory in front of the on-disk backlog
+        with self._lock:
+            if self.directory and self._memory:
+                payloads = [(self._encode(item), priority) for priority, item, _ in self._memory]
+                needed = sum(_FRAME.size + len(payload) for payload, _ in payloads)
+                first_id = self._segments[0].id if self._segments else self._cursor[0] + 1
+                segment = self._new_segment(first_id - 1, max(needed, self.segment_size))
+                for payload, priority in payloads:
+                    segment.append(payload, priority)
+                self._segments.insert(0, segment)
+                self._disk_count += segment.count
+                self._write_cursor((segment.id, 0))
+                self._memory.clear()
+                self._memory_bytes = 0
+            if self._cursor_fd is not None:
+                os.close(self._cursor_fd)
+                self._cursor_fd = None
+
+    def _put_memory_full(self, item, priority, size):
+        if self.drop_policy == DROP_NEWEST or size > self.memory_limit:
+            self._drop("full")
+            return False
+        if self.drop_policy == DROP_PRIORITY:
+            victims = [entry for entry in self._memory if entry[0] < priority]
+            freed = sum(entry[2] for entry in victims)
+            if self._memory_bytes - freed + size > self.memory_limit:
+                self._drop("priority")
+                return False
+            victims.sort(key=lambda entry: entry[0])
+            for entry in victims:
+                if self._memory_bytes + size <= self.memory_limit:
+                    break
+                self._memory.remove(entry)
+                self._memory_bytes -= entry[2]
+                self._drop("priority")
+        while self._memory_bytes + size > self.memory_limit:
+            _, _, evicted_size = self._memory.popleft()
+            self._memory_bytes -= evicted_size
+            self._drop("oldest")
+        self._memory.append((priority, item, size))
+        self._memory_bytes += size
+        return True
+
+    def _spill(self, payload, priority):
+        if _FRAME.size + len(payload) > self.segment_size:
+            self._drop("too_large")
+            return False
+        if not self._segments or not self._segments[-1].append(payload, priority):
+            if len(self._segments) >= self.max_segments:
+                if self.drop_policy == DROP_NEWEST:
+                    self._drop("full")
+                    return False
+                self._drop("oldest", self._advance((self._segments[0].id + 1, 0)))
+            next_id = self._segments[-1].id + 1 if self._segments else self._cursor[0] + 1
+            segment = self._new_segment(next_id, self.segment_size)
+            self._segments.append(segment)
+            if len(self._segments) == 1:
+                self._write_cursor((segment.id, 0))
+            segment.append(payload, priority)
+        self._disk_count += 1
+        self.spilled += 1
+        return True
+
+    def _advance(self, position):
+        # Move the read cursor and delete segments that are fully consumed
+        segment_id, offset = position
+        consumed = 0
+        while self._segments:
+            segment = self._segments[0]
+            start = self._cursor[1] if segment.id == self._cursor[0] else 0
+            if segment.id < segment_id or (segment.id == segment_id and offset >= segment.write_offset):
+                consumed += self._count_between(segment, start, segment.write_offset)
+                segment.remove()
+                self._segments.pop(0)
+                continue
+            if segment.id == segment_id:
+                consumed += self._count_between(segment, start, offset)
+            break
+        self._disk_count -= consumed
+        self._write_cursor(position)
+        return consumed
+
+    @staticmethod
+    def _count_between(segment, start, end):
+        count = 0
+        while start < end:
+            frame = segment.read(start)
+            if frame is None:
+                break
+            start = frame[2]
+            count += 1
+        return count
+
+    def _new_segment(self, segment_id, size):
+        path = os.path.join(self.directory, f"{segment_id:020d}.seg")
+        return _Segment(path, segment_id, size)
+
+    def _load(self):
+        cursor_path = os.path.join(self.directory, "cursor")
+        if os.path.exists(cursor_path):
+            with open(cursor_path, "rb") as f:
+                data = f.read(_CURSOR.size)
+            if len(data) == _CURSOR.size:
+                self._cursor = _CURSOR.unpack(data)
+        self._cursor_fd = os.open(cursor_path, os.O_RDWR | os.O_CREAT, 0o644)
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".seg"))
+        for name in names:
+            segment_id = int(name[:-4])
+            segment = _Segment(os.path.join(self.directory, name), segment_id)
+            if segment_id < self._cursor[0]:
+                segment.remove()
+                continue
+            self._segments.append(segment)
+            start = self._cursor[1] if segment_id == self._cursor[0] else 0
+            self._disk_count += self._count_between(segment, start, segment.write_offset)
+        if self._segments and self._segments[0].id > self._cursor[0]:
+            self._write_cursor((self._segments[0].id, 0))
+
+    def _write_cursor(self, position):
+        self._cursor = position
+        os.pwrite(self._cursor_fd, _CURSOR.pack(*position), 0)
+
+    def _drop(self, reason, count=1):
+        self.dropped[reason] = self.dropped.get(reason, 0) + count
+        if self.on_drop is not None:
+            self.on_drop(reason, count)
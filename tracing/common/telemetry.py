@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+
+from common.metrics import REGISTRY, Histogram, start_http_server
+
+# Self-telemetry of the export pipelines. Every exporter and sink (OTLP
+# span export, the Loki sink, the Cloud Logging transport...) reports on the
+# Pipeline returned by pipeline(name): batches, records and bytes sent,
+# failed export attempts, records dropped by reason, seconds callers spent
+# blocked on it, a histogram of export latency, and gauges such as queue
+# depth, read through callbacks only when the telemetry is.
+#
+# snapshot() returns all of it as a dict; the metrics registry serves it as
+# pipeline_* series, and start_telemetry_server() as JSON on /telemetry.
+# Recording takes one short lock and never logs or starts spans, so sinks
+# call it from their export threads. A forked child starts from zero.
+
+EXPORT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Pipeline:
+    def __init__(self, name):
+        self.name = name
+        self._gauges = {}
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.records = 0
+        self.bytes = 0
+        self.failures = 0
+        self.blocked_seconds = 0.0
+        self.dropped = {}
+        self.events = {}
+        self.latency = Histogram("pipeline_export_seconds", "Duration of export requests",
+                                 buckets=EXPORT_BUCKETS)
+
+    def sent(self, records, nbytes=0, seconds=None):
+        # One batch accepted by the backend
+        with self._lock:
+            self.batches += 1
+            self.records += records
+            self.bytes += nbytes
+        if seconds is not None:
+            self.latency.observe(seconds)
+
+    def failed(self, seconds=None):
+        # One export attempt that did not go through (it may be retried)
+        with self._lock:
+            self.failures += 1
+        if seconds is not None:
+            self.latency.observe(seconds)
+
+    def drop(self, reason, count=1):
+        with self._lock:
+            self.dropped[reason] = self.dropped.get(reason, 0) + count
+
+    def blocked(self, seconds):
+        with self._lock:
+            self.blocked_seconds += seconds
+
+    def count(self, event, value=1):
+        # Pipeline-specific events: retries, spooled batches...
+        with self._lock:
+            self.events[event] = self.events.get(event, 0) + value
+
+    def gauge(self, name, callback):
+        # `callback` returns the current value; a later one of the same
+        # name replaces it
+        self._gauges[name] = callback
+
+    def _gauge_values(self):
+        values = {}
+        for name, callback in list(self._gauges.items()):
+            try:
+                values[name] = callback()
+            except Exception:
+                # A sink torn down under us; never let reading fail
+                continue
+        return values
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {
+                "batches_sent": self.batches,
+                "records_sent": self.records,
+                "bytes_sent": self.bytes,
+                "export_failures": self.failures,
+                "dropped": dict(self.dropped),
+                "blocked_seconds": self.blocked_seconds,
+                "events": dict(self.events),
+            }
+        latency = {"count": 0, "sum": 0.0, "buckets": {}}
+        for sample_name, labels, value in self.latency.collect()[0][3]:
+            if sample_name.endswith("_bucket"):
+                latency["buckets"][labels["le"]] = value
+            else:
+                latency[sample_name.rsplit("_", 1)[1]] = value
+        snapshot["export_seconds"] = latency
+        snapshot["gauges"] = self._gauge_values()
+        return snapshot
+
+
+_lock = threading.Lock()
+_pipelines = {}
+
+
+def pipeline(name):
+    # One per name and process; exporters rebuilt after a fork reuse it
+    found = _pipelines.get(name)
+    if found is None:
+        with _lock:
+            found = _pipelines.setdefault(name, Pipeline(name))
+    return found
+
+
+def pipelines():
+    with _lock:
+        return dict(_pipelines)
+
+
+def snapshot():
+    return {name: found.snapshot() for name, found in sorted(pipelines().items())}
+
+
+def collect():
+    counters = {"batches": [], "records": [], "bytes": [], "failures": [], "dropped": [], "blocked": [],
+                "events": []}
+    gauges = {}
+    latency = []
+    for name, found in sorted(pipelines().items()):
+        labels = {"pipeline": name}
+        with found._lock:
+            counters["batches"].append((labels, found.batches))
+            counters["records"].append((labels, found.records))
+            counters["bytes"].append((labels, found.bytes))
+            counters["failures"].append((labels, found.failures))
+            counters["blocked"].append((labels, found.blocked_seconds))
+            counters["dropped"].extend((dict(labels, reason=reason), count)
+                                       for reason, count in sorted(found.dropped.items()))
+            counters["events"].extend((dict(labels, event=event), count)
+                                      for event, count in sorted(found.events.items()))
+        for gauge, value in sorted(found._gauge_values().items()):
+            gauges.setdefault(gauge, []).append((labels, value))
+        latency.extend((sample_name, dict(labels, **sample_labels), value)
+                       for sample_name, sample_labels, value in found.latency.collect()[0][3])
+    return [
+        ("pipeline_batches_sent_total", "counter", "Batches accepted by the backend", counters["batches"]),
+        ("pipeline_records_sent_total", "counter", "Records accepted by the backend", counters["records"]),
+        ("pipeline_bytes_sent_total", "counter", "Request body bytes accepted by the backend", counters["bytes"]),
+        ("pipeline_export_failures_total", "counter", "Export attempts that failed", counters["failures"]),
+        ("pipeline_records_dropped_total", "counter", "Records dropped, by reason", counters["dropped"]),
+        ("pipeline_blocked_seconds_total", "counter", "Seconds callers spent blocked on the pipeline",
+         counters["blocked"]),
+        ("pipeline_events_total", "counter", "Pipeline-specific events (retries, spooled batches...)",
+         counters["events"]),
+        ("pipeline_export_seconds", "histogram", "Duration of export requests", latency),
+    ] + [(f"pipeline_{gauge}", "gauge", f"Pipeline {gauge.replace('_', ' ')}", samples)
+         for gauge, samples in sorted(gauges.items())]
+
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+    for found in _pipelines.values():
+        found._reset()
+
+
+REGISTRY.register(collect)
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def start_telemetry_server(port, host=""):
+    # JSON snapshot on /telemetry, the whole metrics registry elsewhere. A
+    # bare http.server: no instrumentation, no access log
+    def render():
+        return "application/json", json.dumps(snapshot()).encode("utf-8")
+
+    return start_http_server(port, host, routes={"/telemetry": render})
@@ -1,71 +1,433 @@
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
-from opentelemetry.instrumentation.flask import FlaskInstrumentor
-from opentelemetry.instrumentation.grpc import GrpcInstrumentorServer
-from opentelemetry.instrumentation.requests import RequestsInstrumentor
-from opentelemetry.instrumentation.urllib import URLLibInstrumentor
-from opentelemetry.instrumentation.celery import CeleryInstrumentor
-from opentelemetry.sdk.resources import SERVICE_NAME, Resource
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.sdk.trace.sampling import ParentBasedTraceIdRatio
-from opentelemetry.trace import SpanContext, INVALID_SPAN_ID, INVALID_TRACE_ID
-import requests
-from opentelemetry.propagate import inject
-import datetime
-import json
+import importlib.util
+import os
+import threading
 import time
+
 from opentelemetry import trace, propagate
+from opentelemetry.propagate import inject
+from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import ParentBased, ParentBasedTraceIdRatio
 from loguru import logger
+from common.metrics import span_metrics_processor
+from common.sampling import RateLimitingSampler, RecordingSampler, TailSamplingSpanProcessor
+from common import lifecycle
+from common.log_context import install_loguru
+from common.spool import ExportBuffer, process_directory
+from common.telemetry import pipeline, start_telemetry_server
 
-def before_request_hook(span, request_to_be_instrumented):
-    # Inject the current trace context into the request headers
-    inject(request_to_be_instrumented.headers)
+OTLP_ENDPOINT = "http://localhost:4318/v1/traces"  # Grafana Tempo
 
+# Defaults per deployment profile. TRACING_* environment variables override
+# the profile and explicit setup_tracing() arguments override both.
+PROFILES = {
+    "tempo": {
+        "exporter": "otlp",
+        "sampling_rate": 1,
+        "instrumentations": ["flask", "requests", "urllib", "grpc", "celery"],
+    },
+    "local": {
+        "exporter": "file",
+        "sampling_rate": 1,
+        "instrumentations": ["flask", "requests", "urllib", "redis"],
+    },
+    "prod": {
+        "exporter": "cloud_trace",
+        "sampling_rate": 1 / 10,
+        "instrumentations": ["flask", "requests", "urllib", "redis", "grpc"],
+    },
+}
 
-def setup_tracing(app = None, service_name="my_service", sampling_rate=1):
-    print(f"In setup_tracing")
-    sampler = ParentBasedTraceIdRatio(sampling_rate)
-    resource = Resource.create(attributes={SERVICE_NAME: service_name})
-    trace_provider = TracerProvider(sampler=sampler, resource=resource)
-    trace.set_tracer_provider(trace_provider)
-    
-    otlp_exporter = OTLPSpanExporter(endpoint="http://localhost:4318/v1/traces")  # Configure for Grafana Tempo
-    span_processor = BatchSpanProcessor(otlp_exporter)
-    trace.get_tracer_provider().add_span_processor(span_processor)
-    
-    # Instrumentation
-    if(app):
-        FlaskInstrumentor().instrument_app(app)
-        RequestsInstrumentor().instrument(request_hook=before_request_hook)
+_ENV = {
+    "enabled": ("TRACING_ENABLED", lambda value: value.lower() not in ("0", "false", "no")),
+    "service_name": ("OTEL_SERVICE_NAME", str),
+    "exporter": ("TRACING_EXPORTER", str),
+    "otlp_endpoint": ("TRACING_OTLP_ENDPOINT", str),
+    "sampling_rate": ("TRACING_SAMPLING_RATE", float),
+    "spans_per_second": ("TRACING_SPANS_PER_SECOND", float),
+    "instrumentations": ("TRACING_INSTRUMENTATIONS",
+                         lambda value: [name.strip() for name in value.split(",") if name.strip()]),
+    "spool_dir": ("TRACING_SPOOL_DIR", str),
+    "shm_path": ("TRACING_SHM_PATH", str),
+    "excluded_urls": ("TRACING_EXCLUDED_URLS", str),
+    "span_metrics": ("TRACING_SPAN_METRICS", lambda value: value.lower() in ("1", "true", "yes")),
+    "celery_link_only": ("TRACING_CELERY_LINK_ONLY", lambda value: value.lower() in ("1", "true", "yes")),
+    "profiler_hz": ("TRACING_PROFILER_HZ", float),
+    "export_batch_size": ("TRACING_EXPORT_BATCH_SIZE", int),
+    "export_queue_size": ("TRACING_EXPORT_QUEUE_SIZE", int),
+    "export_interval": ("TRACING_EXPORT_INTERVAL", float),
+    "export_in_flight": ("TRACING_EXPORT_IN_FLIGHT", int),
+    "export_compression": ("TRACING_EXPORT_COMPRESSION", str),
+    "telemetry_port": ("TRACING_TELEMETRY_PORT", int),
+    "span_store_dir": ("TRACING_SPAN_STORE_DIR", str),
+}
+
+
+# FlaskInstrumentor owns the one server span per request: it continues the
+# incoming traceparent and names the span after the route template. These
+# hooks only add the size attributes it does not record itself.
+def server_request_hook(span, environ):
+    if span.is_recording() and environ.get("CONTENT_LENGTH"):
+        try:
+            span.set_attribute("http.request_content_length", int(environ["CONTENT_LENGTH"]))
+        except ValueError:
+            pass
+
+
+def server_response_hook(span, status, response_headers):
+    if not span.is_recording():
+        return
+    for name, value in response_headers:
+        if name.lower() == "content-length":
+            try:
+                span.set_attribute("http.response_content_length", int(value))
+            except ValueError:
+                pass
+            break
+
+
+class TelemetrySpanExporter(SpanExporter):
+    # Times every export and counts its spans on a telemetry pipeline
+    def __init__(self, exporter, telemetry):
+        self._exporter = exporter
+        self._telemetry = telemetry
+
+    def export(self, spans):
+        started = time.perf_counter()
+        try:
+            result = self._exporter.export(spans)
+        except Exception:
+            self._telemetry.failed(time.perf_counter() - started)
+            self._telemetry.drop("error", len(spans))
+            raise
+        if result is SpanExportResult.SUCCESS:
+            self._telemetry.sent(len(spans), seconds=time.perf_counter() - started)
+        else:
+            # BatchSpanProcessor does not retry
+            self._telemetry.failed(time.perf_counter() - started)
+            self._telemetry.drop("export_failed", len(spans))
+        return result
+
+    def force_flush(self, timeout_millis=30000):
+        return self._exporter.force_flush(timeout_millis)
+
+    def shutdown(self):
+        self._exporter.shutdown()
+
+
+class TelemetryBatchSpanProcessor(BatchSpanProcessor):
+    # BatchSpanProcessor evicts the oldest queued span when its queue is full
+    # and warns only the first time; this counts every eviction and reports
+    # the queue depth
+    def __init__(self, exporter, telemetry, **options):
+        super().__init__(TelemetrySpanExporter(exporter, telemetry), **options)
+        self.telemetry = telemetry
+        telemetry.gauge("queue_depth", lambda: len(self.queue))
+
+    def on_end(self, span):
+        if len(self.queue) >= self.max_queue_size and not self.done and span.context.trace_flags.sampled:
+            self.telemetry.drop("queue_full")
+        super().on_end(span)
+
+
+class ForkSafeSpanProcessor(SpanProcessor):
+    # Owns the export pipeline built by `factory`. A forked child inherits the
+    # parent's BatchSpanProcessor and its HTTP connections, so the first span
+    # seen in a new process builds a fresh pipeline. The inherited one is left
+    # alone: shutting it down would flush into the parent's connections.
+    def __init__(self, factory):
+        self._factory = factory
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._processor = factory()
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def reinit(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._processor = self._factory()
+                self._pid = os.getpid()
+        return self._processor
+
+    def _current(self):
+        if self._pid != os.getpid():
+            return self.reinit()
+        return self._processor
+
+    def on_start(self, span, parent_context=None):
+        self._current().on_start(span, parent_context=parent_context)
+
+    def on_end(self, span):
+        self._current().on_end(span)
+
+    def force_flush(self, timeout_millis=30000):
+        return self._current().force_flush(timeout_millis)
+
+    def shutdown(self):
+        self._current().shutdown()
+
+    def close(self, timeout=5):
+        self.force_flush(int(timeout * 1000))
+
+
+def otlp_export_processor(config):
+    from common.otlp_export import OTLPExportProcessor
+
+    # Batches are gzipped and sent by several threads at once; batches that
+    # keep failing are spooled and replayed once the collector is back
+    return OTLPExportProcessor(config["otlp_endpoint"], max_batch_size=config["export_batch_size"],
+                               max_queue_size=config["export_queue_size"],
+                               flush_interval=config["export_interval"],
+                               max_in_flight=config["export_in_flight"],
+                               compression=config["export_compression"],
+                               buffer=ExportBuffer(process_directory(config["spool_dir"])),
+                               name=config["exporter"])
+
+
+def _console_exporter(config):
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+    return ConsoleSpanExporter()
+
+
+def _file_exporter(config):
+    from common.span_store import FileSpanExporter, default_store_directory
+
+    # Query with python -m common.span_store <directory> ...
+    return FileSpanExporter(config["span_store_dir"] or default_store_directory(config["service_name"]))
+
+
+def _cloud_trace_exporter(config):
+    from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
+
+    return CloudTraceSpanExporter()
+
+
+def _shm_processor(config):
+    from common.shm_collector import shared_memory_span_processor
+
+    # Spans go through a host-wide shared-memory ring; the process draining
+    # it sends them on with the same OTLP pipeline, reporting on `shm`
+    return shared_memory_span_processor(config, lambda: otlp_export_processor(config))
+
+
+def _batch_processor(make_exporter):
+    def build(config):
+        return TelemetryBatchSpanProcessor(make_exporter(config), pipeline(config["exporter"]))
+
+    return build
+
+
+# Exporter name -> factory for the span processor that exports the spans
+EXPORTERS = {
+    "otlp": otlp_export_processor,
+    "shm": _shm_processor,
+    "console": _batch_processor(_console_exporter),
+    # Append-only segments on local disk, indexed by trace, name and start time
+    "file": _batch_processor(_file_exporter),
+    "cloud_trace": _batch_processor(_cloud_trace_exporter),
+    "none": None,
+}
+
+
+def _instrument_flask(app, config):
+    from opentelemetry.instrumentation.flask import FlaskInstrumentor
+
+    if app is not None:
+        FlaskInstrumentor().instrument_app(app, request_hook=server_request_hook,
+                                           response_hook=server_response_hook,
+                                           excluded_urls=config["excluded_urls"])
     else:
-        FlaskInstrumentor().instrument()
-        RequestsInstrumentor().instrument()
+        FlaskInstrumentor().instrument(request_hook=server_request_hook,
+                                       response_hook=server_response_hook,
+                                       excluded_urls=config["excluded_urls"])
+
+
+def _instrument_requests(app, config):
+    from opentelemetry.instrumentation.requests import RequestsInstrumentor
+
+    # The instrumentation injects the trace headers into every request itself
+    RequestsInstrumentor().instrument()
+
+
+def _instrument_urllib(app, config):
+    from opentelemetry.instrumentation.urllib import URLLibInstrumentor
 
     URLLibInstrumentor().instrument()
+
+
+def _instrument_grpc(app, config):
+    from opentelemetry.instrumentation.grpc import GrpcInstrumentorServer
+
     GrpcInstrumentorServer().instrument()
-    CeleryInstrumentor().instrument()
 
-def add_trace_context_to_loguru():
-    def enrich_with_trace_info(record):
-        print(f"In enrich_with_trace_info")
-        span = trace.get_current_span()
-        if not span:
-            return  # No active span, no action needed
-
-        span_context = span.get_span_context()
-        if not span_context:
-            return  # No span context available
-
-        if span_context.trace_id != INVALID_TRACE_ID:
-            record["extra"]["otel_trace_id"] = f"{span_context.trace_id:032x}"
-        else:
-            record["extra"]["otel_trace_id"] = None
 
-        if span_context.span_id != INVALID_SPAN_ID:
-            record["extra"]["otel_span_id"] = f"{span_context.span_id:016x}"
-        else:
-            record["extra"]["otel_span_id"] = None
+def _instrument_celery(app, config):
+    from common.celery_tracing import instrument_celery
+
+    # Trace context and baggage in the message headers, spans around publish and run
+    instrument_celery(link_only=config["celery_link_only"])
+
+
+def _instrument_redis(app, config):
+    from opentelemetry.instrumentation.redis import RedisInstrumentor
+
+    RedisInstrumentor().instrument()
+
+
+# name -> (module that must be installed, instrument function)
+INSTRUMENTATIONS = {
+    "flask": ("flask", _instrument_flask),
+    "requests": ("requests", _instrument_requests),
+    # urllib is in the standard library; only the instrumentation may be missing
+    "urllib": ("opentelemetry.instrumentation.urllib", _instrument_urllib),
+    "grpc": ("grpc", _instrument_grpc),
+    "celery": ("celery", _instrument_celery),
+    "redis": ("redis", _instrument_redis),
+}
 
-    print(f"In add_trace_context_to_loguru")
-    logger.configure(patcher=enrich_with_trace_info)
 
+def tracing_config(profile=None, **overrides):
+    profile = profile or os.environ.get("TRACING_PROFILE", "tempo")
+    config = {
+        "enabled": True,
+        "service_name": "my_service",
+        "otlp_endpoint": OTLP_ENDPOINT,
+        "spans_per_second": None,
+        "sampling_budgets": None,
+        "spool_dir": None,
+        "shm_path": None,
+        "shm_size": 16 * 1024 * 1024,
+        "tail_sampling": None,
+        "excluded_urls": None,
+        # Off by default: exact RED metrics build every span the sampler drops
+        "span_metrics": False,
+        "celery_link_only": False,
+        "profiler_hz": None,
+        "profiler": None,
+        "export_batch_size": 512,
+        "export_queue_size": 8192,
+        "export_interval": 1.0,
+        "export_in_flight": 4,
+        "export_compression": "gzip",
+        "telemetry_port": None,
+        "span_store_dir": None,
+    }
+    config.update(PROFILES[profile])
+    unknown = set(overrides) - set(config)
+    if unknown:
+        raise TypeError(f"Unknown tracing option(s): {', '.join(sorted(unknown))}")
+    for key, (variable, parse) in _ENV.items():
+        if os.environ.get(variable):
+            config[key] = parse(os.environ[variable])
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    if config["exporter"] not in EXPORTERS:
+        raise ValueError(f"Unknown tracing exporter: {config['exporter']}")
+    return config
+
+
+_instrumented = set()
+
+
+def _installed(module):
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ModuleNotFoundError:
+        # A parent package of a dotted name is missing
+        return False
+
+
+def instrument(names, app=None, config=None):
+    # Instrumentors are imported only when selected, and skipped when the
+    # library they patch (or the instrumentation package) is not installed.
+    # Each patches its library once per process; only Flask apps are
+    # instrumented one by one
+    config = config or tracing_config()
+    instrumented = []
+    for name in names:
+        library, instrument_library = INSTRUMENTATIONS[name]
+        if name in _instrumented and (name != "flask" or app is None):
+            instrumented.append(name)
+            continue
+        if not _installed(library):
+            continue
+        try:
+            instrument_library(app, config)
+        except ImportError:
+            continue
+        _instrumented.add(name)
+        instrumented.append(name)
+    return instrumented
+
+
+_telemetry_server = None
+_provider = None
+
+
+def telemetry_server(port):
+    # One per process however many times tracing is set up
+    global _telemetry_server
+    if _telemetry_server is None:
+        _telemetry_server = start_telemetry_server(port)
+    return _telemetry_server
+
+
+def setup_tracing(app = None, service_name=None, sampling_rate=None, profile=None, **options):
+    global _provider
+    config = tracing_config(profile, service_name=service_name, sampling_rate=sampling_rate, **options)
+    if not config["enabled"]:
+        return None
+    if _provider is not None:
+        # Set up once per process (a Flask app and the Celery app it imports
+        # both call this): the global provider cannot be replaced, and a
+        # second pipeline would only add export threads and fork and
+        # shutdown hooks. Later calls instrument their app
+        instrument(config["instrumentations"], app, config)
+        return _provider
+
+    if config["spans_per_second"] is not None:
+        # Adaptive per-route / per-task budgets instead of a fixed ratio
+        sampler = ParentBased(RateLimitingSampler(config["spans_per_second"],
+                                                  budgets=config["sampling_budgets"]))
+    else:
+        sampler = ParentBasedTraceIdRatio(config["sampling_rate"])
+    if config["span_metrics"]:
+        # Unsampled spans are still recorded so the RED metrics stay exact.
+        # They are built in full, and code that skips work for spans that
+        # are not recording (trace_function, log enrichment) no longer does
+        sampler = RecordingSampler(sampler)
+    resource = Resource.create(attributes={SERVICE_NAME: config["service_name"]})
+    trace_provider = _provider = TracerProvider(sampler=sampler, resource=resource)
+    trace.set_tracer_provider(trace_provider)
+    if config["span_metrics"]:
+        trace_provider.add_span_processor(span_metrics_processor())
+    if config["profiler_hz"]:
+        # Keyword arguments for SpanProfiler go in `profiler`
+        from common.profiler import span_profiler
+
+        trace_provider.add_span_processor(span_profiler(hz=config["profiler_hz"], **(config["profiler"] or {})))
+
+    make_processor = EXPORTERS[config["exporter"]]
+    if make_processor is not None:
+        def build_processor():
+            span_processor = make_processor(config)
+            if config["tail_sampling"] is not None:
+                # Keyword arguments for TailSamplingSpanProcessor; use with sampling_rate=1
+                span_processor = TailSamplingSpanProcessor(span_processor, **config["tail_sampling"])
+            return span_processor
+
+        trace_provider.add_span_processor(lifecycle.register(ForkSafeSpanProcessor(build_processor)))
+
+    if config["telemetry_port"]:
+        telemetry_server(config["telemetry_port"])
+
+    instrument(config["instrumentations"], app, config)
+    return trace_provider
+
+def add_trace_context_to_loguru():
+    # Adds otel_trace_id / otel_span_id to every loguru record's extra
+    install_loguru()
@@ -1,12 +1,201 @@
+import inspect
+import reprlib
 from functools import wraps
-from opentelemetry import trace
 
-def trace_function(name):
+from opentelemetry import context, trace
+from opentelemetry.trace import Status, StatusCode
+
+# @trace_function("name") wraps a function, coroutine, generator or async
+# generator in a span. The tracer is resolved once, at import. With no span
+# in context a span is started and the sampler decides, as before; under a
+# parent that is not recording (unsampled, without span metrics) the
+# function is called as is, with one context lookup of overhead.
+#
+# A generator's span runs from the call until it is exhausted or closed, and
+# is current only while the generator body runs, not in the code consuming
+# it. capture_args / capture_result record arguments and the return value as
+# function.arg.<name> / function.result attributes, strings cut at
+# `max_length`. Other values go through reprlib, so a large container is
+# summarized rather than rendered whole on every call.
+
+_tracer = trace.get_tracer(__name__)
+
+MAX_ARGS = 16
+_PRIMITIVES = (bool, int, float)
+
+
+def _repr(max_length):
+    # Bounded repr(): a few items per container, nested two levels deep
+    bounded = reprlib.Repr()
+    bounded.maxlevel = 2
+    bounded.maxstring = bounded.maxother = max_length
+    return bounded.repr
+
+
+def _value(value, max_length, bounded_repr):
+    if isinstance(value, _PRIMITIVES):
+        return value
+    value = value if isinstance(value, str) else bounded_repr(value)
+    return value if len(value) <= max_length else value[:max_length] + "..."
+
+
+def _fail(span, error):
+    span.record_exception(error)
+    span.set_status(Status(StatusCode.ERROR, f"{type(error).__name__}: {error}"))
+
+
+def trace_function(name=None, capture_args=False, capture_result=False, max_length=128):
+    if callable(name):
+        # Bare @trace_function
+        return trace_function()(name)
+
     def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            tracer = trace.get_tracer(__name__)
-            with tracer.start_as_current_span(name):
-                return func(*args, **kwargs)
+        span_name = name or func.__qualname__
+        attributes = {"code.function": func.__qualname__, "code.namespace": func.__module__}
+        signature = inspect.signature(func) if capture_args else None
+        bounded_repr = _repr(max_length)
+
+        def active():
+            # False for the untraced path: a parent that was not sampled.
+            # With no parent at all the sampler makes the call.
+            span = trace.get_current_span()
+            return span.is_recording() or not span.get_span_context().is_valid
+
+        def start(args, kwargs):
+            if signature is None:
+                return _tracer.start_span(span_name, attributes=attributes)
+            span_attributes = dict(attributes)
+            try:
+                bound = signature.bind_partial(*args, **kwargs).arguments
+            except TypeError:
+                bound = {}
+            for index, (arg_name, value) in enumerate(bound.items()):
+                if index >= MAX_ARGS:
+                    break
+                if arg_name not in ("self", "cls"):
+                    span_attributes[f"function.arg.{arg_name}"] = _value(value, max_length, bounded_repr)
+            return _tracer.start_span(span_name, attributes=span_attributes)
+
+        def finish(span, result):
+            if capture_result and span.is_recording():
+                span.set_attribute("function.result", _value(result, max_length, bounded_repr))
+
+        if inspect.isasyncgenfunction(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not active():
+                    return func(*args, **kwargs)
+                span = start(args, kwargs)
+                return _traced_async_generator(span, func(*args, **kwargs))
+        elif inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                if not active():
+                    return await func(*args, **kwargs)
+                span = start(args, kwargs)
+                token = context.attach(trace.set_span_in_context(span))
+                try:
+                    result = await func(*args, **kwargs)
+                    finish(span, result)
+                    return result
+                except BaseException as error:
+                    _fail(span, error)
+                    raise
+                finally:
+                    context.detach(token)
+                    span.end()
+        elif inspect.isgeneratorfunction(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not active():
+                    return func(*args, **kwargs)
+                span = start(args, kwargs)
+                return _traced_generator(span, func(*args, **kwargs), finish)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not active():
+                    return func(*args, **kwargs)
+                span = start(args, kwargs)
+                token = context.attach(trace.set_span_in_context(span))
+                try:
+                    result = func(*args, **kwargs)
+                    finish(span, result)
+                    return result
+                except BaseException as error:
+                    _fail(span, error)
+                    raise
+                finally:
+                    context.detach(token)
+                    span.end()
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
+
+
+def _traced_generator(span, generator, finish):
+    # Drives `generator` step by step so its span is current only inside it;
+    # values sent and exceptions thrown in are passed through
+    span_context = trace.set_span_in_context(span)
+    method, value = generator.send, None
+    try:
+        while True:
+            token = context.attach(span_context)
+            try:
+                item = method(value)
+            except StopIteration as stop:
+                finish(span, stop.value)
+                return stop.value
+            finally:
+                context.detach(token)
+            try:
+                value = yield item
+                method = generator.send
+            except GeneratorExit:
+                token = context.attach(span_context)
+                try:
+                    generator.close()
+                finally:
+                    context.detach(token)
+                raise
+            except BaseException as error:
+                method, value = generator.throw, error
+    except GeneratorExit:
+        raise
+    except BaseException as error:
+        _fail(span, error)
+        raise
+    finally:
+        span.end()
+
+
+async def _traced_async_generator(span, generator):
+    span_context = trace.set_span_in_context(span)
+    method, value = generator.asend, None
+    try:
+        while True:
+            token = context.attach(span_context)
+            try:
+                item = await method(value)
+            except StopAsyncIteration:
+                return
+            finally:
+                context.detach(token)
+            try:
+                value = yield item
+                method = generator.asend
+            except GeneratorExit:
+                token = context.attach(span_context)
+                try:
+                    await generator.aclose()
+                finally:
+                    context.detach(token)
+                raise
+            except BaseException as error:
+                method, value = generator.athrow, error
+    except GeneratorExit:
+        raise
+    except BaseException as error:
+        _fail(span, error)
+        raise
+    finally:
+        span.end()
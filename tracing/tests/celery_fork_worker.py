@@ -0,0 +1,98 @@
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+# Run by test_fork_safety.py in a process of its own: a prefork Celery worker
+# on the in-memory broker, exporting spans over OTLP and logs to Loki, both to
+# a stub receiver in the worker's main process. Writes what the receiver got
+# from the pool processes while the pool was still running, then after its
+# shutdown, as JSON to `output` (Celery redirects stdout). A child that kept
+# the parent's pipelines has no export threads, so its spans and logs never
+# arrive before shutdown, if at all.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+from harness import StubReceiver  # noqa: E402
+
+receiver = StubReceiver(status=204)
+os.environ["LOKI_URL"] = f"{receiver.url}/loki/api/v1/push"
+
+from celery import Celery  # noqa: E402
+from loguru import logger  # noqa: E402
+from opentelemetry import trace  # noqa: E402
+
+from common.lifecycle import install_celery_hooks  # noqa: E402
+from common.logger import loki_sink  # noqa: E402,F401
+from common.tracing import setup_tracing  # noqa: E402
+
+
+def run_spans():
+    return [span for span in receiver.spans() if span.name.startswith("run/")]
+
+
+def span_pids():
+    return sorted({attribute.value.int_value for span in run_spans()
+                   for attribute in span.attributes if attribute.key == "worker.pid"})
+
+
+def log_pids():
+    with receiver._lock:
+        bodies = [body for path, body in receiver.bodies if path == "/loki/api/v1/push"]
+    pids = set()
+    for body in bodies:
+        for stream in json.loads(body)["streams"]:
+            for value in stream["values"]:
+                if "pool process" in value[1]:
+                    pids.add(int(value[1].rsplit(" ", 1)[1]))
+    return sorted(pids)
+
+
+def main(tasks, concurrency, timeout, output):
+    setup_tracing(service_name="fork-check", instrumentations=["celery"],
+                  otlp_endpoint=f"{receiver.url}/v1/traces", export_interval=0.1)
+    install_celery_hooks()
+
+    app = Celery("fork_check", broker="memory://")
+    app.conf.update(task_ignore_result=True, worker_hijack_root_logger=False,
+                    broker_transport_options={"polling_interval": 0.01})
+
+    @app.task(name="fork_check.work")
+    def work(index):
+        trace.get_current_span().set_attribute("worker.pid", os.getpid())
+        logger.warning("fork check from pool process {}", os.getpid())
+        return index
+
+    for index in range(tasks):
+        work.delay(index)
+    # Export the producer spans and logs now, so the parent holds live
+    # keep-alive connections and running export threads when the pool forks
+    trace.get_tracer_provider().force_flush()
+    logger.warning("fork check from main process {}", os.getpid())
+    loki_sink.flush(5)
+
+    result = {"parent_pid": os.getpid(), "tasks": tasks}
+
+    def stop_when_done():
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and (len(run_spans()) < tasks or len(log_pids()) < len(span_pids())
+                                               or not log_pids()):
+            time.sleep(0.1)
+        result["running"] = {"task_spans": len(run_spans()), "span_pids": span_pids(), "log_pids": log_pids()}
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    threading.Thread(target=stop_when_done, daemon=True).start()
+    app.worker_main(["worker", "--loglevel=WARNING", "--pool=prefork", f"--concurrency={concurrency}",
+                     "--without-heartbeat", "--without-gossip", "--without-mingle"])
+    time.sleep(0.5)
+    result["after_shutdown"] = {"task_spans": len(run_spans()), "span_pids": span_pids(),
+                                "log_pids": log_pids()}
+    with open(output, "w") as f:
+        json.dump(result, f)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]), int(sys.argv[2]), float(sys.argv[3]), sys.argv[4])
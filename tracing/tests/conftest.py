@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# Tests run from anywhere, like the benchmarks: make the service modules and
+# the benchmark harness (StubReceiver) importable
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "benchmarks")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture
+def receiver():
+    from harness import StubReceiver
+
+    stub = StubReceiver()
+    yield stub
+    stub.close()
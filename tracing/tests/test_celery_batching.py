@@ -0,0 +1,33 @@
+import pytest
+from celery import Celery
+
+from common.celery_batching import BatchedTask, BatchItemError
+
+
+def test_a_failed_publish_fails_its_calls_and_the_next_batch_still_goes_out(monkeypatch):
+    app = Celery("batching_check", broker="memory://")
+    batched = BatchedTask(app, lambda value: value, name="batching_check.echo", max_items=100, window=0.01)
+    apply_async = batched.task.apply_async
+    calls = []
+
+    def publish_once_failing(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise ConnectionError("broker down")
+        return apply_async(*args, **kwargs)
+
+    monkeypatch.setattr(batched.task, "apply_async", publish_once_failing)
+    try:
+        first = [batched.delay(index) for index in range(3)]
+        with pytest.raises(BatchItemError, match="broker down"):
+            first[0].get(timeout=5)
+        assert not any(result.published for result in first)
+
+        second = batched.delay(3)
+        second._published.wait(5)
+        assert second.published
+        assert batched._thread.is_alive()
+        assert (batched.failed_batches, batched.failed_items) == (1, 3)
+        assert (batched.published_batches, batched.published_items) == (1, 1)
+    finally:
+        batched.close()
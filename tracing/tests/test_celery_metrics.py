@@ -0,0 +1,93 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from celery import Celery
+from celery.worker import state
+from kombu import Message
+from kombu.serialization import dumps
+
+from common.celery_metrics import EXECUTION, PREFETCH_WAIT, QUEUE_WAIT, UNACKED, QueueSampler, TimedRequest
+
+
+@pytest.fixture
+def app():
+    app = Celery("metrics_check", broker="memory://")
+
+    @app.task(name="metrics_check.early")
+    def early():
+        pass
+
+    @app.task(name="metrics_check.late", acks_late=True)
+    def late():
+        pass
+
+    return app
+
+
+def request(app, name, queue, enqueued_at):
+    headers, properties, body, _ = app.amqp.as_task_v2(f"{name}-id", name, args=(), kwargs={})
+    headers["enqueued_at"] = enqueued_at
+    content_type, content_encoding, payload = dumps(body, "json")
+    message = Message(body=payload, headers=headers, delivery_info={"routing_key": queue},
+                      content_type=content_type, content_encoding=content_encoding, **properties)
+    acks = []
+    return TimedRequest(message, app=app, task=app.tasks[name], on_ack=lambda *args: acks.append(1)), acks
+
+
+def observations(histogram, *labels):
+    values = histogram._series.get(labels)
+    return None if values is None else (sum(values[:-1]), values[-1])
+
+
+def test_timed_request_records_waits_and_acks_late_execution(app):
+    late, acks = request(app, "metrics_check.late", "metrics-late", time.time() - 2.0)
+    assert late.request_dict["received_at"] == late.received_at
+    late.on_accepted(1, time.monotonic())
+    # acks_late: acknowledged once the task has run
+    assert acks == []
+    labels = ("metrics-late", "metrics_check.late")
+    count, total = observations(QUEUE_WAIT, *labels)
+    assert count == 1 and 1.9 < total < 3.0
+    assert observations(PREFETCH_WAIT, *labels)[0] == 1
+
+    time.sleep(0.05)
+    late.acknowledge()
+    late.acknowledge()
+    assert acks == [1]
+    assert observations(UNACKED, *labels)[0] == 1
+    count, total = observations(EXECUTION, *labels)
+    assert count == 1 and total >= 0.05
+
+
+def test_timed_request_acks_early_tasks_on_start_without_execution(app):
+    early, acks = request(app, "metrics_check.early", "metrics-early", time.time())
+    early.on_accepted(1, time.monotonic())
+    labels = ("metrics-early", "metrics_check.early")
+    assert acks == [1]
+    assert observations(UNACKED, *labels)[0] == 1
+    assert observations(EXECUTION, *labels) is None
+
+
+def test_queue_sampler_reports_depth_and_prefetch(app):
+    for _ in range(3):
+        app.tasks["metrics_check.early"].apply_async(queue="metrics-depth")
+    sampler = QueueSampler(app, queues=["metrics-depth"])
+    sampler.consumer = SimpleNamespace(qos=SimpleNamespace(value=4))
+    sampler.sample()
+    reserved, _ = request(app, "metrics_check.early", "metrics-depth", time.time())
+    state.reserved_requests.add(reserved)
+    try:
+        metrics = {name: samples for name, _, _, samples in sampler.collect()}
+    finally:
+        state.reserved_requests.discard(reserved)
+    assert metrics["celery_queue_messages"] == [({"queue": "metrics-depth"}, 3)]
+    assert metrics["celery_worker_reserved_tasks"] == [({"queue": "metrics-depth"}, 1)]
+    assert metrics["celery_worker_prefetch_limit"] == [({}, 4)]
+    assert metrics["celery_worker_prefetch_occupancy"] == [({}, 0.25)]
+
+    # A queue the broker does not know fails the sample; the last depths stay
+    sampler.queues.append("metrics-missing")
+    sampler.sample()
+    assert sampler.errors == 1
+    assert sampler.collect()[0][3] == [({"queue": "metrics-depth"}, 3)]
@@ -0,0 +1,44 @@
+import pytest
+from celery import Celery
+from kombu.messaging import Producer
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import StatusCode
+
+from common import celery_tracing
+
+
+@pytest.fixture
+def spans():
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    send_task = Celery.send_task
+    celery_tracing.instrument_celery(tracer_provider=provider)
+    yield exporter
+    celery_tracing.uninstrument_celery()
+    assert Celery.send_task is send_task
+    provider.shutdown()
+
+
+def test_failed_publish_ends_the_producer_span(spans, monkeypatch):
+    app = Celery("publish_check", broker="memory://")
+
+    @app.task(name="publish_check.work")
+    def work():
+        pass
+
+    def broker_down(*args, **kwargs):
+        raise ConnectionError("broker down")
+
+    work.delay()
+    monkeypatch.setattr(Producer, "_publish", broker_down)
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            work.delay()
+
+    assert celery_tracing._publishing == {}
+    finished = [span for span in spans.get_finished_spans() if span.name == "apply_async/publish_check.work"]
+    assert [span.status.status_code for span in finished] == [StatusCode.UNSET] + [StatusCode.ERROR] * 3
+    assert finished[-1].events[0].name == "exception"
@@ -0,0 +1,53 @@
+import pytest
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ALWAYS_OFF
+
+import decorators
+from decorators import trace_function
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(decorators, "_tracer", provider.get_tracer(__name__))
+    yield exporter
+    provider.shutdown()
+
+
+def test_a_span_is_started_with_no_span_in_context(exporter):
+    @trace_function("work")
+    def work():
+        return 1
+
+    assert work() == 1
+    assert [span.name for span in exporter.get_finished_spans()] == ["work"]
+
+
+def test_an_unsampled_parent_takes_the_untraced_path(exporter):
+    parent_tracer = TracerProvider(sampler=ALWAYS_OFF).get_tracer(__name__)
+
+    @trace_function("work")
+    def work():
+        return 1
+
+    with parent_tracer.start_as_current_span("parent"):
+        assert work() == 1
+    assert exporter.get_finished_spans() == ()
+
+
+def test_captured_containers_are_summarized(exporter):
+    @trace_function("work", capture_args=True, capture_result=True, max_length=64)
+    def work(items, mapping):
+        return items
+
+    items = list(range(1_000_000))
+    work(items, {"key": "x" * 10_000, "nested": {"a": [items]}})
+    attributes = exporter.get_finished_spans()[0].attributes
+    assert attributes["function.arg.items"].startswith("[0, 1, 2, 3, 4, 5, ...]")
+    assert attributes["function.result"] == attributes["function.arg.items"]
+    assert len(attributes["function.arg.mapping"]) <= 64 + 3
+    assert "xxx" in attributes["function.arg.mapping"]
@@ -0,0 +1,22 @@
+import json
+import os
+import subprocess
+import sys
+
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "celery_fork_worker.py")
+
+
+def test_prefork_pool_processes_export_their_own_spans_and_logs(tmp_path):
+    output = tmp_path / "result.json"
+    tasks = 40
+    subprocess.run([sys.executable, WORKER, str(tasks), "2", "15", str(output)], capture_output=True,
+                   timeout=90, check=True)
+    result = json.loads(output.read_text())
+
+    running = result["running"]
+    # Exported by the pool processes' own pipelines while they ran, not by
+    # the flush on worker shutdown
+    assert running["task_spans"] == tasks
+    assert running["span_pids"] and result["parent_pid"] not in running["span_pids"]
+    assert running["log_pids"] == running["span_pids"]
+    assert result["after_shutdown"]["task_spans"] == tasks
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+
+from common.http_client import HttpClient
+
+
+@pytest.fixture
+def client():
+    client = HttpClient(tries=3, delay=0.0, retry_methods={"POST"})
+    yield client
+    client.close()
+
+
+@pytest.mark.parametrize("status, requests", [(503, 3), (500, 1), (404, 1), (200, 1)])
+def test_only_retryable_statuses_are_retried(client, receiver, status, requests):
+    receiver.status = status
+    response = client.post(f"{receiver.url}/push", data=b"x")
+    assert response.status_code == status
+    assert receiver.requests == requests
+
+
+def test_non_idempotent_calls_are_not_retried(receiver):
+    client = HttpClient(tries=3, delay=0.0)
+    receiver.status = 503
+    assert client.post(f"{receiver.url}/push", data=b"x").status_code == 503
+    assert receiver.requests == 1
+    client.close()
+
+
+class RecordingClient(HttpClient):
+    # Answers each call with its own URL after `delay`, from a pool thread
+    def __init__(self):
+        super().__init__(max_workers=4)
+        self.seen = []
+
+    def request(self, method, url, delay=0.0, **kwargs):
+        time.sleep(delay)
+        self.seen.append((url, trace.get_current_span().get_span_context().span_id, threading.current_thread().name))
+        if url == "fail":
+            raise ConnectionError(url)
+        return url
+
+
+def test_fan_out_keeps_the_callers_context_and_order():
+    client = RecordingClient()
+    tracer = TracerProvider().get_tracer(__name__)
+    calls = [{"method": "GET", "url": str(index), "delay": (4 - index) * 0.02} for index in range(4)]
+    with tracer.start_as_current_span("caller") as span:
+        assert client.fan_out(calls) == ["0", "1", "2", "3"]
+    # Finished last to first, on the pool's threads, all under the caller's span
+    assert [url for url, _, _ in client.seen] == ["3", "2", "1", "0"]
+    assert {context for _, context, _ in client.seen} == {span.get_span_context().span_id}
+    assert all(name.startswith("http-fan-out") for _, _, name in client.seen)
+
+    results = client.fan_out([{"method": "GET", "url": "0"}, {"method": "GET", "url": "fail"}],
+                             return_exceptions=True)
+    assert results[0] == "0" and isinstance(results[1], ConnectionError)
+    with pytest.raises(ConnectionError):
+        client.fan_out([{"method": "GET", "url": "fail"}])
+    client.close()
@@ -0,0 +1,57 @@
+from loguru import logger
+
+from common.log_sampling import TraceAwareLogFilter
+
+
+def capture(log_filter, repeats=False):
+    lines = []
+
+    def sink(message):
+        record = message.record
+        suffix = f" (+{log_filter.repeated(record)})" if repeats and log_filter.repeated(record) else ""
+        lines.append(f"{record['level'].name} {record['message']}{suffix}")
+
+    handler = logger.add(sink, format="{message}", level="INFO", filter=log_filter)
+    return lines, handler
+
+
+def test_limits_per_message_template_not_per_call_site():
+    log_filter = TraceAwareLogFilter(rate_limit=2)
+    lines, handler = capture(log_filter)
+    try:
+        for message in ["disk full", "timeout", "disk full", "disk full", "user 1 failed", "user 22 failed",
+                        "user 333 failed", "timeout"]:
+            logger.info(message)
+    finally:
+        logger.remove(handler)
+    assert lines == ["INFO disk full", "INFO timeout", "INFO disk full", "INFO user 1 failed",
+                     "INFO user 22 failed", "INFO timeout"]
+
+
+def test_always_levels_are_not_rate_limited():
+    log_filter = TraceAwareLogFilter(rate_limit=1)
+    lines, handler = capture(log_filter)
+    try:
+        for _ in range(5):
+            logger.error("boom")
+    finally:
+        logger.remove(handler)
+    assert lines == ["ERROR boom"] * 5
+
+
+def test_repeats_reach_the_sink_but_not_the_shared_extra():
+    log_filter = TraceAwareLogFilter(rate_limit=1)
+    lines, handler = capture(log_filter, repeats=True)
+    other = []
+    other_handler = logger.add(lambda message: other.append(dict(message.record["extra"])), level="INFO")
+    try:
+        for _ in range(4):
+            logger.info("same")
+        # Next window
+        log_filter._sites["same"].window_start -= log_filter.rate_window
+        logger.info("same")
+    finally:
+        logger.remove(handler)
+        logger.remove(other_handler)
+    assert lines == ["INFO same", "INFO same (+3)"]
+    assert all("repeated" not in extra for extra in other)
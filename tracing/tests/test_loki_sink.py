@@ -0,0 +1,46 @@
+import json
+
+from loguru import logger
+
+from common.logger import UNREPRESENTABLE, LokiSink
+
+
+class Unrepresentable:
+    def __str__(self):
+        raise RuntimeError("no str")
+
+    def __repr__(self):
+        raise RuntimeError("no repr")
+
+
+def lines(receiver):
+    with receiver._lock:
+        bodies = [body for path, body in receiver.bodies if path == "/loki/api/v1/push"]
+    return [value[1] for body in bodies for stream in json.loads(body)["streams"] for value in stream["values"]]
+
+
+def test_unrenderable_fields_do_not_stop_the_sink_thread(receiver):
+    receiver.status = 204
+    sink = LokiSink(url=f"{receiver.url}/loki/api/v1/push", flush_interval=0.05, name="test-loki-render")
+    handler = logger.add(sink, format="{message}", level="INFO",
+                         filter=lambda record: record["extra"].get("render_check"))
+    nested = []
+    for _ in range(5000):
+        nested = [nested]
+    try:
+        log = logger.bind(render_check=True)
+        log.info("bad value", value=Unrepresentable(), ok=1)
+        log.info("too deep", value=nested)
+        log.info("after")
+        assert sink.flush(5)
+    finally:
+        logger.remove(handler)
+        sink.close()
+
+    shipped = lines(receiver)
+    assert sink._thread is not None
+    assert any("message: after " in line for line in shipped)
+    assert any("too deep" in line and UNREPRESENTABLE in line for line in shipped)
+    bad = next(line for line in shipped if "bad value" in line)
+    assert json.loads(bad.split("fields=", 1)[1]) == {"render_check": True, "value": UNREPRESENTABLE, "ok": 1}
+    assert sink.telemetry.snapshot()["dropped"].get("render_error") == 2
@@ -0,0 +1,41 @@
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import TraceIdRatioBased
+
+from common.metrics import Histogram, SpanMetricsProcessor
+from common.sampling import RecordingSampler
+
+
+def test_span_metrics_count_every_span_at_any_sampling_rate():
+    metrics = SpanMetricsProcessor()
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider(sampler=RecordingSampler(TraceIdRatioBased(0.1)))
+    provider.add_span_processor(metrics)
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = provider.get_tracer(__name__)
+    for _ in range(1000):
+        tracer.start_span("GET /hello/<name>").end()
+
+    (requests, _) = metrics.collect()
+    assert requests[3] == [({"span_name": "GET /hello/<name>", "span_kind": "internal", "status": "unset"}, 1000)]
+    assert 0 < len(exporter.get_finished_spans()) < 300
+
+
+def test_a_duration_on_a_bucket_bound_counts_in_that_bucket():
+    metrics = SpanMetricsProcessor(buckets=(0.05, 0.1, 0.5))
+    provider = TracerProvider()
+    provider.add_span_processor(metrics)
+    span = provider.get_tracer(__name__).start_span("work", start_time=int(1e9))
+    span.end(end_time=int(1.1e9))
+
+    (_, durations) = metrics.collect()
+    buckets = {labels["le"]: value for name, labels, value in durations[3] if name.endswith("_bucket")}
+    assert buckets == {"0.05": 0, "0.1": 1, "0.5": 1, "+Inf": 1}
+
+    histogram = Histogram("test_seconds", "Test", ("queue",), buckets=(0.05, 0.1, 0.5))
+    histogram.observe(0.1, "q")
+    histogram.observe(0.10001, "q")
+    (_, _, _, samples) = histogram.collect()[0]
+    buckets = {labels["le"]: value for name, labels, value in samples if name.endswith("_bucket")}
+    assert buckets == {"0.05": 0, "0.1": 1, "0.5": 2, "+Inf": 2}
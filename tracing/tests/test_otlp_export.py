@@ -0,0 +1,68 @@
+import time
+
+from opentelemetry.sdk.trace import TracerProvider
+
+from common.otlp_export import OTLPExportProcessor
+from common.spool import ExportBuffer
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_spooled_batches_replay_while_traffic_flows(receiver):
+    buffer = ExportBuffer()
+    processor = OTLPExportProcessor(f"{receiver.url}/v1/traces", flush_interval=0.05, max_retries=0,
+                                    buffer=buffer, name="test-replay")
+    provider = TracerProvider()
+    provider.add_span_processor(processor)
+    tracer = provider.get_tracer(__name__)
+
+    receiver.status = 503
+    for index in range(3):
+        tracer.start_span(f"outage-{index}").end()
+        assert wait_for(lambda: len(buffer) == index + 1, 2.0)
+
+    # Collector back, a span every 20 ms: the backlog must go out while the
+    # traffic is still flowing, not once it stops
+    receiver.status = 200
+    deadline = time.monotonic() + 5.0
+    sent = 0
+    while len(buffer) and time.monotonic() < deadline:
+        tracer.start_span(f"live-{sent}").end()
+        sent += 1
+        time.sleep(0.02)
+    assert len(buffer) == 0
+    for index in range(10):
+        tracer.start_span(f"after-{index}").end()
+        time.sleep(0.02)
+    processor.force_flush()
+
+    names = [span.name for span in receiver.spans()]
+    assert [name for name in names if name.startswith("outage-")] == ["outage-0", "outage-1", "outage-2"]
+    # Nothing that ended after the backlog was gone got ahead of it
+    assert names.index("outage-2") < names.index("after-0")
+    assert processor.telemetry.snapshot()["events"]["replayed"] == 3
+    provider.shutdown()
+
+
+def test_refused_batches_are_dropped_and_counted(receiver):
+    processor = OTLPExportProcessor(f"{receiver.url}/v1/traces", flush_interval=0.05, buffer=ExportBuffer(),
+                                    name="test-refused")
+    provider = TracerProvider()
+    provider.add_span_processor(processor)
+    tracer = provider.get_tracer(__name__)
+
+    receiver.status = 400
+    tracer.start_span("a").end()
+    tracer.start_span("b").end()
+    processor.force_flush()
+    assert receiver.requests == 1
+    assert processor.telemetry.snapshot()["dropped"] == {"http_400": 2}
+    assert len(processor._buffer) == 0
+    provider.shutdown()
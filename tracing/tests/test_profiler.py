@@ -0,0 +1,33 @@
+import threading
+
+from opentelemetry.sdk.trace import TracerProvider
+
+from common.profiler import SpanProfiler
+
+
+def test_thread_churn_leaves_no_entries_behind():
+    profiler = SpanProfiler(hz=1000)
+    provider = TracerProvider()
+    provider.add_span_processor(profiler)
+    tracer = provider.get_tracer(__name__)
+
+    def request():
+        with tracer.start_as_current_span("request"):
+            pass
+
+    handed_over = []
+
+    def start_only():
+        # Ended on another thread once this one has exited
+        handed_over.append(tracer.start_span("handed over"))
+
+    for target in [request] * 50 + [start_only] * 5:
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+    for span in handed_over:
+        span.end()
+    profiler.sample()
+    assert profiler._open == {}
+    assert profiler._owner == {}
+    profiler.close()
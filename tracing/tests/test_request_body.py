@@ -0,0 +1,53 @@
+import io
+
+import pytest
+from flask import Flask, request
+from werkzeug.exceptions import HTTPException
+
+from common.exception import CoreApi
+from common.request_body import SUMMARY_BYTES, read_json, summarize
+from views.test import TestHandler
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    TestHandler.init(CoreApi(app, catch_all_404s=True))
+    return app.test_client()
+
+
+@pytest.mark.parametrize("body", [b"", b"  \n", b'{"a": ', b"not json", b"\xff\xfe"])
+def test_empty_or_malformed_bodies_are_a_400(client, body):
+    response = client.post("/test", data=body, content_type="application/json")
+    assert response.status_code == 400
+    assert "message" in response.get_json()
+
+
+def test_a_body_over_the_limit_is_a_413():
+    app = Flask(__name__)
+    body = b"[" + b"1," * 600 + b"1]"
+    with app.test_request_context("/test", method="POST", data=body):
+        with pytest.raises(HTTPException) as error:
+            read_json(max_bytes=1024)
+        assert error.value.code == 413
+    # No Content-Length: refused once the stream passes the limit
+    with app.test_request_context("/test", method="POST", input_stream=io.BytesIO(body),
+                                  headers={"Transfer-Encoding": "chunked"},
+                                  environ_overrides={"wsgi.input_terminated": True}):
+        assert request.content_length is None
+        with pytest.raises(HTTPException) as error:
+            read_json(max_bytes=1024)
+        assert error.value.code == 413
+    with app.test_request_context("/test", method="POST", data=body):
+        assert read_json(max_bytes=len(body)) == ([1] * 601, len(body))
+
+
+def test_summarize_keeps_small_payloads_and_describes_large_ones():
+    assert summarize({"a": 1}, 8) == {"a": 1}
+    large = {f"key-{index}" + "x" * 100: index for index in range(100)}
+    summary = summarize(large, SUMMARY_BYTES + 1)
+    assert summary["bytes"] == SUMMARY_BYTES + 1
+    assert (summary["type"], summary["keys"], len(summary["first_keys"])) == ("dict", 100, 16)
+    assert all(len(key) == 64 for key in summary["first_keys"])
+    assert summarize(list(range(500)), 2000) == {"bytes": 2000, "type": "list", "items": 500}
+    assert summarize("x" * 2000, 2002) == {"bytes": 2002, "type": "str"}
@@ -0,0 +1,122 @@
+import random
+
+import pytest
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.id_generator import RandomIdGenerator
+from opentelemetry.sdk.trace.sampling import Decision
+from opentelemetry.trace import Status, StatusCode
+
+from common import sampling
+from common.sampling import RateLimitingSampler, TailSamplingSpanProcessor
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_sampling_probability_extrapolates_to_the_arrivals_under_a_burst(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sampling.time, "monotonic", clock.monotonic)
+    random.seed(4)
+    sampler = RateLimitingSampler(spans_per_second=10, window=10.0)
+
+    # 20/s, a 2000/s burst for 3 s, then 20/s again
+    rates = [20] * 15 + [2000] * 3 + [20] * 15
+    arrivals = 0
+    weight = 0.0
+    kept = 0
+    for rate in rates:
+        for _ in range(rate):
+            clock.now += 1.0 / rate
+            arrivals += 1
+            result = sampler.should_sample(None, random.getrandbits(128), "GET /hello/<name>")
+            if result.decision is Decision.RECORD_AND_SAMPLE:
+                kept += 1
+                weight += 1.0 / result.attributes["sampling.probability"]
+
+    assert kept <= 10 * len(rates) + 10
+    assert abs(weight - arrivals) / arrivals < 0.02
+
+
+class FixedIds(RandomIdGenerator):
+    def __init__(self):
+        self.trace_ids = []
+
+    def generate_trace_id(self):
+        return self.trace_ids.pop(0)
+
+
+# Low 64 bits below or above the bound of a 0.5 baseline
+IN_BASELINE = (7 << 64) | 1
+OUT_OF_BASELINE = (7 << 64) | (1 << 63) | 1
+
+
+@pytest.fixture
+def tail():
+    exporter = InMemorySpanExporter()
+    ids = FixedIds()
+    processor = TailSamplingSpanProcessor(SimpleSpanProcessor(exporter), baseline_rate=0.5,
+                                          latency_thresholds={"/slow": 0.5}, max_traces=1)
+    provider = TracerProvider(id_generator=ids)
+    provider.add_span_processor(processor)
+    yield provider.get_tracer(__name__), ids, processor, exporter
+    provider.shutdown()
+
+
+def kept_traces(exporter):
+    return {span.context.trace_id for span in exporter.get_finished_spans()}
+
+
+def test_tail_sampling_keeps_errors_5xx_and_slow_roots(tail):
+    tracer, ids, processor, exporter = tail
+    ids.trace_ids[:] = [OUT_OF_BASELINE + index for index in range(4)]
+
+    with tracer.start_as_current_span("error"):
+        with tracer.start_as_current_span("child") as child:
+            child.set_status(Status(StatusCode.ERROR))
+    with tracer.start_as_current_span("5xx") as root:
+        root.set_attribute("http.status_code", 503)
+    root = tracer.start_span("GET /slow", attributes={"http.route": "/slow"}, start_time=int(1e9))
+    root.end(end_time=int(1.6e9))
+    root = tracer.start_span("GET /fast", attributes={"http.route": "/fast"}, start_time=int(1e9))
+    root.end(end_time=int(1.4e9))
+
+    assert kept_traces(exporter) == {OUT_OF_BASELINE, OUT_OF_BASELINE + 1, OUT_OF_BASELINE + 2}
+    assert (processor.stats["traces_kept"], processor.stats["traces_dropped"]) == (3, 1)
+
+
+def test_tail_sampling_baseline_follows_the_trace_id(tail):
+    tracer, ids, processor, exporter = tail
+    ids.trace_ids[:] = [trace_id + (index << 96) for index in range(10)
+                        for trace_id in (IN_BASELINE, OUT_OF_BASELINE)]
+    for _ in range(20):
+        tracer.start_span("ok").end()
+    assert kept_traces(exporter) == {IN_BASELINE + (index << 96) for index in range(10)}
+    assert (processor.stats["traces_kept"], processor.stats["traces_dropped"]) == (10, 10)
+
+
+def test_evicted_traces_keep_their_decision_for_late_spans(tail):
+    tracer, ids, processor, exporter = tail
+    ids.trace_ids[:] = [OUT_OF_BASELINE, OUT_OF_BASELINE + 1]
+
+    first = tracer.start_span("first")
+    with trace.use_span(first):
+        with tracer.start_as_current_span("failed") as child:
+            child.set_status(Status(StatusCode.ERROR))
+    second = tracer.start_span("second")
+    with trace.use_span(second):
+        tracer.start_span("child").end()
+    # Over max_traces: the first trace was judged on its failed child
+    assert processor.stats["traces_evicted"] == 1
+    assert [span.name for span in exporter.get_finished_spans()] == ["failed"]
+
+    first.end()
+    second.end()
+    assert [span.name for span in exporter.get_finished_spans()] == ["failed", "first"]
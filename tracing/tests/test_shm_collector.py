@@ -0,0 +1,61 @@
+import os
+
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from common.otlp_export import OTLPExportProcessor
+from common.shm_collector import SharedMemorySpanProcessor, SpanRing, SpanRingDrain
+from common.span_codec import encode_span
+from common.telemetry import pipeline
+
+
+class RingWriter(SpanExporter):
+    def __init__(self, ring):
+        self.ring = ring
+
+    def export(self, spans):
+        for span in spans:
+            self.ring.write(encode_span(span))
+        return SpanExportResult.SUCCESS
+
+
+def test_the_drainer_sends_ring_spans_through_the_otlp_pipeline(tmp_path, receiver):
+    ring = SpanRing(os.path.join(tmp_path, "ring"), capacity=1024 * 1024)
+    senders = []
+
+    def otlp_processor():
+        senders.append(OTLPExportProcessor(f"{receiver.url}/v1/traces", max_batch_size=100,
+                                           flush_interval=60, name="test-shm"))
+        return senders[-1]
+
+    processor = SharedMemorySpanProcessor(ring, otlp_processor, drain_interval=60)
+    processor._drain.max_pending = 200
+    provider = TracerProvider()
+    provider.add_span_processor(processor)
+    tracer = provider.get_tracer(__name__)
+    for index in range(500):
+        tracer.start_span(f"span-{index}").end()
+
+    assert processor.force_flush()
+    assert sorted(span.name for span in receiver.spans()) == sorted(f"span-{index}" for index in range(500))
+    assert len(senders) == 1
+    assert senders[0].telemetry.snapshot()["records_sent"] == 500
+    assert senders[0].telemetry.snapshot()["dropped"] == {}
+    provider.shutdown()
+
+
+def test_records_that_do_not_decode_are_skipped_and_counted(tmp_path):
+    ring = SpanRing(os.path.join(tmp_path, "ring"), capacity=64 * 1024)
+    exporter = InMemorySpanExporter()
+    drain = SpanRingDrain(ring, SimpleSpanProcessor(exporter), telemetry=pipeline("test-shm-decode"))
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(RingWriter(ring)))
+    tracer = provider.get_tracer(__name__)
+
+    tracer.start_span("before").end()
+    ring.write(b"\x00" * 10)
+    tracer.start_span("after").end()
+    assert drain.drain_once() == 3
+    assert [span.name for span in exporter.get_finished_spans()] == ["before", "after"]
+    assert drain.telemetry.snapshot()["dropped"] == {"decode_error": 1}
@@ -0,0 +1,18 @@
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from common.span_codec import SpanDecoder, encode_span
+
+
+def test_long_names_are_cut_on_a_character_boundary():
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    # 2 bytes per character: 0xFFFF bytes would end inside one
+    name = "é" * 40000
+    span = provider.get_tracer(__name__).start_span(name)
+    span.end()
+
+    decoded = SpanDecoder().decode(encode_span(exporter.get_finished_spans()[0]))
+    assert decoded.name == name[:0xFFFF // 2]
@@ -0,0 +1,51 @@
+import os
+
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+
+from common.span_store import SEGMENT_SUFFIX, FileSpanExporter, SpanStore, compact_store
+
+
+def test_compaction_in_the_writer_process_leaves_the_live_segment(tmp_path):
+    directory = str(tmp_path)
+    # A segment left by an earlier run, idle and mergeable
+    earlier = FileSpanExporter(directory, compact=False)
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(earlier))
+    provider.get_tracer(__name__).start_span("earlier").end()
+    provider.shutdown()
+
+    exporter = FileSpanExporter(directory, compact=False)
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = provider.get_tracer(__name__)
+    tracer.start_span("a").end()
+    live = exporter._segment[0]
+
+    # What a second exporter of this process does on its startup thread
+    compact_store(directory)
+    assert os.path.exists(live)
+    tracer.start_span("b").end()
+    provider.shutdown()
+
+    store = SpanStore(directory)
+    assert set(store.names()) == {"earlier", "a", "b"}
+    store.close()
+
+
+def test_pending_segments_are_not_compacted(tmp_path):
+    directory = str(tmp_path)
+    exporter = FileSpanExporter(directory, compact=False)
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    provider.get_tracer(__name__).start_span("a").end()
+    provider.shutdown()
+    # A writer that crashed between creating and renaming its segment
+    with open(os.path.join(directory, f"00000000000000000001-1{SEGMENT_SUFFIX}.new"), "wb") as f:
+        f.write(b"OTSPANS1")
+
+    compact_store(directory)
+    assert [name for name in os.listdir(directory) if name.endswith(".new")] == []
+    store = SpanStore(directory)
+    assert set(store.names()) == {"a"}
+    store.close()
@@ -0,0 +1,52 @@
+import multiprocessing
+import os
+
+from common.spool import ExportBuffer, process_directory
+
+
+def _spool(directory, items, queue):
+    buffer = ExportBuffer(process_directory(directory), memory_limit=0)
+    queue.put((os.path.basename(buffer.directory), buffer.peek(100)[0]))
+    for item in items:
+        buffer.put(item)
+    buffer.close()
+
+
+def _run_worker(context, directory, items):
+    queue = context.Queue()
+    worker = context.Process(target=_spool, args=(directory, items, queue))
+    worker.start()
+    result = queue.get(timeout=10)
+    worker.join(10)
+    return result
+
+
+def test_restarted_worker_resumes_the_backlog_of_the_one_it_replaces(tmp_path):
+    context = multiprocessing.get_context("fork")
+    directory = str(tmp_path)
+
+    slot, backlog = _run_worker(context, directory, [b"a", b"b"])
+    assert (slot, backlog) == ("worker-0", [])
+    # A new pid, the same slot and the spooled items
+    assert _run_worker(context, directory, []) == ("worker-0", [b"a", b"b"])
+    assert sorted(os.listdir(directory)) == ["worker-0"]
+
+
+def test_live_workers_get_their_own_slots(tmp_path):
+    context = multiprocessing.get_context("fork")
+    directory = str(tmp_path)
+    queue = context.Queue()
+    release = context.Event()
+
+    def hold():
+        queue.put(process_directory(directory))
+        release.wait(10)
+
+    workers = [context.Process(target=hold) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    slots = sorted(os.path.basename(queue.get(timeout=10)) for _ in workers)
+    release.set()
+    for worker in workers:
+        worker.join(10)
+    assert slots == ["worker-0", "worker-1", "worker-2"]
@@ -1,10 +1,8 @@
 from flask_restful import Resource, abort, request
 from celery_module.tasks import printHello
-from opentelemetry import trace, propagate
 from loguru import logger
 # from decorators import trace_function
-import json
-import requests
+from common.http_client import client as http_client
 
 class HelloHandler(Resource):
     # @trace_function("sumHelper")
@@ -18,24 +16,17 @@ class HelloHandler(Resource):
             a = self.sumHelper()
             task_payload = {'x': a[0], 'y': a[1]}
 
-            # trace_context = {}
-            # propagate.inject(trace_context)
-
+            # The trace context travels in the Celery message headers
             full_payload = {
                 'task_payload': task_payload,
-                # 'trace_context': trace_context,
                 'name': "abc"
             }
-            logger.info(f"Sending payload to queue -> {full_payload}")
+            logger.info("Sending payload to queue", payload=full_payload)
             printHello.delay(full_payload)
             url = "http://127.0.0.1:8081/test"
 
-            payload = json.dumps(full_payload)
-            headers = {
-            'Content-Type': 'application/json'
-            }
-
-            response = requests.request("POST", url, headers=headers, data=payload)
+            # Pooled keep-alive connection, trace headers injected once
+            response = http_client.post(url, json=full_payload)
 
             return response.text
             # return "Hello, World!"
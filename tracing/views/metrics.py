@@ -0,0 +1,13 @@
+from flask import Response
+from flask_restful import Resource
+from common.metrics import CONTENT_TYPE, REGISTRY
+
+
+class MetricsHandler(Resource):
+
+    def get(self):
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+    @staticmethod
+    def init(api):
+        api.add_resource(MetricsHandler, '/metrics')
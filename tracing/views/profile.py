@@ -0,0 +1,18 @@
+from flask import Response, request
+from flask_restful import Resource
+from common.profiler import current_profiler
+
+
+class ProfileHandler(Resource):
+    # Collapsed stacks from the span profiler (TRACING_PROFILER_HZ), all
+    # routes and tasks or one with ?name=<root span name>
+
+    def get(self):
+        profiler = current_profiler()
+        if profiler is None:
+            return {"error": "profiler not enabled"}, 404
+        return Response(profiler.collapsed(request.args.get("name")), content_type="text/plain; charset=utf-8")
+
+    @staticmethod
+    def init(api):
+        api.add_resource(ProfileHandler, '/debug/profile')
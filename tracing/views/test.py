@@ -1,17 +1,9 @@
 from flask_restful import Resource, abort, request
 from opentelemetry import trace, propagate
 from loguru import logger
+from werkzeug.exceptions import HTTPException
 # from decorators import trace_function
-import json
-
-def json_parse(obj_str=None):
-	if obj_str is not None and isinstance(obj_str, (str, bytes, bytearray)) and len(obj_str.strip())>0:
-		try:
-			return json.loads(obj_str)
-		except Exception:
-			return None
-	else:
-		return None
+from common.request_body import read_json, summarize
 
 class TestHandler(Resource):
 
@@ -19,13 +11,16 @@ class TestHandler(Resource):
     # @trace_function("get_test")
     def post(self):
         try:
-            a = json_parse(request.data)
-            logger.info(f"Getting payload to test  -> {a}")
+            # Streamed under a size cap: 413 when too large, 400 when malformed
+            a, size = read_json()
+            logger.info("Getting payload to test", payload=summarize(a, size))
             return "Test, World!"
+        except HTTPException:
+            raise
         except Exception as error:
             logger.error(str(error))
             return "Test, World!"
-        
+
     @staticmethod
     def init(api):
         api.add_resource(TestHandler, '/test')